@@ -1,144 +1,108 @@
-import pkg from "hardhat";
-const { ethers } = pkg;
-import fs from "fs";
-import path from "path";
-import { fileURLToPath } from "url";
-import crypto from "crypto";
+import { ethers } from "ethers";
 import "dotenv/config";
-
-const __filename = fileURLToPath(import.meta.url);
-const __dirname = path.dirname(__filename);
+import { appendThreatRecords, connectThreatChain, errorReason, threatHashFor } from "./threatChain.js";
 
 /**
- * Log a threat to the ThreatChain smart contract
- * Called by detector-py service when a user reaches malicious threat level
- * Usage: node logThreat.js <userId>
+ * Log threats to the ThreatChain smart contract
+ * Called by detector-py's threat outbox when users reach malicious threat level
+ * Usage: node logThreat.js <userId> [<userId> ...]
+ *
+ * Several userIds can be passed in one invocation so the detector pays the
+ * Node start-up, ABI load and RPC connection once per batch. For every user a
+ * machine-readable result line is printed:
+ *   THREAT_LOGGED <userId> <txHash>
+ *   THREAT_FAILED <userId> <reason>
+ * The exit code is 0 only if every user was logged.
+ *
+ * For a steady stream of threats run threatSidecar.js instead, which keeps
+ * the connection and nonce state warm between batches.
  */
 async function main() {
-  const userId = process.argv[2];
+  const userIds = process.argv.slice(2);
   
-  if (!userId) {
+  if (userIds.length === 0) {
     console.error("❌ Error: userId argument required");
-    console.error("Usage: node logThreat.js <userId>");
+    console.error("Usage: node logThreat.js <userId> [<userId> ...]");
     process.exit(1);
   }
 
   try {
-    console.log(`\n📝 Logging threat for user: ${userId}`);
-
-    // --- Get Signer ---
-    // Use the private key from .env file
-    const privateKey = process.env.PRIVATE_KEY;
-    if (!privateKey) {
-        console.error("❌ Error: PRIVATE_KEY not found in .env file.");
-        process.exit(1);
-    }
-    // Connect to the RPC URL from .env
-    const rpcUrl = process.env.BLOCKCHAIN_RPC_URL || "http://127.0.0.1:8545";
-    const provider = new ethers.JsonRpcProvider(rpcUrl);
-    const signer = new ethers.Wallet(privateKey, provider);
-    
+    console.log(`\n📝 Logging threats for ${userIds.length} user(s): ${userIds.join(", ")}`);
+
+    // Signer from PRIVATE_KEY, contract from deployments.json and the ABI
+    const { wallet: signer, rpcUrl, contractAddress, abi } = connectThreatChain();
     console.log(`✓ Using account: ${signer.address}`);
     console.log(`✓ Connected to RPC: ${rpcUrl}`);
-
-    // --- Load Deployment Info ---
-    const deploymentsFile = path.join(__dirname, "..", "deployments.json");
-    if (!fs.existsSync(deploymentsFile)) {
-      console.error("❌ Error: deployments.json not found. Please run deploy.js first.");
-      process.exit(1);
-    }
-
-    const deployments = JSON.parse(fs.readFileSync(deploymentsFile, "utf8"));
-    // Use 'hardhat' network as per user's .env, fallback to localhost
-    const deployment = deployments["hardhat"] || deployments["localhost"];
-
-    if (!deployment) {
-      console.error(`❌ Error: No deployment found for 'hardhat' or 'localhost'`);
-      process.exit(1);
-    }
-
-    const contractAddress = process.env.BLOCKCHAIN_CONTRACT_ADDRESS || deployment.contractAddress;
     console.log(`✓ Contract address: ${contractAddress}`);
 
-    // --- Load ABI ---
-    const abiFile = path.join(__dirname, "..", "ThreatChain.abi.json");
-    if (!fs.existsSync(abiFile)) {
-      console.error("❌ Error: ThreatChain.abi.json not found");
-      process.exit(1);
-    }
-
-    const abi = JSON.parse(fs.readFileSync(abiFile, "utf8"));
-
     // Create contract instance
     const contract = new ethers.Contract(contractAddress, abi, signer);
 
-    // Create threat hash
-    const threatData = {
-      userId,
-      timestamp: new Date().toISOString(),
-      detected_at: Math.floor(Date.now() / 1000)
-    };
-    const threatHash = crypto
-      .createHash("sha256")
-      .update(JSON.stringify(threatData))
-      .digest("hex");
-
-    console.log(`✓ Threat hash: 0x${threatHash}`);
-
-    // Log threat to blockchain
-    console.log("⏳ Submitting transaction to blockchain...");
-    const tx = await contract.logThreat(
-      userId,                          // threatId (string)
-      `0x${threatHash}`,              // threatHash (bytes32)
-      `0.0.0.0`,                      // ipAddress (will be hashed by contract)
-      3                               // severity: CRITICAL (as score is >= 0.95)
-    );
-
-    console.log(`📋 Transaction hash: ${tx.hash}`);
-
-    // Wait for transaction confirmation
-    console.log("⏳ Waiting for confirmation...");
-    const receipt = await tx.wait();
-
-    console.log(`✅ Threat logged successfully!`);
-    console.log(`📦 Block number: ${receipt.blockNumber}`);
-    console.log(`⛽ Gas used: ${receipt.gasUsed.toString()}`);
-
-    // --- FIXED PATH ---
-    // Save threat record to file for gateway access
-    // This now correctly points to /sentinel-v1/blockchain/threat_records.json
-    const threatRecordsPath = path.join(__dirname, "..", "threat_records.json");
-    
-    const threatRecord = {
-      userId,
-      threatHash: `0x${threatHash}`,
-      blockNumber: receipt.blockNumber,
-      transactionHash: tx.hash,
-      timestamp: new Date().toISOString(),
-      severity: "CRITICAL" // Match the severity we sent
-    };
-
-    // Read existing records or create new array
-    let records = [];
-    if (fs.existsSync(threatRecordsPath)) {
+    const newRecords = [];
+    let failures = 0;
+
+    for (const userId of userIds) {
       try {
-        const existing = fs.readFileSync(threatRecordsPath, "utf8");
-        records = JSON.parse(existing);
-      } catch (e) {
-        console.warn("Could not parse existing threat_records.json, starting new.");
-        records = [];
+        // Retries from the detector's outbox must be idempotent: the contract
+        // rejects a threatId that was already logged.
+        if (await contract.isThreatLogged(userId)) {
+          console.log(`✓ Threat for ${userId} already on chain, skipping`);
+          console.log(`THREAT_LOGGED ${userId} already-logged`);
+          continue;
+        }
+
+        // Create threat hash
+        const threatHash = threatHashFor(userId);
+
+        console.log(`✓ Threat hash for ${userId}: ${threatHash}`);
+
+        // Log threat to blockchain
+        console.log("⏳ Submitting transaction to blockchain...");
+        const tx = await contract.logThreat(
+          userId,                          // threatId (string)
+          threatHash,                     // threatHash (bytes32)
+          `0.0.0.0`,                      // ipAddress (will be hashed by contract)
+          3                               // severity: CRITICAL (as score is >= 0.95)
+        );
+
+        console.log(`📋 Transaction hash: ${tx.hash}`);
+
+        // Wait for transaction confirmation
+        console.log("⏳ Waiting for confirmation...");
+        const receipt = await tx.wait();
+
+        console.log(`✅ Threat logged successfully!`);
+        console.log(`📦 Block number: ${receipt.blockNumber}`);
+        console.log(`⛽ Gas used: ${receipt.gasUsed.toString()}`);
+
+        newRecords.push({
+          userId,
+          threatHash,
+          blockNumber: receipt.blockNumber,
+          transactionHash: tx.hash,
+          timestamp: new Date().toISOString(),
+          severity: "CRITICAL" // Match the severity we sent
+        });
+        console.log(`THREAT_LOGGED ${userId} ${tx.hash}`);
+
+      } catch (error) {
+        failures += 1;
+        console.error(`❌ Error logging ${userId}:`, error.message);
+        if (error.code === 'CALL_EXCEPTION') {
+            console.error("CALL_EXCEPTION: Check if the contract is deployed at the correct address and network.");
+        }
+        console.log(`THREAT_FAILED ${userId} ${errorReason(error)}`);
       }
     }
 
-    // Add new record
-    records.push(threatRecord);
-
-    // Write updated records
-    fs.writeFileSync(threatRecordsPath, JSON.stringify(records, null, 2));
-    console.log(`✓ Threat record saved to ${threatRecordsPath}`);
+    // Save threat records to file for gateway access
+    if (newRecords.length > 0) {
+      const threatRecordsPath = appendThreatRecords(newRecords);
+      console.log(`✓ ${newRecords.length} threat record(s) saved to ${threatRecordsPath}`);
+    }
 
     console.log("\n✨ Threat logging complete!\n");
-    process.exit(0);
+    process.exit(failures === 0 ? 0 : 1);
 
   } catch (error) {
     console.error("❌ Error:", error.message);
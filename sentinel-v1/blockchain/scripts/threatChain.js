@@ -0,0 +1,84 @@
+import { ethers } from "ethers";
+import fs from "fs";
+import path from "path";
+import { fileURLToPath } from "url";
+import crypto from "crypto";
+
+const __filename = fileURLToPath(import.meta.url);
+const __dirname = path.dirname(__filename);
+
+const BLOCKCHAIN_DIR = path.join(__dirname, "..");
+const THREAT_RECORDS_PATH = path.join(BLOCKCHAIN_DIR, "threat_records.json");
+
+/**
+ * Shared ThreatChain setup for logThreat.js and threatSidecar.js
+ *
+ * Builds the provider, signer and contract instance from the .env settings,
+ * deployments.json and ThreatChain.abi.json. Throws with a readable message
+ * when a piece is missing.
+ */
+export function connectThreatChain({ rpcUrl = process.env.BLOCKCHAIN_RPC_URL || "http://127.0.0.1:8545" } = {}) {
+  const privateKey = process.env.PRIVATE_KEY;
+  if (!privateKey) {
+    throw new Error("PRIVATE_KEY not found in .env file.");
+  }
+  const provider = new ethers.JsonRpcProvider(rpcUrl);
+  const wallet = new ethers.Wallet(privateKey, provider);
+
+  const deploymentsFile = path.join(BLOCKCHAIN_DIR, "deployments.json");
+  if (!fs.existsSync(deploymentsFile)) {
+    throw new Error("deployments.json not found. Please run deploy.js first.");
+  }
+  const deployments = JSON.parse(fs.readFileSync(deploymentsFile, "utf8"));
+  // Use 'hardhat' network as per user's .env, fallback to localhost
+  const deployment = deployments["hardhat"] || deployments["localhost"];
+  if (!deployment) {
+    throw new Error("No deployment found for 'hardhat' or 'localhost'");
+  }
+  const contractAddress = process.env.BLOCKCHAIN_CONTRACT_ADDRESS || deployment.contractAddress;
+
+  const abiFile = path.join(BLOCKCHAIN_DIR, "ThreatChain.abi.json");
+  if (!fs.existsSync(abiFile)) {
+    throw new Error("ThreatChain.abi.json not found");
+  }
+  const abi = JSON.parse(fs.readFileSync(abiFile, "utf8"));
+
+  return { provider, wallet, rpcUrl, contractAddress, abi };
+}
+
+/**
+ * SHA-256 of the threat details, as the bytes32 the contract stores
+ */
+export function threatHashFor(userId) {
+  const threatData = {
+    userId,
+    timestamp: new Date().toISOString(),
+    detected_at: Math.floor(Date.now() / 1000)
+  };
+  return `0x${crypto.createHash("sha256").update(JSON.stringify(threatData)).digest("hex")}`;
+}
+
+/**
+ * Append records to threat_records.json for gateway access
+ */
+export function appendThreatRecords(newRecords) {
+  if (newRecords.length === 0) return THREAT_RECORDS_PATH;
+
+  // Read existing records or create new array
+  let records = [];
+  if (fs.existsSync(THREAT_RECORDS_PATH)) {
+    try {
+      records = JSON.parse(fs.readFileSync(THREAT_RECORDS_PATH, "utf8"));
+    } catch (e) {
+      console.warn("Could not parse existing threat_records.json, starting new.");
+      records = [];
+    }
+  }
+  records.push(...newRecords);
+  fs.writeFileSync(THREAT_RECORDS_PATH, JSON.stringify(records, null, 2));
+  return THREAT_RECORDS_PATH;
+}
+
+export function errorReason(error) {
+  return (error.shortMessage || error.message || "error").replace(/\s+/g, " ");
+}
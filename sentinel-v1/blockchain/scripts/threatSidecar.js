@@ -0,0 +1,228 @@
+import { ethers } from "ethers";
+import net from "net";
+import fs from "fs";
+import "dotenv/config";
+import { appendThreatRecords, connectThreatChain, errorReason, threatHashFor } from "./threatChain.js";
+
+/**
+ * Long-lived threat logger for detector-py's threat outbox
+ * Usage: node threatSidecar.js [address]
+ *
+ * logThreat.js pays Node start-up, ABI and deployment loading, the RPC
+ * connection and a nonce lookup on every batch. The sidecar does that once
+ * and then serves batches over a local socket, so a batch costs about one
+ * RPC round trip per transaction plus the confirmation wait.
+ *
+ * Address (argument or THREAT_SIDECAR_ADDR): host:port, or a Unix socket
+ * path. Default 127.0.0.1:8547.
+ *
+ * Protocol: one JSON object per line in each direction.
+ *   -> {"id": 1, "userIds": ["u1", "u2"]}
+ *   <- {"id": 1, "results": {"u1": {"txHash": "0x..."}, "u2": {"error": "..."}}}
+ *   -> {"id": 2, "op": "ping"}
+ *   <- {"id": 2, "ok": true, "account": "0x...", "contract": "0x..."}
+ *
+ * The contract logs one threat per call, so a batch is sent as pipelined
+ * transactions: nonces are assigned locally (ethers NonceManager), every
+ * transaction is submitted before any confirmation is awaited, and the next
+ * batch can be submitted while the previous one confirms. A user that is
+ * still being logged by an earlier batch is not sent again: the later batch
+ * reports the earlier one's result.
+ */
+const DEFAULT_ADDRESS = "127.0.0.1:8547";
+
+function parseAddress(address) {
+  const match = /^([^/\\]*):(\d+)$/.exec(address);
+  if (match) return { host: match[1] || "127.0.0.1", port: parseInt(match[2], 10) };
+  return { path: address };
+}
+
+class ThreatSidecar {
+  constructor() {
+    const { wallet, rpcUrl, contractAddress, abi } = connectThreatChain();
+    this.rpcUrl = rpcUrl;
+    this.contractAddress = contractAddress;
+    this.signer = new ethers.NonceManager(wallet);
+    this.contract = new ethers.Contract(contractAddress, abi, this.signer);
+    this.account = wallet.address;
+    // Submissions are serialized so nonces go out in order; confirmations overlap
+    this.submitting = Promise.resolve();
+    // userId -> Promise of its result while a batch is logging it
+    this.inFlight = new Map();
+    this.logged = 0;
+    this.failed = 0;
+  }
+
+  async logThreats(userIds) {
+    const results = {};
+    const joined = [];
+    const own = [];
+    // A user already being logged by another batch (the detector retried
+    // before that batch answered) waits for that batch's result instead of
+    // sending a second transaction, which the contract would reject.
+    for (const userId of userIds) {
+      const inFlight = this.inFlight.get(userId);
+      if (inFlight) joined.push(inFlight.then((result) => { results[userId] = result; }));
+      else own.push(userId);
+    }
+    const sent = this.sendThreats(own);
+    for (const userId of own) {
+      const result = sent.then((sentResults) => sentResults[userId], (error) => ({ error: errorReason(error) }));
+      this.inFlight.set(userId, result);
+      result.finally(() => this.inFlight.delete(userId));
+    }
+
+    const sentResults = await sent.catch((error) => Object.fromEntries(
+      own.map((userId) => [userId, { error: errorReason(error) }])));
+    Object.assign(results, sentResults);
+    await Promise.all(joined);
+    return results;
+  }
+
+  async sendThreats(userIds) {
+    const results = {};
+    const pending = [];
+    if (userIds.length === 0) return results;
+
+    // Retries from the detector's outbox must be idempotent: the contract
+    // rejects a threatId that was already logged.
+    const logged = await Promise.all(userIds.map((userId) =>
+      this.contract.isThreatLogged(userId).catch((error) => error)));
+    const toSend = [];
+    userIds.forEach((userId, i) => {
+      if (logged[i] instanceof Error) results[userId] = { error: errorReason(logged[i]) };
+      else if (logged[i]) results[userId] = { txHash: "already-logged" };
+      else toSend.push(userId);
+    });
+
+    const submitted = this.submitting.then(async () => {
+      for (const userId of toSend) {
+        const threatHash = threatHashFor(userId);
+        try {
+          const tx = await this.contract.logThreat(
+            userId,      // threatId (string)
+            threatHash,  // threatHash (bytes32)
+            `0.0.0.0`,   // ipAddress (will be hashed by contract)
+            3            // severity: CRITICAL (as score is >= 0.95)
+          );
+          pending.push({ userId, threatHash, tx });
+        } catch (error) {
+          // The failed send may have consumed a local nonce: ask the node again
+          this.signer.reset();
+          results[userId] = await this.failureResult(userId, error);
+        }
+      }
+    });
+    this.submitting = submitted.catch(() => {});
+    await submitted;
+
+    const newRecords = [];
+    await Promise.all(pending.map(async ({ userId, threatHash, tx }) => {
+      try {
+        const receipt = await tx.wait();
+        newRecords.push({
+          userId,
+          threatHash,
+          blockNumber: receipt.blockNumber,
+          transactionHash: tx.hash,
+          timestamp: new Date().toISOString(),
+          severity: "CRITICAL" // Match the severity we sent
+        });
+        results[userId] = { txHash: tx.hash };
+      } catch (error) {
+        results[userId] = await this.failureResult(userId, error);
+      }
+    }));
+
+    if (newRecords.length > 0) appendThreatRecords(newRecords);
+    for (const result of Object.values(results)) {
+      if (result.error) this.failed += 1;
+      else this.logged += 1;
+    }
+    console.log(`✓ Batch of ${userIds.length}: ${newRecords.length} logged, `
+      + `${Object.values(results).filter((r) => r.error).length} failed`);
+    return results;
+  }
+
+  async failureResult(userId, error) {
+    // Reverted because the threat got logged in the meantime (e.g. by
+    // logThreat.js or another sidecar): the outbox entry is done
+    const logged = await this.contract.isThreatLogged(userId).catch(() => false);
+    return logged ? { txHash: "already-logged" } : { error: errorReason(error) };
+  }
+
+  async handle(request) {
+    if (request.op === "ping") {
+      return { ok: true, account: this.account, contract: this.contractAddress,
+        logged: this.logged, failed: this.failed };
+    }
+    if (!Array.isArray(request.userIds)) {
+      return { error: "userIds must be an array" };
+    }
+    return { results: await this.logThreats([...new Set(request.userIds.map(String))]) };
+  }
+
+  serve(address) {
+    const target = parseAddress(address);
+    if (target.path && fs.existsSync(target.path)) {
+      // Stale socket left by a previous run
+      fs.unlinkSync(target.path);
+    }
+
+    const server = net.createServer((socket) => {
+      socket.setEncoding("utf8");
+      let buffer = "";
+      socket.on("data", (chunk) => {
+        buffer += chunk;
+        let end;
+        while ((end = buffer.indexOf("\n")) !== -1) {
+          const line = buffer.slice(0, end).trim();
+          buffer = buffer.slice(end + 1);
+          if (!line) continue;
+          let request;
+          try {
+            request = JSON.parse(line);
+          } catch (error) {
+            socket.write(JSON.stringify({ id: null, error: "invalid JSON" }) + "\n");
+            continue;
+          }
+          this.handle(request)
+            .catch((error) => ({ error: errorReason(error) }))
+            .then((response) => {
+              if (!socket.destroyed) socket.write(JSON.stringify({ id: request.id ?? null, ...response }) + "\n");
+            });
+        }
+      });
+      socket.on("error", (error) => console.error("Sidecar client error:", error.message));
+    });
+
+    server.listen(target, () => {
+      console.log(`✓ Threat sidecar listening on ${address}`);
+    });
+    const shutdown = () => {
+      console.log("Threat sidecar stopping");
+      server.close(() => process.exit(0));
+      setTimeout(() => process.exit(0), 5000).unref();
+    };
+    process.on("SIGINT", shutdown);
+    process.on("SIGTERM", shutdown);
+    return server;
+  }
+}
+
+async function main() {
+  const address = process.argv[2] || process.env.THREAT_SIDECAR_ADDR || DEFAULT_ADDRESS;
+  try {
+    const sidecar = new ThreatSidecar();
+    const network = await sidecar.signer.provider.getNetwork();
+    console.log(`✓ Using account: ${sidecar.account}`);
+    console.log(`✓ Connected to RPC: ${sidecar.rpcUrl} (chain ${network.chainId})`);
+    console.log(`✓ Contract address: ${sidecar.contractAddress}`);
+    sidecar.serve(address);
+  } catch (error) {
+    console.error("❌ Error:", error.message);
+    process.exit(1);
+  }
+}
+
+main();
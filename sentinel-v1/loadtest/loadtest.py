@@ -0,0 +1,419 @@
+"""
+Load test for the wrappers and detector services.
+
+Drives POST /get_noisy_response with an open-loop arrival schedule and
+calls POST /run_analysis on a fixed interval, the way the gateway's sweep
+does, then reports:
+    - requests/s offered and achieved per endpoint
+    - latency percentiles and a latency histogram per endpoint
+    - schedule lag (how late requests left the client; a growing lag means
+      the load generator itself is saturated and latencies understate)
+    - time-to-detect per profile: seconds from a user's first request until
+      the detector scores it Suspicious (tier 2) and Malicious (tier 3),
+      and how many benign users were flagged
+
+Users are drawn from the detector benchmarks' traffic profiles (people,
+attacker-demo style counter bots, template bots, paraphrasing bots). Each
+user sends Poisson arrivals at its profile's rate from a random start in the
+ramp-up period. Arrivals are not held back by slow responses (open loop); at
+most --max-in-flight requests are outstanding, the rest count as dropped.
+
+By default both services run in this process behind httpx's ASGI transport,
+with their lifespans started, against one shared mongomock database, so the
+test runs offline on one machine. --mongo-uri uses a local mongod instead.
+--transport http sends requests over loopback to running services
+(--wrappers-url, --detector-url); --mongo-uri must then name their database.
+
+The harness plays the gateway: it creates the users documents the detector
+updates. Threats the detector flags are recorded instead of being sent to
+the blockchain.
+
+Usage (from sentinel-v1):
+    python loadtest/loadtest.py --duration 60 --mix human=200,counter_bot=5,template_bot=5,paraphrase_bot=5
+    python loadtest/loadtest.py --duration 120 --rate human=0.1 --analysis-interval 5 --out run.json
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parent.parent
+DETECTOR_DIR = ROOT / "services" / "detector-py"
+WRAPPERS_DIR = ROOT / "services" / "wrappers-py"
+sys.path.insert(0, str(DETECTOR_DIR / "benchmarks"))
+
+from traffic import PROFILES  # noqa: E402
+
+DEFAULT_MIX = "human=200,counter_bot=5,template_bot=5,paraphrase_bot=5"
+# Requests per second per user: people a few prompts a minute, bots flat out
+DEFAULT_RATES = {"human": 0.05, "counter_bot": 1.0, "template_bot": 1.0, "paraphrase_bot": 0.5, "mixed": 0.5}
+BENIGN_PROFILES = {"human"}
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+TIER_SUSPICIOUS = 2
+TIER_MALICIOUS = 3
+
+
+def parse_pairs(text: str, cast) -> dict:
+    """'a=1,b=2' -> {'a': cast('1'), 'b': cast('2')}"""
+    pairs = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, value = item.partition("=")
+        if name not in PROFILES:
+            raise SystemExit(f"Unknown profile {name!r}; choose from {', '.join(PROFILES)}")
+        pairs[name] = cast(value)
+    return pairs
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def histogram(latencies_ms) -> dict:
+    counts = {f"<={bound}ms": 0 for bound in LATENCY_BUCKETS_MS}
+    counts["inf"] = 0
+    for latency in latencies_ms:
+        for bound in LATENCY_BUCKETS_MS:
+            if latency <= bound:
+                counts[f"<={bound}ms"] += 1
+                break
+        else:
+            counts["inf"] += 1
+    return counts
+
+
+def build_schedule(mix: dict, rates: dict, duration: float, ramp: float, seed: int):
+    """
+    Open-loop arrivals for every user.
+
+    Returns:
+        (users, arrivals): users maps userId -> profile; arrivals is a
+        time-sorted list of (offset seconds, userId, prompt)
+    """
+    rng = random.Random(seed)
+    users = {}
+    arrivals = []
+    for profile, count in mix.items():
+        rate = rates.get(profile, DEFAULT_RATES.get(profile, 0.1))
+        for index in range(count):
+            user_id = f"loadtest-{profile}-{index}"
+            users[user_id] = profile
+            times = []
+            at = rng.random() * ramp
+            while rate > 0 and at < duration:
+                times.append(at)
+                at += rng.expovariate(rate)
+            for at, prompt in zip(times, PROFILES[profile](len(times), rng)):
+                arrivals.append((at, user_id, prompt))
+    arrivals.sort(key=lambda arrival: arrival[0])
+    return users, arrivals
+
+
+class EndpointStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies_ms = []
+        self.lag_ms = []
+        self.statuses = {}
+        self.errors = 0
+        self.dropped = 0
+
+    def record(self, status, latency_ms: float, lag_ms: float = None) -> None:
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status != 200:
+            self.errors += 1
+        self.latencies_ms.append(latency_ms)
+        if lag_ms is not None:
+            self.lag_ms.append(lag_ms)
+
+    def report(self, elapsed: float, offered: int = None) -> dict:
+        sent = len(self.latencies_ms)
+        return {
+            "endpoint": self.name,
+            "offered": offered if offered is not None else sent,
+            "sent": sent,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items(), key=str)},
+            "offered_rps": (offered if offered is not None else sent) / elapsed if elapsed else None,
+            "achieved_rps": (sent - self.errors) / elapsed if elapsed else None,
+            "latency_ms": {
+                "p50": percentile(self.latencies_ms, 50),
+                "p90": percentile(self.latencies_ms, 90),
+                "p99": percentile(self.latencies_ms, 99),
+                "max": max(self.latencies_ms) if self.latencies_ms else None,
+            },
+            "schedule_lag_ms": {
+                "p50": percentile(self.lag_ms, 50),
+                "p99": percentile(self.lag_ms, 99),
+                "max": max(self.lag_ms) if self.lag_ms else None,
+            } if self.lag_ms else None,
+            "histogram": histogram(self.latencies_ms),
+        }
+
+
+class RecordingThreatSink:
+    """Stands in for the blockchain logger: accepts every threat and notes when."""
+
+    def __init__(self):
+        self.logged = {}
+
+    async def log_threats(self, user_ids: list) -> dict:
+        now = time.perf_counter()
+        for user_id in user_ids:
+            self.logged.setdefault(user_id, now)
+        return {user_id: None for user_id in user_ids}
+
+
+def load_services(mongo_uri: str, db_name: str):
+    """
+    Import both FastAPI apps in this process, sharing one database.
+
+    The detector is imported as `app`, its own package name, because its
+    scoring worker processes import it by that name. The wrappers service
+    also calls its package `app`, so it is loaded under another name.
+    """
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["MONGODB_URI"] = os.environ["MONGO_URI"] = mongo_uri or "mongodb://localhost:27017/loadtest"
+    os.environ["DB_NAME"] = db_name
+    os.environ.setdefault("LOG_SPOOL_DIR", tempfile.mkdtemp(prefix="sentinel-loadtest-spool-"))
+
+    if mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+
+    with mock.patch("pymongo.MongoClient", lambda *args, **kwargs: client):
+        sys.path.insert(0, str(DETECTOR_DIR))
+        import app.main as detector
+
+        spec = importlib.util.spec_from_file_location(
+            "sentinel_wrappers", WRAPPERS_DIR / "app" / "__init__.py",
+            submodule_search_locations=[str(WRAPPERS_DIR / "app")]
+        )
+        package = importlib.util.module_from_spec(spec)
+        sys.modules["sentinel_wrappers"] = package
+        spec.loader.exec_module(package)
+        import sentinel_wrappers.main as wrappers
+
+    detector.threat_outbox.sink = RecordingThreatSink()
+    return detector, wrappers, client[db_name]
+
+
+class LoadTest:
+    def __init__(self, args, database, wrappers_client, detector_client, get_tier, threat_sink=None):
+        self.args = args
+        self.database = database
+        self.wrappers = wrappers_client
+        self.detector = detector_client
+        self.get_tier = get_tier
+        self.threat_sink = threat_sink
+        self.prompt_stats = EndpointStats("POST /get_noisy_response")
+        self.analysis_stats = EndpointStats("POST /run_analysis")
+        self.first_request = {}
+        self.detected = {TIER_SUSPICIOUS: {}, TIER_MALICIOUS: {}}
+        self.in_flight = 0
+
+    async def send_prompt(self, scheduled: float, user_id: str, prompt: str) -> None:
+        started = time.perf_counter()
+        self.first_request.setdefault(user_id, started)
+        try:
+            response = await self.wrappers.post("/get_noisy_response", json={"userId": user_id, "prompt": prompt},
+                                                timeout=self.args.timeout)
+            status = response.status_code
+        except Exception as e:
+            status = type(e).__name__
+        finally:
+            self.in_flight -= 1
+        self.prompt_stats.record(status, (time.perf_counter() - started) * 1000, (started - scheduled) * 1000)
+
+    async def generate(self, arrivals, origin: float) -> None:
+        tasks = set()
+        for offset, user_id, prompt in arrivals:
+            scheduled = origin + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.in_flight >= self.args.max_in_flight:
+                self.prompt_stats.dropped += 1
+                continue
+            self.in_flight += 1
+            task = asyncio.create_task(self.send_prompt(scheduled, user_id, prompt))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def analyze(self, users: dict, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                response = await self.detector.post("/run_analysis", timeout=self.args.timeout)
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            self.analysis_stats.record(status, (time.perf_counter() - started) * 1000)
+            await asyncio.to_thread(self.check_detections, users)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.args.analysis_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def check_detections(self, users: dict) -> None:
+        now = time.perf_counter()
+        pending = [user_id for user_id in users
+                   if user_id in self.first_request and user_id not in self.detected[TIER_MALICIOUS]]
+        if not pending:
+            return
+        for user in self.database["users"].find({"userId": {"$in": pending}}, {"userId": 1, "suspicion_score": 1}):
+            tier = self.get_tier(user.get("suspicion_score", 0.0))
+            for level in (TIER_SUSPICIOUS, TIER_MALICIOUS):
+                if tier >= level:
+                    self.detected[level].setdefault(user["userId"], now)
+
+    async def run(self, users: dict, arrivals: list) -> dict:
+        # The gateway creates a users document before a user's first prompt
+        self.database["users"].insert_many([
+            {"userId": user_id, "apiKey": None, "suspicion_score": 0.0, "is_human_verified": False}
+            for user_id in users
+        ])
+        stop = asyncio.Event()
+        origin = time.perf_counter()
+        analyzer = asyncio.create_task(self.analyze(users, stop))
+        await self.generate(arrivals, origin)
+        # Let the detector catch up on the last prompts before stopping
+        await asyncio.sleep(self.args.drain)
+        stop.set()
+        await analyzer
+        elapsed = time.perf_counter() - origin
+        return self.report(users, len(arrivals), elapsed)
+
+    def report(self, users: dict, offered: int, elapsed: float) -> dict:
+        detection = {}
+        for profile in sorted(set(users.values())):
+            members = [user_id for user_id, user_profile in users.items()
+                       if user_profile == profile and user_id in self.first_request]
+            row = {"users": len(members)}
+            for level, label in ((TIER_SUSPICIOUS, "suspicious"), (TIER_MALICIOUS, "malicious")):
+                delays = [self.detected[level][user_id] - self.first_request[user_id]
+                          for user_id in members if user_id in self.detected[level]]
+                row[label] = {
+                    "detected": len(delays),
+                    "p50_seconds": percentile(delays, 50),
+                    "max_seconds": max(delays) if delays else None,
+                }
+            if self.threat_sink is not None:
+                row["threats_logged"] = sum(1 for user_id in members if user_id in self.threat_sink.logged)
+            row["benign"] = profile in BENIGN_PROFILES
+            detection[profile] = row
+        return {
+            "duration_seconds": elapsed,
+            "transport": self.args.transport,
+            "mongo": "mongod" if self.args.mongo_uri else "mongomock",
+            "endpoints": [self.prompt_stats.report(elapsed, offered), self.analysis_stats.report(elapsed)],
+            "detection": detection,
+        }
+
+
+def print_report(report: dict) -> None:
+    print(f"\n{report['duration_seconds']:.1f}s, {report['transport']} transport, {report['mongo']}")
+    print(f"{'endpoint':<28}{'sent':>8}{'drop':>6}{'err':>6}{'req/s':>9}{'p50 ms':>9}{'p90 ms':>9}"
+          f"{'p99 ms':>9}{'max ms':>9}")
+    for row in report["endpoints"]:
+        latency = row["latency_ms"]
+        cells = [latency[key] for key in ("p50", "p90", "p99", "max")]
+        print(f"{row['endpoint']:<28}{row['sent']:>8}{row['dropped']:>6}{row['errors']:>6}"
+              f"{row['achieved_rps'] or 0:>9.1f}" + "".join(f"{cell or 0:>9.1f}" for cell in cells))
+        if row["schedule_lag_ms"]:
+            print(f"{'':<28}schedule lag p99 {row['schedule_lag_ms']['p99']:.1f} ms")
+        buckets = [f"{bucket}:{count}" for bucket, count in row["histogram"].items() if count]
+        print(f"{'':<28}{' '.join(buckets)}")
+
+    print(f"\n{'profile':<16}{'users':>6}{'tier2':>7}{'p50 s':>8}{'max s':>8}{'tier3':>7}{'p50 s':>8}{'max s':>8}")
+    for profile, row in report["detection"].items():
+        cells = []
+        for label in ("suspicious", "malicious"):
+            level = row[label]
+            cells.append(f"{level['detected']:>7}{level['p50_seconds'] or 0:>8.1f}{level['max_seconds'] or 0:>8.1f}")
+        note = "  (false positives)" if row["benign"] and row["suspicious"]["detected"] else ""
+        print(f"{profile:<16}{row['users']:>6}" + "".join(cells) + note)
+
+
+async def run(args) -> dict:
+    import httpx
+
+    mix = parse_pairs(args.mix, int)
+    rates = {**DEFAULT_RATES, **parse_pairs(args.rate, float)}
+    users, arrivals = build_schedule(mix, rates, args.duration, args.ramp, args.seed)
+    print(f"{len(users)} users, {len(arrivals)} prompts over {args.duration:g}s "
+          f"({len(arrivals) / args.duration:.1f} req/s offered)", file=sys.stderr)
+
+    if args.transport == "http":
+        if not args.mongo_uri:
+            raise SystemExit("--transport http needs --mongo-uri (the services' database)")
+        from pymongo import MongoClient
+        sys.path.insert(0, str(DETECTOR_DIR))
+        from app.scoring import get_tier
+        database = MongoClient(args.mongo_uri)[args.db_name]
+        async with httpx.AsyncClient(base_url=args.wrappers_url) as wrappers_client, \
+                httpx.AsyncClient(base_url=args.detector_url) as detector_client:
+            return await LoadTest(args, database, wrappers_client, detector_client, get_tier).run(users, arrivals)
+
+    detector, wrappers, database = load_services(args.mongo_uri, args.db_name)
+    from app.scoring import get_tier
+    async with detector.app.router.lifespan_context(detector.app), \
+            wrappers.app.router.lifespan_context(wrappers.app), \
+            httpx.AsyncClient(transport=httpx.ASGITransport(app=wrappers.app), base_url="http://wrappers") \
+            as wrappers_client, \
+            httpx.AsyncClient(transport=httpx.ASGITransport(app=detector.app), base_url="http://detector") \
+            as detector_client:
+        test = LoadTest(args, database, wrappers_client, detector_client, get_tier,
+                        threat_sink=detector.threat_outbox.sink)
+        return await test.run(users, arrivals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of traffic")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Users per profile, e.g. human=200,template_bot=5")
+    parser.add_argument("--rate", default="", help="Requests/s per user by profile, e.g. human=0.1,counter_bot=2")
+    parser.add_argument("--ramp", type=float, default=10, help="Users start at random within this many seconds")
+    parser.add_argument("--analysis-interval", type=float, default=2, help="Seconds between /run_analysis calls")
+    parser.add_argument("--drain", type=float, default=5, help="Seconds of analysis after the last prompt")
+    parser.add_argument("--max-in-flight", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--transport", choices=["asgi", "http"], default="asgi")
+    parser.add_argument("--wrappers-url", default="http://127.0.0.1:8002")
+    parser.add_argument("--detector-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--mongo-uri", help="Use this mongod instead of mongomock")
+    parser.add_argument("--db-name", default="sentinel_loadtest")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Keep the services' per-request output")
+    args = parser.parse_args()
+
+    # The services print several lines per request
+    with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w")):
+        report = asyncio.run(run(args))
+    print_report(report)
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f"\nSaved {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Event-driven ingestion of query_logs through a MongoDB change stream.
+
+With the feed enabled, every insert into query_logs is handed to the scoring
+engine as soon as it is committed, so the affected user is re-scored within
+one change-stream round trip instead of waiting for the next /run_analysis
+poll. /run_analysis keeps working unchanged and acts as the reconciliation
+sweep: it expires old entries and picks up anything the stream missed.
+
+The stream's resume token is stored in the `detector_state` collection after
+every processed batch, so a restarted detector continues where it stopped,
+and a stream invalidated by dropping or renaming query_logs is reopened
+after the invalidate.
+Change streams need a replica set (a single-node one is enough); on a
+standalone mongod the feed logs a warning and the detector falls back to
+polling only.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CHANGE_STREAM_ENABLED = os.getenv("DETECTOR_CHANGE_STREAM", "0").lower() in ("1", "true", "yes")
+# Upper bound on inserts scored together; a burst is split into batches of this size
+CHANGE_STREAM_BATCH_SIZE = int(os.getenv("CHANGE_STREAM_BATCH_SIZE", "500"))
+# How long the server holds an empty getMore open. This bounds how long a
+# partially filled batch waits before it is scored.
+CHANGE_STREAM_MAX_AWAIT_MS = int(os.getenv("CHANGE_STREAM_MAX_AWAIT_MS", "100"))
+CHANGE_STREAM_RETRY_SECONDS = float(os.getenv("CHANGE_STREAM_RETRY_SECONDS", "5"))
+
+STATE_DOCUMENT_ID = "query_logs_change_stream"
+
+# With no inserts the token still advances on every getMore; persist it at most this often
+IDLE_TOKEN_SAVE_SECONDS = 30
+
+# Server error codes: the stored token cannot be resumed from
+# (InvalidResumeToken, ChangeStreamFatalError, ChangeStreamHistoryLost),
+# or change streams are not supported at all
+_RESUME_FAILED_CODES = {260, 280, 286}
+_NOT_A_REPLICA_SET = 40573
+
+# Only inserts matter, and only the fields scoring.py uses
+_PIPELINE = [
+    {"$match": {"operationType": "insert"}},
+    {"$project": {
+        "fullDocument._id": 1,
+        "fullDocument.userId": 1,
+        "fullDocument.timestamp": 1,
+        "fullDocument.prompt": 1,
+        "fullDocument.insertedAt": 1,
+    }},
+]
+
+
+class QueryLogChangeFeed:
+    """
+    Tails query_logs inserts in a background thread.
+
+    Each batch of inserted documents is passed to `handle_logs(logs)`, which
+    is expected to ingest and score them (see main.process_streamed_logs).
+    The resume token is persisted only after handle_logs returns, so a batch
+    that failed is replayed after a restart.
+    """
+
+    def __init__(self, collection, state_collection, handle_logs,
+                 batch_size: int = CHANGE_STREAM_BATCH_SIZE, max_await_ms: int = CHANGE_STREAM_MAX_AWAIT_MS):
+        self.collection = collection
+        self.state_collection = state_collection
+        self.handle_logs = handle_logs
+        self.batch_size = batch_size
+        self.max_await_ms = max_await_ms
+        # Last token persisted to detector_state
+        self.resume_token = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load_resume_token(self):
+        state = self.state_collection.find_one({"_id": STATE_DOCUMENT_ID})
+        return state.get("resume_token") if state else None
+
+    def save_resume_token(self, token) -> None:
+        self.state_collection.update_one(
+            {"_id": STATE_DOCUMENT_ID},
+            {"$set": {"resume_token": token, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="query-log-change-feed", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Signal the thread and wait for it; blocks for at most about max_await_ms plus one batch."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        self.resume_token = self.load_resume_token()
+        while not self._stop.is_set():
+            try:
+                self._consume()
+            except OperationFailure as e:
+                if e.code == _NOT_A_REPLICA_SET:
+                    logger.warning("Change streams unavailable (MongoDB is not a replica set); "
+                                   "relying on /run_analysis polling only")
+                    return
+                if self.resume_token is not None and e.code in _RESUME_FAILED_CODES:
+                    # The oplog no longer holds the token; the next sweep
+                    # covers the gap, so start from the current position.
+                    logger.warning("Stored change stream resume token is no longer valid; starting fresh")
+                    self.resume_token = None
+                    self.save_resume_token(None)
+                    continue
+                logger.exception("Change stream failed; reconnecting in %.0fs", CHANGE_STREAM_RETRY_SECONDS)
+                self._stop.wait(CHANGE_STREAM_RETRY_SECONDS)
+            except PyMongoError:
+                logger.exception("Change stream failed; reconnecting in %.0fs", CHANGE_STREAM_RETRY_SECONDS)
+                self._stop.wait(CHANGE_STREAM_RETRY_SECONDS)
+            except Exception:
+                # handle_logs failed; the batch is replayed from the last saved token
+                logger.exception("Processing streamed query logs failed; retrying in %.0fs",
+                                 CHANGE_STREAM_RETRY_SECONDS)
+                self._stop.wait(CHANGE_STREAM_RETRY_SECONDS)
+
+    def _consume(self) -> None:
+        """Read and hand off batches until stopped, resuming after self.resume_token."""
+        # start_after (unlike resume_after) also resumes past an invalidate event
+        with self.collection.watch(
+            _PIPELINE, start_after=self.resume_token, max_await_time_ms=self.max_await_ms
+        ) as stream:
+            logger.info("Watching query_logs for inserts%s", " (resumed)" if self.resume_token else "")
+            saved_at = time.monotonic()
+            while not self._stop.is_set() and stream.alive:
+                logs = []
+                while len(logs) < self.batch_size:
+                    change = stream.try_next()
+                    if change is None:
+                        break
+                    document = change.get("fullDocument")
+                    if document is not None:
+                        logs.append(document)
+
+                if logs:
+                    metrics.inc("stream_events_total", len(logs))
+                    logs.sort(key=_timestamp_sort_key)
+                    self.handle_logs(logs)
+
+                idle_save_due = time.monotonic() - saved_at >= IDLE_TOKEN_SAVE_SECONDS
+                if (logs or idle_save_due) and stream.resume_token not in (None, self.resume_token):
+                    self.resume_token = stream.resume_token
+                    self.save_resume_token(self.resume_token)
+                    saved_at = time.monotonic()
+
+            if not stream.alive and not self._stop.is_set():
+                # Invalidated (query_logs dropped or renamed): reopen after the invalidate
+                logger.warning("Change stream on query_logs was invalidated; reopening")
+                if stream.resume_token not in (None, self.resume_token):
+                    self.resume_token = stream.resume_token
+                    self.save_resume_token(self.resume_token)
+
+
+def _timestamp_sort_key(log):
+    # The engine expects timestamp order; non-datetime timestamps are skipped by it anyway
+    ts = log.get("timestamp")
+    return ts if isinstance(ts, datetime) else datetime.min
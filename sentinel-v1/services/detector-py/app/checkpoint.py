@@ -0,0 +1,488 @@
+"""
+Warm-restart checkpoints of the scoring engine.
+
+Without one, a restarted detector re-reads the whole analysis window from
+query_logs and re-scores every active user before it is warm. Checkpointer
+periodically writes the engine's state to DETECTOR_CHECKPOINT_PATH; on
+startup the lifespan loads it and only ingests the logs after its
+high-water mark.
+
+The file is one little-endian binary blob meant to be memory-mapped:
+
+    magic b"SNTLCKPT" | uint32 version | uint32 header length | header JSON
+    sections, each 8-byte aligned: raw numpy arrays, listed in the header as
+        name -> [offset, dtype, shape]
+
+    prompts          prompt_offsets int64[P+1], prompt_bytes uint8 (UTF-8)
+    prompt sketches  sketches uint32[P, MINHASH_NUM_PERM] (cluster index on)
+    users            user_offsets int64[U+1], user_bytes uint8 (UTF-8)
+    entries          entry_offsets int64[U+1], timestamps float64[E],
+                     prompt_index int32[E] (oldest first per user)
+    per user         dirty uint8[U], pair_sum float64[U], summed int32[U],
+                     velocity float64[U, counters] (velocity tracker on)
+
+Loading maps the file and copies each section with np.frombuffer, so no
+query_logs read, prompt sketching or similarity comparison happens for the
+restored windows and they are not re-scored (their scores are already in
+Mongo). Only the header is read before the detector is ready; the windows
+are loaded in the background, RESTORE_CHUNK_USERS at a time, and a user's
+window is loaded first as soon as new logs of theirs arrive
+(PendingWindows). The header also keeps the high-water mark and the
+settings the state depends on; state that does not match the current
+settings is rebuilt from the entries (velocity counters), dropped (pair
+sums) or re-scored (other scoring settings).
+
+Writes go to a temporary file renamed over the previous checkpoint, so a
+crash mid-write leaves the last complete one. A checkpoint older than the
+analysis window holds nothing still in the window and is ignored.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+from bson import json_util
+
+logger = logging.getLogger(__name__)
+
+# Checkpoint file (empty = no checkpoints)
+DETECTOR_CHECKPOINT_PATH = os.getenv("DETECTOR_CHECKPOINT_PATH", "")
+CHECKPOINT_INTERVAL_SECONDS = float(os.getenv("CHECKPOINT_INTERVAL_SECONDS", "60"))
+# Restored windows loaded per step of the background load (each step holds the cycle lock)
+RESTORE_CHUNK_USERS = 1000
+
+CHECKPOINT_MAGIC = b"SNTLCKPT"
+CHECKPOINT_VERSION = 1
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGNMENT = 8
+
+
+class CheckpointError(Exception):
+    """The checkpoint file is unreadable or was written by another format version."""
+
+
+def capture(engine, meta: dict = None) -> tuple:
+    """
+    Copy the engine's state into arrays (the caller holds the engine's lock).
+
+    Returns:
+        tuple: (header dict, {section name: ndarray})
+    """
+    store = engine.window_store
+    windows = list(store.windows.values())
+    velocity = store.velocity_tracker
+
+    entry_offsets = np.zeros(len(windows) + 1, dtype=np.int64)
+    timestamps = np.empty(store.entry_count, dtype=np.float64)
+    prompt_ids = np.empty(store.entry_count, dtype=np.int64)
+    dirty = np.zeros(len(windows), dtype=np.uint8)
+    pair_sum = np.zeros(len(windows), dtype=np.float64)
+    summed = np.zeros(len(windows), dtype=np.int32)
+    counters = None
+    if velocity is not None:
+        counters = np.zeros((len(windows), len(velocity.new_counters())), dtype=np.float64)
+
+    position = 0
+    for row, window in enumerate(windows):
+        window_timestamps, window_prompt_ids = window.columns()
+        count = window.count
+        timestamps[position:position + count] = np.frombuffer(window_timestamps, dtype=np.float64)
+        prompt_ids[position:position + count] = np.frombuffer(window_prompt_ids, dtype=np.int32)
+        position += count
+        entry_offsets[row + 1] = position
+        dirty[row] = window.dirty
+        pair_sum[row] = window.pair_sum
+        summed[row] = window.summed
+        if counters is not None:
+            counters[row] = np.frombuffer(window.velocity, dtype=np.float64)
+
+    # Renumber the live prompts 0..P-1 (the table's ids have holes)
+    live = np.unique(prompt_ids)
+    prompt_index = np.searchsorted(live, prompt_ids).astype(np.int32)
+    prompt_offsets, prompt_bytes = _pack_strings(store.prompts.get(int(prompt_id)) for prompt_id in live)
+    user_offsets, user_bytes = _pack_strings(window.user_id for window in windows)
+
+    sections = {
+        "prompt_offsets": prompt_offsets,
+        "prompt_bytes": prompt_bytes,
+        "user_offsets": user_offsets,
+        "user_bytes": user_bytes,
+        "entry_offsets": entry_offsets,
+        "timestamps": timestamps,
+        "prompt_index": prompt_index,
+        "dirty": dirty,
+        "pair_sum": pair_sum,
+        "summed": summed,
+    }
+    if counters is not None:
+        sections["velocity"] = counters
+    if engine.cluster_index is not None:
+        sections["sketches"] = engine.cluster_index.sketches(live)
+
+    high_water_mark = engine.high_water_mark
+    header = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        # isoformat keeps whether pymongo handed back naive or aware datetimes
+        "high_water_mark": high_water_mark.isoformat() if high_water_mark is not None else None,
+        # [[_id, epoch], ...] ingested within the grace period below the mark
+        "recent_ids": json_util.dumps(list(engine._recent_ids.items())),
+        "window_minutes": engine.window_minutes,
+        "similarity_backend": engine.similarity_backend,
+        "velocity_windows": velocity.windows if velocity is not None else None,
+        "pair_sums": store.pair_sums is not None,
+        "cluster_detection": engine.cluster_index is not None,
+        "users": len(windows),
+        "entries": int(store.entry_count),
+        "prompts": int(len(live)),
+    }
+    header.update(meta or {})
+    return header, sections
+
+
+def write(path, header: dict, sections: dict) -> int:
+    """
+    Write a captured checkpoint atomically.
+
+    Returns:
+        int: Bytes written
+    """
+    path = Path(path)
+    sections = {
+        name: np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+        for name, array in sections.items()
+    }
+    layout = {name: [0, array.dtype.str, list(array.shape)] for name, array in sections.items()}
+    header = dict(header, version=CHECKPOINT_VERSION, sections=layout)
+    # The header lists the section offsets, which follow the header: grow the
+    # reserved header length until the header fits in it
+    header_length = 0
+    while True:
+        offset = _align(_PREAMBLE.size + header_length)
+        for name, array in sections.items():
+            layout[name][0] = offset
+            offset = _align(offset + array.nbytes)
+        header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        if len(header_bytes) <= header_length:
+            break
+        header_length = len(header_bytes)
+    # JSON allows trailing whitespace
+    header_bytes = header_bytes.ljust(header_length)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + ".tmp")
+    with open(temporary, "wb") as out:
+        out.write(_PREAMBLE.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, header_length))
+        out.write(header_bytes)
+        for name, array in sections.items():
+            out.write(b"\0" * (layout[name][0] - out.tell()))
+            out.write(memoryview(array).cast("B"))
+        size = out.tell()
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temporary, path)
+    return size
+
+
+def read(path) -> tuple:
+    """
+    Map a checkpoint file.
+
+    Returns:
+        tuple: (header dict, {section name: read-only ndarray view}, mmap);
+        the views are valid until the mmap is closed
+    """
+    with open(path, "rb") as checkpoint:
+        try:
+            mapped = mmap.mmap(checkpoint.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            # Empty file
+            raise CheckpointError(f"{path} is damaged: {e}") from e
+    try:
+        magic, version, header_length = _PREAMBLE.unpack_from(mapped, 0)
+        if magic != CHECKPOINT_MAGIC:
+            raise CheckpointError(f"{path} is not a detector checkpoint")
+        if version != CHECKPOINT_VERSION:
+            raise CheckpointError(f"{path} has format version {version}, expected {CHECKPOINT_VERSION}")
+        header = json.loads(bytes(mapped[_PREAMBLE.size:_PREAMBLE.size + header_length]))
+        sections = {}
+        for name, (offset, dtype, shape) in header["sections"].items():
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape, dtype=np.int64))
+            sections[name] = np.frombuffer(mapped, dtype=dtype, count=count, offset=offset).reshape(shape)
+    except (struct.error, ValueError, KeyError) as e:
+        mapped.close()
+        raise CheckpointError(f"{path} is damaged: {e}") from e
+    except CheckpointError:
+        mapped.close()
+        raise
+    return header, sections, mapped
+
+
+def restore(engine, path, now: datetime = None, user_filter=None, accept=None) -> dict:
+    """
+    Restore a checkpoint into a fresh engine.
+
+    The high-water mark is set right away; the windows are left in
+    engine.window_store.pending (see PendingWindows) and loaded as users
+    are touched or by PendingWindows.load_some().
+
+    Args:
+        user_filter: Only restore users it accepts (default: engine.user_filter)
+        accept: Called with the header; the checkpoint is skipped unless it returns True
+
+    Returns:
+        dict: The checkpoint header, or None if it was too old (or not accepted)
+    """
+    now = now or datetime.now(timezone.utc)
+    header, sections, mapped = read(path)
+    pending = None
+    try:
+        if header["high_water_mark"] is None or (accept is not None and not accept(header)):
+            return None
+        high_water_mark = datetime.fromisoformat(header["high_water_mark"])
+        mark_epoch = high_water_mark.replace(tzinfo=high_water_mark.tzinfo or timezone.utc).timestamp()
+        if mark_epoch < now.timestamp() - engine.window_minutes * 60:
+            return None
+        try:
+            recent_ids = dict(json_util.loads(header["recent_ids"]))
+        except KeyError as e:
+            raise CheckpointError(f"{path} is damaged: {e}") from e
+        pending = PendingWindows(engine, header, sections, mapped, user_filter or engine.user_filter)
+    finally:
+        if pending is None:
+            del sections
+            _close(mapped)
+    engine.restore_mark(high_water_mark, recent_ids)
+    if pending.rows:
+        engine.window_store.pending = pending
+    else:
+        pending.close()
+    return header
+
+
+class PendingWindows:
+    """
+    The windows of a restored checkpoint not loaded into the engine yet.
+
+    Building every window is a Python loop over all users and entries, so
+    it is not done before the detector is ready. The store loads a user's
+    window before appending to it (WindowStore.pending), and load_some()
+    loads the others a chunk at a time. Entries that left the analysis
+    window in the meantime are skipped. The checkpoint stays mapped until
+    the last window is loaded.
+    """
+
+    def __init__(self, engine, header: dict, sections: dict, mapped, user_filter):
+        store = self.store = engine.window_store
+        self.window_seconds = engine.window_minutes * 60
+        self.keep_velocity = store.velocity_tracker is not None and "velocity" in sections and \
+            header["velocity_windows"] == [list(window) for window in store.velocity_tracker.windows]
+        self.keep_pair_sums = store.pair_sums is not None and header["pair_sums"]
+        # Stored scores were computed with other settings: score every window again
+        self.rescore = (header["similarity_backend"] != engine.similarity_backend
+                        or header["window_minutes"] != engine.window_minutes
+                        or header["cluster_detection"] != (engine.cluster_index is not None))
+
+        self.prompts = _unpack_strings(sections["prompt_offsets"], sections["prompt_bytes"])
+        self.rows = {
+            user_id: row
+            for row, user_id in enumerate(_unpack_strings(sections["user_offsets"], sections["user_bytes"]))
+            if user_filter is None or user_filter(user_id)
+        }
+        self.users = len(self.rows)
+        self._sections = sections
+        self._mapped = mapped
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def load(self, user_id: str, now_epoch: float = None) -> bool:
+        """Load one user's window if it is still pending. Returns whether it was."""
+        row = self.rows.pop(user_id, None)
+        if row is None:
+            return False
+        self._load_row(user_id, row, (now_epoch or time.time()) - self.window_seconds)
+        if not self.rows:
+            self.close()
+        return True
+
+    def load_some(self, count: int, now_epoch: float = None) -> int:
+        """
+        Load up to count pending windows.
+
+        Returns:
+            int: Number of windows loaded
+        """
+        cutoff = (now_epoch or time.time()) - self.window_seconds
+        loaded = 0
+        while self.rows and loaded < count:
+            user_id, row = self.rows.popitem()
+            self._load_row(user_id, row, cutoff)
+            loaded += 1
+        if not self.rows:
+            self.close()
+        return loaded
+
+    def close(self) -> None:
+        """Drop the windows still pending and unmap the checkpoint."""
+        self.rows = {}
+        if self.store.pending is self:
+            self.store.pending = None
+        if self._mapped is not None:
+            self._sections = None
+            _close(self._mapped)
+            self._mapped = None
+
+    def _load_row(self, user_id: str, row: int, cutoff: float) -> None:
+        store = self.store
+        if user_id in store.windows:
+            return
+        sections = self._sections
+        timestamps = sections["timestamps"]
+        first, end = int(sections["entry_offsets"][row]), int(sections["entry_offsets"][row + 1])
+        # Skip entries that fell out of the window while the detector was down.
+        # Late arrivals can leave a window slightly out of order, so like
+        # WindowStore.expire only the leading run of old entries is dropped.
+        below = timestamps[first:end] < cutoff
+        start = first + (len(below) if below.all() else int(below.argmin()))
+        start = max(start, end - store.max_entries_per_user)
+        if start == end:
+            return
+        indexes = sections["prompt_index"][start:end]
+        sketches = sections.get("sketches") if store.cluster_index is not None else None
+        store.load_window(
+            user_id,
+            timestamps[start:end],
+            [self.prompts[index] for index in indexes.tolist()],
+            velocity=sections["velocity"][row] if self.keep_velocity else None,
+            # Sums over dropped entries no longer apply; they are recomputed
+            pair_sum=float(sections["pair_sum"][row]) if self.keep_pair_sums and start == first else 0.0,
+            summed=int(sections["summed"][row]) if self.keep_pair_sums and start == first else 0,
+            # A trimmed window no longer scores what was stored for it
+            dirty=self.rescore or bool(sections["dirty"][row]) or start != first,
+            sketches=sketches[indexes] if sketches is not None else None,
+        )
+
+
+def _close(mapped) -> None:
+    try:
+        mapped.close()
+    except BufferError:
+        # A view is still referenced (e.g. by a traceback); closed when collected
+        pass
+
+
+def _pack_strings(strings) -> tuple:
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _unpack_strings(offsets, blob) -> list:
+    data = blob.tobytes()
+    bounds = offsets.tolist()
+    return [data[bounds[i]:bounds[i + 1]].decode("utf-8") for i in range(len(bounds) - 1)]
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class Checkpointer:
+    """Saves the engine every CHECKPOINT_INTERVAL_SECONDS and restores it on startup."""
+
+    def __init__(self, path: str = DETECTOR_CHECKPOINT_PATH, interval: float = CHECKPOINT_INTERVAL_SECONDS):
+        self.path = Path(path) if path else None
+        self.interval = interval
+        self.saved_total = 0
+        self.last_saved = None
+        self.last_restored = None
+        self._last_saved_at = None
+        self._write_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def due(self) -> bool:
+        return self.enabled and (self._last_saved_at is None
+                                 or time.monotonic() - self._last_saved_at >= self.interval)
+
+    def capture(self, engine, meta: dict = None) -> tuple:
+        """Snapshot the engine (caller holds its lock); pass the result to save()."""
+        self._last_saved_at = time.monotonic()
+        return capture(engine, meta)
+
+    def save(self, captured: tuple) -> None:
+        """Write a captured snapshot; can run after the engine's lock is released."""
+        header, sections = captured
+        started = time.perf_counter()
+        with self._write_lock:
+            size = write(self.path, header, sections)
+        self.saved_total += 1
+        self.last_saved = {
+            "at": header["created_at"], "users": header["users"], "entries": header["entries"],
+            "bytes": size, "seconds": round(time.perf_counter() - started, 3),
+        }
+
+    def restore(self, engine, now: datetime = None, accept=None) -> dict:
+        """
+        Load the checkpoint into a fresh engine if there is a usable one.
+
+        Returns:
+            dict: The checkpoint header, or None when nothing was restored
+        """
+        if not self.enabled or not self.path.exists():
+            return None
+        started = time.perf_counter()
+        try:
+            header = restore(engine, self.path, now, accept=accept)
+        except CheckpointError:
+            logger.exception("Ignoring checkpoint %s", self.path)
+            return None
+        if header is None:
+            logger.info("Checkpoint %s is too old or was written for other shards; ignoring it", self.path)
+            return None
+        pending = engine.window_store.pending
+        self.last_restored = {
+            "created_at": header["created_at"], "users": pending.users if pending is not None else 0,
+            "high_water_mark": header["high_water_mark"],
+            "seconds": round(time.perf_counter() - started, 3),
+            "loaded_users": 0, "entries": 0, "load_seconds": 0.0,
+        }
+        return header
+
+    def load_pending(self, engine, count: int = RESTORE_CHUNK_USERS) -> bool:
+        """
+        Load the next chunk of restored windows (the caller holds the engine's lock).
+
+        Returns:
+            bool: Whether windows are still pending afterwards
+        """
+        pending = engine.window_store.pending
+        if pending is None:
+            return False
+        started = time.perf_counter()
+        loaded = pending.load_some(count)
+        self.last_restored["loaded_users"] = pending.users - len(pending)
+        self.last_restored["entries"] = engine.window_store.entry_count
+        self.last_restored["load_seconds"] = round(
+            self.last_restored["load_seconds"] + time.perf_counter() - started, 3)
+        return loaded > 0 and engine.window_store.pending is not None
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "path": str(self.path) if self.path else None,
+            "interval_seconds": self.interval,
+            "saved_total": self.saved_total,
+            "last_saved": self.last_saved,
+            "last_restored": self.last_restored,
+        }
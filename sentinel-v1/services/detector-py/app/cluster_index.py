@@ -0,0 +1,284 @@
+"""
+Cross-user near-duplicate prompt index for coordinated-attack detection.
+
+Per-user scoring misses a botnet that spreads the same extraction prompts
+over hundreds of userIds at a human-looking rate. PromptClusterIndex keeps
+a MinHash sketch (scoring.build_prompt_sketch) of every distinct prompt in
+the current windows, banded into LSH buckets:
+
+    CLUSTER_BANDS bands of CLUSTER_ROWS sketch slots each
+    bucket key (band, slot values) -> prompt ids
+
+Prompts sharing a bucket are candidates; a candidate is a near duplicate
+when its sketch agrees on at least CLUSTER_JACCARD of the slots (an
+estimate of shingle Jaccard similarity). Finding a prompt's near
+duplicates thus looks at its CLUSTER_BANDS buckets, not at every prompt.
+
+The index follows the window store: entries are added and removed with the
+windows (WindowStore calls add / remove), so it holds exactly the prompts
+of the analysis window and shrinks with it.
+
+Cluster signal. Popular questions are near duplicates across many honest
+users too, so the size of a cluster alone says little. What sets a botnet
+apart is that its members send little else: a user is *dominated* by a
+cluster (a prompt and its near duplicates) when they have at least
+CLUSTER_MIN_ENTRIES entries and CLUSTER_MIN_SHARE of them are in it. A
+user's cluster score is
+
+    share of their entries in the cluster x size factor
+    size factor = 0 below CLUSTER_MIN_USERS dominated users, rising to 1
+                  at CLUSTER_BOT_USERS
+
+taking the best of the clusters of their most frequent prompts. The engine
+adds CLUSTER_WEIGHT x cluster score to the suspicion score, so coordination
+alone never flags a user, but raises a repetitive or fast one a tier.
+
+The signal changes tiers, so it is opt-in (CLUSTER_DETECTION=1).
+
+With sharding, each instance only sees the users of its own shards.
+"""
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+
+from .scoring import MINHASH_NUM_PERM, build_prompt_sketch
+
+CLUSTER_DETECTION = os.getenv("CLUSTER_DETECTION", "0").lower() in ("1", "true", "yes")
+CLUSTER_WEIGHT = float(os.getenv("CLUSTER_WEIGHT", "0.4"))
+# Dominated users a cluster needs before it counts, and the count at which
+# the signal is full
+CLUSTER_MIN_USERS = int(os.getenv("CLUSTER_MIN_USERS", "5"))
+CLUSTER_BOT_USERS = int(os.getenv("CLUSTER_BOT_USERS", "25"))
+CLUSTER_MIN_ENTRIES = int(os.getenv("CLUSTER_MIN_ENTRIES", "5"))
+CLUSTER_MIN_SHARE = float(os.getenv("CLUSTER_MIN_SHARE", "0.5"))
+CLUSTER_JACCARD = float(os.getenv("CLUSTER_JACCARD", "0.5"))
+CLUSTER_BANDS = 16
+CLUSTER_ROWS = MINHASH_NUM_PERM // CLUSTER_BANDS
+# A user's most frequent prompts tried as the core of their cluster
+CLUSTER_CORE_CANDIDATES = 3
+# Users listed per cluster by top_clusters()
+CLUSTER_SAMPLE_USERS = 20
+
+# Band key tuple, users dict and bucket set entries per prompt
+_PROMPT_INDEX_BYTES = sys.getsizeof(tuple(range(CLUSTER_BANDS))) + CLUSTER_BANDS * 100 + 300
+_USER_ENTRY_BYTES = 100
+
+
+class PromptClusterIndex:
+    """LSH index of the window's distinct prompts and the users sending them."""
+
+    def __init__(self, min_users: int = CLUSTER_MIN_USERS, bot_users: int = CLUSTER_BOT_USERS,
+                 min_entries: int = CLUSTER_MIN_ENTRIES, min_share: float = CLUSTER_MIN_SHARE,
+                 jaccard: float = CLUSTER_JACCARD):
+        self.min_users = min_users
+        self.bot_users = max(bot_users, min_users)
+        self.min_entries = min_entries
+        self.min_share = min_share
+        # Slots that must agree for two sketches to be near duplicates
+        self.min_agreeing_slots = int(np.ceil(jaccard * MINHASH_NUM_PERM))
+        # Row prompt_id holds that prompt's sketch (prompt ids are dense, see PromptTable)
+        self._sketches = np.zeros((64, MINHASH_NUM_PERM), dtype=np.uint32)
+        self._band_keys = {}
+        self._buckets = {}
+        # prompt id -> {userId: entries}
+        self._users = {}
+        self._user_entries = 0
+        # Prompts that gained or lost a user since the last collect_touched()
+        self._touched = set()
+        # Cluster cores currently giving users a signal: prompt id -> users, and back
+        self._cores = {}
+        self._user_core = {}
+
+    def __len__(self) -> int:
+        return len(self._band_keys)
+
+    @property
+    def bytes(self) -> int:
+        return (self._sketches.nbytes + len(self._band_keys) * _PROMPT_INDEX_BYTES
+                + self._user_entries * _USER_ENTRY_BYTES)
+
+    def add(self, user_id: str, prompt_id: int, prompt: str, sketch=None) -> None:
+        """Index one window entry; sketch is the prompt's, if already known."""
+        users = self._users.get(prompt_id)
+        if users is None:
+            if prompt_id >= len(self._sketches):
+                grown = np.zeros((max(prompt_id + 1, 2 * len(self._sketches)), MINHASH_NUM_PERM), dtype=np.uint32)
+                grown[:len(self._sketches)] = self._sketches
+                self._sketches = grown
+            self._sketches[prompt_id] = build_prompt_sketch(prompt) if sketch is None else sketch
+            sketch = self._sketches[prompt_id]
+            keys = tuple(
+                hash((band, sketch[band * CLUSTER_ROWS:(band + 1) * CLUSTER_ROWS].tobytes()))
+                for band in range(CLUSTER_BANDS)
+            )
+            self._band_keys[prompt_id] = keys
+            for key in keys:
+                self._buckets.setdefault(key, set()).add(prompt_id)
+            users = self._users[prompt_id] = {}
+        if user_id not in users:
+            users[user_id] = 0
+            self._user_entries += 1
+            self._touched.add(prompt_id)
+        users[user_id] += 1
+
+    def remove(self, user_id: str, prompt_id: int) -> None:
+        users = self._users[prompt_id]
+        users[user_id] -= 1
+        if users[user_id]:
+            return
+        del users[user_id]
+        self._user_entries -= 1
+        self._touched.add(prompt_id)
+        if users:
+            return
+        # Last entry gone: the prompt table frees (and may reuse) the id too
+        del self._users[prompt_id]
+        for key in self._band_keys.pop(prompt_id):
+            bucket = self._buckets[key]
+            bucket.discard(prompt_id)
+            if not bucket:
+                del self._buckets[key]
+        for member in self._cores.pop(prompt_id, ()):
+            del self._user_core[member]
+
+    def sketches(self, prompt_ids) -> np.ndarray:
+        """Sketches of indexed prompts, one row per id."""
+        return self._sketches[np.asarray(prompt_ids, dtype=np.int64)]
+
+    def neighbours(self, prompt_id: int) -> np.ndarray:
+        """Prompt ids near-duplicating prompt_id (itself included)."""
+        candidates = set()
+        for key in self._band_keys[prompt_id]:
+            candidates.update(self._buckets[key])
+        candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        agreeing = np.count_nonzero(self._sketches[candidates] == self._sketches[prompt_id], axis=1)
+        return candidates[agreeing >= self.min_agreeing_slots]
+
+    def _entries_near(self, core: int, counts: Counter) -> int:
+        """
+        Entries of {prompt id: entries} that near-duplicate core, i.e. the
+        ones neighbours(core) returns, without collecting all of those.
+        """
+        core_keys = set(self._band_keys[core])
+        candidates = [prompt_id for prompt_id in counts if not core_keys.isdisjoint(self._band_keys[prompt_id])]
+        agreeing = np.count_nonzero(self._sketches[candidates] == self._sketches[core], axis=1)
+        return sum(counts[prompt_id] for prompt_id, slots in zip(candidates, agreeing.tolist())
+                   if slots >= self.min_agreeing_slots)
+
+    def _cluster(self, core: int, window_size, memo: dict) -> tuple:
+        """(neighbours, {userId: entries in the cluster}, dominated users) around a core prompt."""
+        cluster = memo.get(core)
+        if cluster is None:
+            members = self.neighbours(core)
+            entries = Counter()
+            for member in members.tolist():
+                entries.update(self._users[member])
+            dominated = sum(
+                1 for user_id, count in entries.items()
+                if count >= self.min_entries and count >= self.min_share * window_size(user_id)
+            )
+            cluster = memo[core] = (members, entries, dominated)
+        return cluster
+
+    def size_factor(self, dominated: int) -> float:
+        if dominated < self.min_users:
+            return 0.0
+        return min(1.0, (dominated - self.min_users + 1) / (self.bot_users - self.min_users + 1))
+
+    def score(self, user_id: str, prompt_ids, window_size, memo: dict) -> float:
+        """
+        Cluster score (0.0 - 1.0) of a user's window.
+
+        Args:
+            prompt_ids: The window's prompt ids
+            window_size: userId -> number of entries in that user's window
+            memo: Per-cycle cache of clusters, shared across calls
+        """
+        best = 0.0
+        best_core = None
+        total = len(prompt_ids)
+        if total >= self.min_entries:
+            counts = Counter(prompt_ids)
+            for core, _ in counts.most_common(CLUSTER_CORE_CANDIDATES):
+                if core in memo:
+                    share = memo[core][1].get(user_id, 0) / total
+                else:
+                    # Cheap check of the user's own share before counting the whole cluster
+                    share = self._entries_near(core, counts) / total
+                if share < self.min_share:
+                    continue
+                _, _, dominated = self._cluster(core, window_size, memo)
+                signal = share * self.size_factor(dominated)
+                if signal > best:
+                    best, best_core = signal, core
+
+        previous = self._user_core.pop(user_id, None)
+        if previous is not None:
+            self._cores[previous].discard(user_id)
+            if not self._cores[previous]:
+                del self._cores[previous]
+        if best_core is not None:
+            self._cores.setdefault(best_core, set()).add(user_id)
+            self._user_core[user_id] = best_core
+        return best
+
+    def collect_touched(self) -> set:
+        """
+        Users to re-score because a cluster giving them a signal changed
+        (gained or lost a user) since the last call. Users of a cluster that
+        is only forming are re-scored as their own windows change.
+        """
+        affected = set()
+        if self._touched and self._cores:
+            touched = np.fromiter(self._touched, dtype=np.int64, count=len(self._touched))
+            for core, members in self._cores.items():
+                neighbours = self.neighbours(core)
+                if np.isin(neighbours, touched).any():
+                    affected.update(members)
+                    for member in neighbours.tolist():
+                        affected.update(self._users[member])
+        self._touched.clear()
+        return affected
+
+    def forget_user(self, user_id: str) -> None:
+        """Drop a user's core membership (their window is gone)."""
+        core = self._user_core.pop(user_id, None)
+        if core is not None:
+            self._cores[core].discard(user_id)
+            if not self._cores[core]:
+                del self._cores[core]
+
+    def top_clusters(self, prompts, window_size, limit: int = 20) -> list:
+        """
+        Clusters currently raising users' scores, most dominated users first.
+
+        Args:
+            prompts: PromptTable holding the indexed prompt ids
+            window_size: userId -> number of entries in that user's window
+        """
+        memo = {}
+        clusters = []
+        for core, flagged in self._cores.items():
+            members, entries, dominated = self._cluster(core, window_size, memo)
+            clusters.append({
+                "dominated_users": dominated,
+                "users": len(entries),
+                "flagged_users": len(flagged),
+                "entries": sum(entries.values()),
+                "distinct_prompts": len(members),
+                "prompt": prompts.get(core),
+                "sample_users": sorted(flagged)[:CLUSTER_SAMPLE_USERS],
+            })
+        clusters.sort(key=lambda cluster: cluster["dominated_users"], reverse=True)
+        return clusters[:limit]
+
+    def stats(self) -> dict:
+        return {
+            "prompts": len(self._band_keys),
+            "buckets": len(self._buckets),
+            "user_entries": self._user_entries,
+            "cores": len(self._cores),
+            "bytes": self.bytes,
+        }
@@ -0,0 +1,525 @@
+"""
+Incremental scoring engine for the detector.
+
+Instead of re-reading every user's last 5 minutes of query_logs on each
+/run_analysis cycle, the engine keeps a sliding window per active user in
+memory (see window_store.py) and only pulls the logs inserted since the
+previous cycle. Users whose window did not change since the last cycle are
+not re-scored.
+
+`timestamp` is set when the request arrives, and a log can reach query_logs
+long after that (buffered, retried or replayed from the wrappers' spool).
+The high-water mark is therefore kept on when a log was written: its
+`insertedAt`, stamped by the wrappers' log writer at insert time, or its
+`timestamp` for logs without one. Each pull re-reads
+LATE_ARRIVAL_GRACE_SECONDS below the mark to absorb clock skew between
+writers, and logs already ingested are recognised by their _id. A log
+written longer ago than that, or whose timestamp is already outside the
+analysis window, is dropped and counted (logs_late_dropped_total).
+
+With the exact similarity backend, each window also carries a running sum of
+its pairwise prompt similarities (see similarity_cache.py), so a re-score
+only compares the prompts that arrived since the last one.
+
+Which part of a cycle runs in the executor's worker processes (SCORING_WORKERS)
+depends on the similarity path:
+    - exact backend with running pair sums (SIMILARITY_CACHE_BYTES > 0): the
+      prompt comparisons the cache is missing; the sums and the vectorized
+      scoring stay in the cycle thread, which owns the cache
+    - minhash backend with cluster detection: nothing; similarity comes from
+      the cluster index's sketches in one vectorized pass
+    - otherwise: the whole scoring of the changed windows
+
+A cross-user LSH index of the window's prompts (see cluster_index.py) adds a
+coordinated-cluster signal on top of the per-user score; users flagged by a
+cluster that grew or shrank are re-scored even if their own window did not
+change. With the minhash backend, windows are scored from the index's
+sketches rather than sketching their prompts again.
+
+A cycle can be given a time budget: changed windows are then scored in
+priority order and whatever the budget does not cover is carried over to
+the next cycle (see scheduler.py).
+"""
+import itertools
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from .cluster_index import CLUSTER_DETECTION, CLUSTER_WEIGHT, PromptClusterIndex
+from .metrics import STAGE_CLUSTER, STAGE_SIMILARITY, STAGE_VELOCITY, metrics
+from .scheduler import SCHEDULER_CHUNK_USERS, SCHEDULER_FIRST_CHUNK_USERS, ScoringQueue
+from .scoring import (
+    SIMILARITY_BACKEND,
+    average_prompt_similarity,
+    batch_average_similarity,
+    build_prompt_sketch,
+    score_users_batch,
+)
+from .similarity_cache import SIMILARITY_CACHE_BYTES, PairSums, SimilarityCache
+from .velocity import VELOCITY_MODE, VelocityTracker
+from .window_store import WINDOW_MAX_ENTRIES_PER_USER, WindowStore
+
+# Seconds below the high-water mark re-read on every pull, so logs written
+# late with an older timestamp are still picked up
+LATE_ARRIVAL_GRACE_SECONDS = float(os.getenv("LATE_ARRIVAL_GRACE_SECONDS", "120"))
+
+
+def to_epoch_seconds(ts) -> float:
+    """
+    Convert a query_logs timestamp to epoch seconds.
+
+    pymongo hands back naive datetimes that are implicitly UTC. The gateway
+    writes its own access logs with ISO strings; those were never matched by
+    the detector's datetime range query, so they are ignored here as well
+    (returns None).
+    """
+    if not isinstance(ts, datetime):
+        return None
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def score_windows(windows: list, window_minutes: float, similarity_backend: str,
+                  burst_scores: dict = None, avg_similarity: dict = None) -> tuple:
+    """
+    Score a list of (userId, [(epoch_seconds, prompt), ...]) windows.
+
+    burst_scores ({userId: burst V-Score}, optional) raise a user's V-Score
+    to at least that value. avg_similarity ({userId: average similarity},
+    optional) is used as is instead of comparing the prompts.
+
+    The windows are flattened into columns. Average prompt similarity is
+    computed first (difflib per user for "exact", one vectorized MinHash
+    pass for "minhash"), then V-Scores and final scores come from a single
+    score_users_batch call.
+
+    Module-level so it can be shipped to worker processes, which is also why
+    stage timings are returned instead of recorded in metrics directly.
+
+    Returns:
+        tuple: ({userId: suspicion_score}, {stage: seconds})
+    """
+    started = time.perf_counter()
+    precomputed = avg_similarity
+    use_sketches = precomputed is None and similarity_backend == "minhash"
+    avg_similarity = None if use_sketches else np.zeros(len(windows))
+    user_index = []
+    timestamps = []
+    sketch_ids = []
+    sketch_rows = {}
+    sketches = []
+
+    for idx, (user_id, entries) in enumerate(windows):
+        for epoch, prompt in entries:
+            user_index.append(idx)
+            timestamps.append(epoch)
+            if use_sketches:
+                sketch_id = sketch_rows.get(prompt)
+                if sketch_id is None:
+                    sketch_id = sketch_rows[prompt] = len(sketches)
+                    sketches.append(build_prompt_sketch(prompt))
+                sketch_ids.append(sketch_id)
+            else:
+                sketch_ids.append(0)
+        if precomputed is not None:
+            avg_similarity[idx] = precomputed.get(user_id, 0.0)
+        elif not use_sketches and len(entries) >= 2:
+            prompts = [prompt for _, prompt in entries]
+            avg_similarity[idx] = average_prompt_similarity(prompts, backend=similarity_backend)
+
+    if use_sketches:
+        avg_similarity = batch_average_similarity(user_index, sketch_ids, np.stack(sketches), len(windows))
+    similarity_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    min_v_scores = None
+    if burst_scores:
+        min_v_scores = [burst_scores.get(user_id, 0.0) for user_id, _ in windows]
+    _, _, final_scores = score_users_batch(
+        user_index,
+        timestamps,
+        sketch_ids,
+        None,
+        num_users=len(windows),
+        analysis_window_minutes=window_minutes,
+        avg_similarity=avg_similarity,
+        min_v_scores=min_v_scores
+    )
+    scores = {user_id: float(final_scores[idx]) for idx, (user_id, _) in enumerate(windows)}
+    velocity_seconds = time.perf_counter() - started
+
+    return scores, {STAGE_SIMILARITY: similarity_seconds, STAGE_VELOCITY: velocity_seconds}
+
+
+class ScoringEngine:
+    """
+    Stateful, incremental replacement for the full rescan in run_analysis.
+
+    Usage per cycle:
+        if engine.high_water_mark is None:
+            engine.bootstrap(store.fetch_window_logs(query_logs, since))
+        else:
+            engine.ingest(store.iter_new_logs(query_logs, engine.cursor_filter(now)))
+        engine.expire(now)
+        scores = engine.rescore(now, budget_seconds)   # {userId: score} for changed users only
+    """
+
+    def __init__(self, window_minutes: float = 5.0, similarity_backend: str = None, executor=None,
+                 max_entries_per_user: int = WINDOW_MAX_ENTRIES_PER_USER, velocity_mode: str = None,
+                 user_filter=None, cluster_detection: bool = None,
+                 late_arrival_grace_seconds: float = LATE_ARRIVAL_GRACE_SECONDS):
+        self.window_minutes = window_minutes
+        # Only users for which user_filter(userId) is true are tracked (e.g.
+        # this instance's shards, see sharding.py); None tracks everyone.
+        self.user_filter = user_filter
+        self.similarity_backend = similarity_backend or SIMILARITY_BACKEND
+        self.executor = executor
+        velocity_mode = velocity_mode or VELOCITY_MODE
+        if velocity_mode not in ("multi", "window"):
+            raise ValueError(f"Unknown velocity mode: {velocity_mode}")
+        # Burst counters for the short velocity windows ("multi" mode only)
+        self.velocity = VelocityTracker() if velocity_mode == "multi" else None
+        # Running pair sums and the cross-cycle similarity cache (exact backend only)
+        self.pair_sums = None
+        if self.similarity_backend == "exact" and SIMILARITY_CACHE_BYTES > 0:
+            self.pair_sums = PairSums(SimilarityCache(SIMILARITY_CACHE_BYTES))
+        # Cross-user near-duplicate prompt index
+        if cluster_detection is None:
+            cluster_detection = CLUSTER_DETECTION
+        self.cluster_index = PromptClusterIndex() if cluster_detection else None
+        self.window_store = WindowStore(max_entries_per_user, self.velocity, self.pair_sums, self.cluster_index)
+        # userId -> UserWindow, owned by the window store
+        self.windows = self.window_store.windows
+        # Newest log timestamp ingested so far; every pull re-reads the grace
+        # period below it. _recent_ids maps the _ids ingested within the grace
+        # period to their epoch, so re-read logs are not counted twice.
+        self.high_water_mark = None
+        self.late_arrival_grace_seconds = late_arrival_grace_seconds
+        self._mark_epoch = None
+        self._recent_ids = {}
+        self._pruned_at = None
+        # Logs that arrived more than the grace period behind the mark
+        self.late_dropped = 0
+        # Changed windows the last rescore() left for the next one, and its stats
+        self.backlog = 0
+        self.last_rescore = None
+        # Running estimate of scoring seconds per scheduler.scoring_cost unit
+        self._seconds_per_unit = None
+
+    def cursor_filter(self, now: datetime) -> dict:
+        """Mongo filter selecting logs that may not have been ingested yet."""
+        if self.high_water_mark is None:
+            since = now - timedelta(minutes=self.window_minutes)
+        else:
+            since = self.high_water_mark - timedelta(seconds=self.late_arrival_grace_seconds)
+            # Logs written since, including ones stamped with an older timestamp
+            return {"$or": [{"insertedAt": {"$gte": since}}, {"timestamp": {"$gte": since}}]}
+        return {"timestamp": {"$gte": since}}
+
+    def bootstrap(self, grouped_logs) -> int:
+        """
+        Load a full window of logs grouped by user (see store.fetch_window_logs).
+
+        Used for the first cycle, before a high-water mark exists.
+
+        Returns:
+            int: Number of log entries loaded
+        """
+        loaded = 0
+        for user_id, entries in grouped_logs:
+            tracked = self.user_filter is None or self.user_filter(user_id)
+            for entry in entries:
+                ts = entry.get("timestamp")
+                epoch = to_epoch_seconds(ts)
+                if epoch is None:
+                    continue
+
+                self._advance_mark(entry, ts, epoch)
+                if tracked:
+                    self.window_store.append(user_id, epoch, entry.get("prompt", ""))
+                    loaded += 1
+        self._prune_recent_ids()
+        return loaded
+
+    def ingest(self, logs) -> int:
+        """
+        Add new query_logs documents (sorted by timestamp) to the windows.
+
+        Logs already ingested (re-read from the grace period) are skipped, as
+        are logs written before the grace period below the high-water mark and
+        logs whose timestamp is outside the analysis window. A late log is
+        appended after the newer entries of its user's window and expires
+        along with them.
+
+        Returns:
+            int: Number of log entries actually added
+        """
+        added = 0
+        late = 0
+        for log in logs:
+            ts = log.get("timestamp")
+            epoch = to_epoch_seconds(ts)
+            if epoch is None:
+                continue
+
+            log_id = log.get("_id")
+            if log_id is not None and log_id in self._recent_ids:
+                continue
+            written_epoch = self._written_epoch(log, epoch)
+            if self._mark_epoch is not None and (
+                    written_epoch < self._mark_epoch - self.late_arrival_grace_seconds
+                    or epoch < self._mark_epoch - self.window_minutes * 60):
+                late += 1
+                continue
+            self._advance_mark(log, ts, epoch)
+
+            user_id = log["userId"]
+            if self.user_filter is not None and not self.user_filter(user_id):
+                continue
+            self.window_store.append(user_id, epoch, log.get("prompt", ""))
+            added += 1
+        if late:
+            self.late_dropped += late
+            metrics.inc("logs_late_dropped_total", late)
+        self._prune_recent_ids()
+        return added
+
+    @staticmethod
+    def _written_epoch(log: dict, epoch: float) -> float:
+        """When the log was written to query_logs (insertedAt, else its timestamp)."""
+        written_epoch = to_epoch_seconds(log.get("insertedAt"))
+        return epoch if written_epoch is None else written_epoch
+
+    def _advance_mark(self, log: dict, ts: datetime, epoch: float) -> None:
+        written_epoch = self._written_epoch(log, epoch)
+        if self._mark_epoch is None or written_epoch > self._mark_epoch:
+            self.high_water_mark = ts if written_epoch == epoch else log["insertedAt"]
+            self._mark_epoch = written_epoch
+        log_id = log.get("_id")
+        if log_id is not None:
+            self._recent_ids[log_id] = written_epoch
+
+    def _prune_recent_ids(self) -> None:
+        """Forget _ids that fell below the grace period (cursor_filter no longer returns them)."""
+        if self._mark_epoch is None:
+            return
+        # Sweep at most once per grace period; the dict holds up to two periods of _ids
+        if self._pruned_at is not None and self._mark_epoch - self._pruned_at < self.late_arrival_grace_seconds:
+            return
+        cutoff = self._mark_epoch - self.late_arrival_grace_seconds
+        self._recent_ids = {log_id: epoch for log_id, epoch in self._recent_ids.items() if epoch >= cutoff}
+        self._pruned_at = self._mark_epoch
+
+    def restore_mark(self, high_water_mark: datetime, recent_ids: dict) -> None:
+        """Set the high-water mark and recently ingested _ids (see checkpoint.restore)."""
+        self.high_water_mark = high_water_mark
+        self._mark_epoch = to_epoch_seconds(high_water_mark)
+        self._recent_ids = dict(recent_ids)
+        self._pruned_at = None
+        self._prune_recent_ids()
+
+    def expire(self, now: datetime, user_ids=None) -> int:
+        """
+        Drop entries that fell out of the analysis window.
+
+        Users whose window becomes empty are forgotten entirely; like the
+        original full rescan, their stored score is left untouched.
+
+        Args:
+            user_ids: Only expire these users' windows (default: all users)
+
+        Returns:
+            int: Number of entries dropped
+        """
+        cutoff = now.timestamp() - self.window_minutes * 60
+        return self.window_store.expire(cutoff, user_ids)
+
+    def memory_report(self) -> dict:
+        report = self.window_store.memory_report()
+        if self.pair_sums is not None:
+            report["similarity_cache"] = self.pair_sums.cache.stats()
+        if self.cluster_index is not None:
+            report["cluster_index"] = self.cluster_index.stats()
+        return report
+
+    def top_clusters(self, limit: int = 20) -> list:
+        """Groups of users mostly sending near-identical prompts (see cluster_index.py)."""
+        if self.cluster_index is None:
+            return []
+        return self.cluster_index.top_clusters(self.window_store.prompts, self._window_size, limit)
+
+    def _window_size(self, user_id: str) -> int:
+        window = self.windows.get(user_id)
+        return window.count if window is not None else 0
+
+    def mark_dirty(self, user_ids) -> None:
+        """Force users to be re-scored next cycle (e.g. their score write failed)."""
+        for user_id in user_ids:
+            window = self.windows.get(user_id)
+            if window is not None:
+                window.dirty = True
+
+    def rescore(self, now: datetime = None, budget_seconds: float = None) -> dict:
+        """
+        Score every user whose window changed since the last call.
+
+        Scoring is delegated to the executor when one is configured (see
+        executor.ScoringExecutor), otherwise done in the calling thread.
+        With running pair sums, similarity is brought up to date here (it
+        needs the windows and the cache), with only the uncached comparisons
+        sent to the executor, and the cheap vectorized scoring runs in the
+        calling thread. With minhash and the cluster index, the index's
+        sketches are scored in the calling thread.
+        Burst V-Scores are evaluated as of `now` (default: current time).
+        Users whose prompt cluster changed are re-scored too, and the
+        cluster signal is added last.
+
+        With a budget_seconds, changed windows are scored in priority order
+        (see scheduler.py), a chunk at a time, until the budget is spent;
+        the rest stay changed for the next call (see `backlog`).
+
+        Returns:
+            dict: {userId: suspicion_score} for the re-scored users
+        """
+        started = time.perf_counter()
+        now_epoch = time.time() if now is None else now.timestamp()
+        cluster_seconds = 0.0
+        if self.cluster_index is not None:
+            self.mark_dirty(self.cluster_index.collect_touched())
+            cluster_seconds = time.perf_counter() - started
+
+        changed = [window for window in self.windows.values() if window.dirty]
+        scores = {}
+        cluster_memo = {}
+        stage_seconds = {STAGE_CLUSTER: cluster_seconds} if self.cluster_index is not None else {}
+        if budget_seconds and budget_seconds > 0:
+            queue = ScoringQueue(changed, now_epoch)
+            while queue:
+                remaining = budget_seconds - (time.perf_counter() - started)
+                if remaining <= 0:
+                    break
+                # Fill the chunk up to the predicted remaining budget
+                if self._seconds_per_unit:
+                    chunk, cost = queue.take_within(remaining / self._seconds_per_unit, SCHEDULER_CHUNK_USERS)
+                else:
+                    chunk, cost = queue.take_within(None, SCHEDULER_FIRST_CHUNK_USERS)
+                chunk_started = time.perf_counter()
+                self._score_chunk(chunk, now_epoch, scores, stage_seconds, cluster_memo)
+                per_unit = (time.perf_counter() - chunk_started) / cost
+                self._seconds_per_unit = per_unit if not self._seconds_per_unit else \
+                    (self._seconds_per_unit + per_unit) / 2
+            self.backlog = len(queue)
+        else:
+            if changed:
+                self._score_chunk(changed, now_epoch, scores, stage_seconds, cluster_memo)
+            self.backlog = 0
+
+        self.last_rescore = {
+            "scored": len(scores),
+            "backlog": self.backlog,
+            "budget_seconds": budget_seconds or 0.0,
+            "elapsed_seconds": time.perf_counter() - started,
+        }
+        if not scores:
+            return scores
+        for stage, seconds in stage_seconds.items():
+            metrics.observe(stage, seconds)
+        metrics.inc("users_scored_total", len(scores))
+        return scores
+
+    def _sketch_similarity(self, windows: list) -> dict:
+        """MinHash average similarity per window, from the cluster index's sketches."""
+        prompt_ids = [window.columns()[1] for window in windows]
+        user_index = np.repeat(np.arange(len(windows)), [len(ids) for ids in prompt_ids])
+        flat = np.fromiter(itertools.chain.from_iterable(prompt_ids), dtype=np.int64, count=len(user_index))
+        distinct, sketch_ids = np.unique(flat, return_inverse=True)
+        averages = batch_average_similarity(user_index, sketch_ids, self.cluster_index.sketches(distinct), len(windows))
+        return {window.user_id: float(average) for window, average in zip(windows, averages)}
+
+    def _compare_in_pool(self, windows: list) -> dict:
+        """
+        Run the prompt comparisons PairSums cannot serve from its cache in the
+        executor's worker processes, so average() is left with lookups.
+
+        Returns:
+            dict: {userId: evaluate_windows result} for windows evaluated as a whole
+        """
+        prompts = self.window_store.prompts
+        missing = {}
+        full = []
+        for window in windows:
+            if self.pair_sums.needs_full_evaluation(window):
+                full.append(window)
+            else:
+                self.pair_sums.missing_pairs(self.window_store, window, missing)
+        if not missing and not full:
+            return {}
+        ratios, evaluations = self.executor.similarity(
+            list(missing.values()), [[prompts.get(prompt_id) for prompt_id in window.columns()[1]] for window in full]
+        )
+        self.pair_sums.add_pairs(missing, ratios)
+        return {window.user_id: evaluation for window, evaluation in zip(full, evaluations)}
+
+    def _score_chunk(self, windows: list, now_epoch: float, scores: dict, stage_seconds: dict,
+                     cluster_memo: dict) -> None:
+        """Score changed windows into scores, adding up stage timings."""
+        dirty = []
+        burst_scores = {} if self.velocity is not None else None
+        for window in windows:
+            dirty.append((window.user_id, self.window_store.entries(window)))
+            window.dirty = False
+            if burst_scores is not None:
+                burst_scores[window.user_id] = self.velocity.score(window.velocity, now_epoch)
+
+        if self.pair_sums is not None:
+            started = time.perf_counter()
+            evaluated = {}
+            if self.executor is not None and self.executor.parallel:
+                evaluated = self._compare_in_pool(windows)
+            avg_similarity = {
+                window.user_id: self.pair_sums.average(self.window_store, window, evaluated.get(window.user_id))
+                for window in windows
+            }
+            similarity_seconds = time.perf_counter() - started
+            chunk_scores, chunk_seconds = score_windows(
+                dirty, self.window_minutes, self.similarity_backend, burst_scores, avg_similarity
+            )
+            chunk_seconds[STAGE_SIMILARITY] += similarity_seconds
+        elif self.similarity_backend == "minhash" and self.cluster_index is not None:
+            # The cluster index already holds every window prompt's sketch
+            started = time.perf_counter()
+            avg_similarity = self._sketch_similarity(windows)
+            similarity_seconds = time.perf_counter() - started
+            chunk_scores, chunk_seconds = score_windows(
+                dirty, self.window_minutes, self.similarity_backend, burst_scores, avg_similarity
+            )
+            chunk_seconds[STAGE_SIMILARITY] += similarity_seconds
+        elif self.executor is not None:
+            chunk_scores, chunk_seconds = self.executor.score(
+                dirty, self.window_minutes, self.similarity_backend, burst_scores
+            )
+        else:
+            chunk_scores, chunk_seconds = score_windows(
+                dirty, self.window_minutes, self.similarity_backend, burst_scores
+            )
+
+        if self.cluster_index is not None and CLUSTER_WEIGHT > 0:
+            started = time.perf_counter()
+            for user_id in chunk_scores:
+                _, prompt_ids = self.windows[user_id].columns()
+                cluster_score = self.cluster_index.score(
+                    user_id, prompt_ids.tolist(), self._window_size, cluster_memo
+                )
+                if cluster_score > 0:
+                    chunk_scores[user_id] = min(1.0, chunk_scores[user_id] + CLUSTER_WEIGHT * cluster_score)
+            chunk_seconds[STAGE_CLUSTER] = chunk_seconds.get(STAGE_CLUSTER, 0.0) + time.perf_counter() - started
+
+        for window in windows:
+            window.score = chunk_scores[window.user_id]
+            window.scored_at = now_epoch
+        for stage, seconds in chunk_seconds.items():
+            stage_seconds[stage] = stage_seconds.get(stage, 0.0) + seconds
+        scores.update(chunk_scores)
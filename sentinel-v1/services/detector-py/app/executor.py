@@ -0,0 +1,117 @@
+"""
+Process pool for the CPU-bound part of an analysis cycle.
+
+Pairwise prompt similarity is pure-Python CPU work, so scoring thousands of
+changed users in the service process would pin one core and hold the GIL.
+ScoringExecutor shards the changed windows across a ProcessPoolExecutor and
+merges the per-shard results.
+
+With running pair sums (exact backend with a similarity cache), windows are
+scored in the engine, which owns the cache; the pool then runs only the
+prompt comparisons the cache is missing (see similarity()).
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .engine import score_windows
+from .similarity_cache import evaluate_windows, pair_ratios
+
+# Worker processes for scoring (0 or 1 = score in the calling thread)
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Below this many changed users per worker the pool overhead isn't worth it
+SCORING_MIN_USERS_PER_SHARD = int(os.getenv("SCORING_MIN_USERS_PER_SHARD", "32"))
+# Likewise for prompt comparisons shipped by similarity()
+SCORING_MIN_PAIRS_PER_SHARD = 2000
+
+
+class ScoringExecutor:
+    """Shards user windows across worker processes and scores them in parallel."""
+
+    def __init__(self, max_workers: int = SCORING_WORKERS,
+                 min_users_per_shard: int = SCORING_MIN_USERS_PER_SHARD):
+        self.max_workers = max_workers
+        self.min_users_per_shard = min_users_per_shard
+        self._pool = None
+        if max_workers > 1:
+            # spawn, not fork: the service process holds MongoClient sockets and threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def score(self, windows: list, window_minutes: float, similarity_backend: str,
+              burst_scores: dict = None) -> tuple:
+        """
+        Score (userId, entries) windows, in parallel when there are enough of them.
+
+        Returns:
+            tuple: ({userId: suspicion_score}, {stage: seconds summed over shards})
+        """
+        shard_count = min(self.max_workers, len(windows) // max(1, self.min_users_per_shard))
+        if self._pool is None or shard_count <= 1:
+            return score_windows(windows, window_minutes, similarity_backend, burst_scores)
+
+        # Interleave so heavy and light users spread evenly over the shards
+        shards = [windows[i::shard_count] for i in range(shard_count)]
+        futures = [
+            self._pool.submit(
+                score_windows, shard, window_minutes, similarity_backend,
+                {user_id: burst_scores[user_id] for user_id, _ in shard} if burst_scores else None
+            )
+            for shard in shards
+        ]
+        scores = {}
+        stage_seconds = {}
+        for future in futures:
+            shard_scores, shard_seconds = future.result()
+            scores.update(shard_scores)
+            for stage, seconds in shard_seconds.items():
+                stage_seconds[stage] = stage_seconds.get(stage, 0.0) + seconds
+        return scores, stage_seconds
+
+    @property
+    def parallel(self) -> bool:
+        """Whether there are worker processes to hand work to."""
+        return self._pool is not None
+
+    def similarity(self, pairs: list, prompt_lists: list) -> tuple:
+        """
+        Run the comparisons that running pair sums could not serve from cache.
+
+        Args:
+            pairs: [(normalized text, normalized text), ...] to compare
+            prompt_lists: [[prompt, ...], ...] windows to evaluate as a whole
+
+        Returns:
+            tuple: (pair_ratios(pairs), evaluate_windows(prompt_lists))
+        """
+        work = len(pairs) + sum(len(prompts) * (len(prompts) - 1) // 2 for prompts in prompt_lists)
+        shard_count = min(self.max_workers, work // SCORING_MIN_PAIRS_PER_SHARD)
+        if self._pool is None or shard_count <= 1:
+            return pair_ratios(pairs), evaluate_windows(prompt_lists)
+
+        # Largest windows first, dealt round robin, so shards get similar work
+        order = sorted(range(len(prompt_lists)), key=lambda index: -len(prompt_lists[index]))
+        pair_chunk = max(1, -(-len(pairs) // shard_count))
+        pair_futures = [
+            self._pool.submit(pair_ratios, pairs[start:start + pair_chunk])
+            for start in range(0, len(pairs), pair_chunk)
+        ]
+        window_shards = [order[i::shard_count] for i in range(shard_count)]
+        window_futures = [
+            self._pool.submit(evaluate_windows, [prompt_lists[index] for index in shard])
+            for shard in window_shards if shard
+        ]
+        ratios = []
+        for future in pair_futures:
+            ratios.extend(future.result())
+        evaluations = [None] * len(prompt_lists)
+        for shard, future in zip([shard for shard in window_shards if shard], window_futures):
+            for index, result in zip(shard, future.result()):
+                evaluations[index] = result
+        return ratios, evaluations
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
@@ -1,14 +1,18 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
 from pymongo import MongoClient
 from datetime import datetime, timedelta, timezone
 import os
-import subprocess
 from pathlib import Path
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import asyncio
 import hashlib
+import logging
 import sys
+import threading
+import time
 
 # Define the path to the root .env file
 ENV_PATH = Path(__file__).resolve().parent.parent.parent.parent / '.env'
@@ -17,18 +21,26 @@ load_dotenv(dotenv_path=ENV_PATH)
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent.parent))
 
-# Import scoring module - *** CHANGED TO RELATIVE IMPORT ***
-try:
-    from .scoring import calculate_suspicion_score
-except ImportError as e:
-    print(f"Import Error: {e}. Using fallback.")
-    # Fallback: simple scoring function
-    def calculate_suspicion_score(recent_queries, analysis_window_minutes):
-        if not recent_queries:
-            return 0.0
-        # Simple scoring: more queries = higher score
-        score = min(len(recent_queries) * 0.1, 1.0)
-        return score
+# Scoring is done by the incremental engine, which wraps scoring.py
+from .engine import ScoringEngine
+from .executor import ScoringExecutor
+from . import store
+from .checkpoint import Checkpointer
+from .change_feed import CHANGE_STREAM_ENABLED, QueryLogChangeFeed
+from .score_feed import ScoreFeed
+from .scoring import get_tier
+from .metrics import STAGE_CYCLE, STAGE_FETCH, STAGE_STREAM, STAGE_WRITE_BACK, metrics
+from .retention import QueryLogCompactor, safety_net_ttl
+from .scheduler import ANALYSIS_BUDGET_SECONDS
+from .sharding import ShardCoordinator
+from .threat_queue import THREAT_SIDECAR_ADDR, SidecarThreatSink, SubprocessThreatSink, ThreatOutbox
+
+
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger(__name__)
 
 
 MONGODB_URI = os.getenv("MONGODB_URI")
@@ -47,46 +59,61 @@ users_collection = db["users"]
 query_logs_collection = db["query_logs"]
 print(f"Detector: Connected to MongoDB (DB: {os.getenv('DB_NAME', '07')})")
 
+ANALYSIS_WINDOW_MINUTES = 5
+scoring_executor = ScoringExecutor()
 
+# With DETECTOR_SHARDS > 1 this instance only tracks the users of the shards it leases
+shard_coordinator = ShardCoordinator(db["detector_shards"])
 
-class AnalysisResponse(BaseModel):
-    status: str
-    users_updated: int
-    flagged_count: int
-    message: str = ""
 
+def new_scoring_engine() -> ScoringEngine:
+    user_filter = shard_coordinator.owns if shard_coordinator.enabled else None
+    return ScoringEngine(window_minutes=ANALYSIS_WINDOW_MINUTES, executor=scoring_executor,
+                         user_filter=user_filter)
 
-def log_threat_to_blockchain(user_id: str) -> bool:
-    try:
-        script_path = os.path.join(BLOCKCHAIN_SCRIPTS_PATH, "logThreat.js")
-        # Ensure node can find the root .env file by setting CWD
-        project_root = Path(script_path).parent.parent.parent
-        
-        print(f"Running blockchain script from: {project_root}")
-        result = subprocess.run(
-            ["node", script_path, user_id],
-            capture_output=True,
-            text=True,
-            timeout=30,
-            cwd=project_root # Set the current working directory
-        )
 
-        if result.returncode == 0:
-            print("Threat logged successfully")
-            print(f"Output: {result.stdout.strip()}")
-            return True
-        else:
-            print("Blockchain logging failed")
-            print(f"Error: {result.stderr.strip()}")
-            return False
+scoring_engine = new_scoring_engine()
+# shard_coordinator.generation the engine's windows were built for
+scoring_engine_generation = shard_coordinator.generation
+# Cycles run in a worker thread; only one may touch the engine at a time
+cycle_lock = threading.Lock()
 
-    except subprocess.TimeoutExpired:
-        print("Timeout while logging threat")
-        return False
-    except Exception as e:
-        print(f"Exception while logging threat: {e}")
-        return False
+# Raw query_logs past the hot horizon are rolled up per user and minute; with
+# several instances the owner of shard 0 does it
+query_log_compactor = QueryLogCompactor(
+    query_logs_collection, db["query_log_rollups"], min_hot_seconds=ANALYSIS_WINDOW_MINUTES * 60,
+    should_run=lambda: not shard_coordinator.enabled or 0 in shard_coordinator.owned
+)
 
+# The engine's windows are saved to DETECTOR_CHECKPOINT_PATH so a restart
+# only ingests the logs written since
+checkpointer = Checkpointer()
+
+# Score changes are pushed to the gateway's score cache over /scores/stream
+score_feed = ScoreFeed()
+
+# Flagged users are logged to the blockchain by a background worker, through
+# threatSidecar.js when one is configured (logThreat.js runs if it is down)
+threat_sink = SubprocessThreatSink(BLOCKCHAIN_SCRIPTS_PATH)
+if THREAT_SIDECAR_ADDR:
+    threat_sink = SidecarThreatSink(THREAT_SIDECAR_ADDR, fallback=threat_sink)
+threat_outbox = ThreatOutbox(db["threat_outbox"], threat_sink)
+
+
+
+class AnalysisResponse(BaseModel):
+    status: str
+    users_updated: int
+    flagged_count: int
+    message: str = ""
+    # Shards this instance scored (empty when sharding is off)
+    shards: list = []
+    # Changed users left for the next cycle once the scoring budget ran out
+    backlog: int = 0
+    budget_seconds: float = 0.0
+    budget_used_seconds: float = 0.0
+    # True when this call joined a cycle that was already running
+    joined: bool = False
 
 
 @asynccontextmanager
@@ -94,15 +121,64 @@ async def lifespan(app: FastAPI):
     print("\n" + "=" * 60)
     print("SENTINEL DETECTOR SERVICE STARTED")
     print("=" * 60)
-    print(f"MongoDB connected: {MONGODB_URI.split('@')[1].split('/')[0]}")
+    print(f"MongoDB connected: {MONGODB_URI.split('://')[-1].split('@')[-1].split('/')[0]}")
     print(f"Blockchain scripts path: {BLOCKCHAIN_SCRIPTS_PATH}")
     print(f"Hardhat RPC URL: {HARDHAT_RPC_URL}")
+    if THREAT_SIDECAR_ADDR:
+        print(f"Threat sidecar: {THREAT_SIDECAR_ADDR}")
+    print(f"Scoring worker processes: {scoring_executor.max_workers}")
+    try:
+        store.ensure_indexes(users_collection, query_logs_collection,
+                             ttl_seconds=safety_net_ttl(query_log_compactor.hot_seconds))
+        threat_outbox.ensure_indexes()
+        if query_log_compactor.enabled:
+            query_log_compactor.ensure_indexes()
+        print("MongoDB indexes ensured")
+    except Exception as e:
+        print(f"Could not ensure MongoDB indexes: {e}")
+    threat_outbox.start()
+    print("Threat outbox worker started")
+    if shard_coordinator.enabled:
+        shard_coordinator.start()
+        print(f"Instance {shard_coordinator.instance_id} owns shards "
+              f"{sorted(shard_coordinator.owned)} of {shard_coordinator.num_shards}")
+    if checkpointer.enabled:
+        restored = await asyncio.to_thread(restore_checkpoint)
+        if restored:
+            print(f"Restored checkpoint {checkpointer.path} in {restored['seconds']}s; ingested "
+                  f"{restored['tail_logs']} newer logs; loading {restored['users']} user windows in the background")
+        else:
+            print(f"No usable checkpoint at {checkpointer.path}; the first cycle loads the full window")
+    if query_log_compactor.enabled:
+        query_log_compactor.start()
+        print(f"Query logs older than {query_log_compactor.hot_seconds}s are rolled up into query_log_rollups")
+    if CHANGE_STREAM_ENABLED:
+        change_feed.start()
+        print("Change stream on query_logs enabled; /run_analysis acts as reconciliation sweep")
     print("Service ready to analyze user behavior")
     print("=" * 60 + "\n")
 
     yield
 
-    print("\n[SHUTDOWN] Closing MongoDB connection...")
+    if CHANGE_STREAM_ENABLED:
+        print("\n[SHUTDOWN] Stopping change stream...")
+        await asyncio.to_thread(change_feed.stop)
+    if shard_coordinator.enabled:
+        print("[SHUTDOWN] Releasing shards...")
+        await asyncio.to_thread(shard_coordinator.stop)
+    if query_log_compactor.enabled:
+        print("[SHUTDOWN] Stopping query log compactor...")
+        await asyncio.to_thread(query_log_compactor.stop)
+    if checkpointer.enabled:
+        print("[SHUTDOWN] Saving checkpoint...")
+        await asyncio.to_thread(save_checkpoint, True)
+    print("\n[SHUTDOWN] Stopping threat outbox worker...")
+    await threat_outbox.stop()
+    if THREAT_SIDECAR_ADDR:
+        await threat_sink.close()
+    print("[SHUTDOWN] Stopping scoring workers...")
+    scoring_executor.shutdown()
+    print("[SHUTDOWN] Closing MongoDB connection...")
     mongo_client.close()
     print("[SHUTDOWN] Detector service stopped")
 
@@ -117,76 +193,375 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "sentinel-detector",
-        "timestamp": datetime.now(datetime.timezone.utc)
+        "timestamp": datetime.now(timezone.utc)
     }
 
 
-@app.post("/run_analysis", response_model=AnalysisResponse)
-async def run_analysis():
-    try:
-        print("\n" + "="*60)
-        print(f"STARTING DETECTION ANALYSIS CYCLE: {datetime.now(timezone.utc)}")
-        print("="*60)
+@app.get("/scores/stream")
+async def scores_stream(request: Request, since: int = None):
+    """
+    Score changes as Server-Sent Events (see score_feed.py). Resume with
+    ?since=<seq> or the Last-Event-ID header.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if since is None and last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    return StreamingResponse(
+        score_feed.stream(since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/scores/snapshot")
+async def scores_snapshot():
+    """Every user's current score, and the stream seq to resume from after loading it."""
+    # Read seq first: every event up to it was written before the scan starts
+    stream_id, seq = score_feed.stream_id, score_feed.seq
+
+    def read_scores():
+        return [
+            {
+                "userId": user_id,
+                "score": score,
+                "tier": get_tier(score),
+                "updated_at": int(last_seen.replace(tzinfo=last_seen.tzinfo or timezone.utc).timestamp() * 1000)
+                if isinstance(last_seen, datetime) else None,
+            }
+            for user_id, score, last_seen in store.iter_scores(users_collection)
+        ]
 
-        users_updated = 0
-        flagged_count = 0
+    return {"stream_id": stream_id, "seq": seq, "scores": await asyncio.to_thread(read_scores)}
 
-        all_users = list(users_collection.find({}))
-        analysis_window_minutes = 5
-        time_threshold = datetime.now(datetime.timezone.utc) - timedelta(minutes=analysis_window_minutes)
 
-        for user in all_users:
-            user_id = user["userId"]
-            old_score = user.get("suspicion_score", 0.0)
+@app.get("/shards")
+async def shards_status():
+    """Shard leases and the latest progress each owner reported."""
+    return {
+        "enabled": shard_coordinator.enabled,
+        "instance_id": shard_coordinator.instance_id,
+        "num_shards": shard_coordinator.num_shards,
+        "owned": sorted(shard_coordinator.owned),
+        "shards": await asyncio.to_thread(shard_coordinator.status) if shard_coordinator.enabled else [],
+    }
 
-            # Query MongoDB using the Python datetime object, NOT an ISO string
-            recent_queries = list(query_logs_collection.find({
-                "userId": user_id,
-                "timestamp": {"$gte": time_threshold} 
-            }))
 
-            if len(recent_queries) == 0:
-                # print(f"User {user_id}: No recent queries. Skipping.")
-                continue
+@app.get("/clusters")
+async def prompt_clusters(limit: int = 20):
+    """Groups of users sending near-identical prompts in the current window."""
+    def read_clusters():
+        with cycle_lock:
+            return scoring_engine.top_clusters(limit)
 
-            print(f"User {user_id}: Found {len(recent_queries)} recent queries. Old score: {old_score}")
+    return {
+        "enabled": scoring_engine.cluster_index is not None,
+        "clusters": await asyncio.to_thread(read_clusters),
+    }
 
-            new_score = calculate_suspicion_score(
-                recent_queries=recent_queries,
-                analysis_window_minutes=analysis_window_minutes
-            )
-            
-            print(f"User {user_id}: New score: {new_score}")
 
-            users_collection.update_one(
-                {"userId": user_id},
-                {"$set": {"suspicion_score": new_score, "last_seen": datetime.now(timezone.utc)}}
-            )
-            users_updated += 1
+@app.get("/checkpoint")
+async def checkpoint_status():
+    """Warm-restart checkpoint settings and the last save and restore."""
+    return checkpointer.status()
+
+
+@app.get("/retention")
+async def retention_status():
+    """Query log compactor settings and progress."""
+    return query_log_compactor.status()
+
+
+def sync_shard_ownership() -> None:
+    """
+    Start over with a fresh engine when this instance's shards changed.
+
+    The next cycle bootstraps the new engine from a full window of logs, so
+    users of newly claimed shards are scored on their whole history and users
+    of released shards are dropped. Caller holds cycle_lock.
+    """
+    global scoring_engine, scoring_engine_generation
+    generation = shard_coordinator.generation
+    if generation == scoring_engine_generation:
+        return
+    logger.info("Shard ownership changed to %s; rebuilding windows", sorted(shard_coordinator.owned))
+    scoring_engine = new_scoring_engine()
+    scoring_engine_generation = generation
+
+
+def export_window_gauges() -> None:
+    report = scoring_engine.memory_report()
+    metrics.set_gauge("active_users", report["users"])
+    metrics.set_gauge("window_entries", report["entries"])
+    metrics.set_gauge("interned_prompts", report["interned_prompts"])
+    metrics.set_gauge("window_store_bytes", report["total_bytes"])
+    if "similarity_cache" in report:
+        metrics.set_gauge("similarity_cache_bytes", report["similarity_cache"]["bytes"])
+        metrics.set_gauge("similarity_cache_hit_rate", report["similarity_cache"]["hit_rate"])
+    if "cluster_index" in report:
+        metrics.set_gauge("cluster_index_prompts", report["cluster_index"]["prompts"])
+        metrics.set_gauge("cluster_index_bytes", report["cluster_index"]["bytes"])
+
+
+def apply_scores(scores: dict) -> tuple:
+    """
+    Persist new scores and queue users that crossed into Tier 3.
+
+    Returns:
+        tuple: (users_updated, flagged_count)
+    """
+    flagged_count = 0
+    try:
+        old_scores = store.fetch_scores(users_collection, scores)
+        new_scores = {user_id: score for user_id, score in scores.items() if user_id in old_scores}
+
+        # Flags are queued before the score write: if the write fails the user
+        # is re-scored and re-queued next cycle, and logThreat.js skips users
+        # that are already on chain.
+        for user_id, new_score in new_scores.items():
+            old_score = old_scores[user_id]
+
+            logger.debug("User %s: Old score: %s. New score: %s", user_id, old_score, new_score)
 
             # As per blueprint: trigger on crossing the threshold
             if new_score >= 0.95 and old_score < 0.95:
-                print(f"FLAGGING TIER 3: User {user_id} crossed threshold. Logging to blockchain...")
-                ok = log_threat_to_blockchain(user_id)
-                if ok:
-                    flagged_count += 1
+                logger.warning("FLAGGING TIER 3: User %s crossed threshold. Queued for blockchain logging.", user_id)
+                threat_outbox.enqueue(user_id, new_score)
+                flagged_count += 1
             elif new_score >= 0.95:
-                 print(f"User {user_id} remains at TIER 3. (Already logged).")
+                logger.debug("User %s remains at TIER 3. (Already logged).", user_id)
+
+        written_at = datetime.now(timezone.utc)
+        users_updated = store.write_scores(users_collection, new_scores, written_at)
+        metrics.inc("users_updated_total", users_updated)
+        metrics.inc("users_flagged_total", flagged_count)
+    except Exception:
+        # Nothing was persisted; score these users again next cycle
+        scoring_engine.mark_dirty(scores)
+        raise
+
+    updated_at = int(written_at.timestamp() * 1000)
+    changes = [
+        (user_id, score, get_tier(score), updated_at)
+        for user_id, score in new_scores.items()
+        if score != old_scores[user_id]
+    ]
+    if changes:
+        score_feed.publish(changes)
+        metrics.inc("score_events_published_total", len(changes))
+    return users_updated, flagged_count
+
+
+def process_streamed_logs(logs: list) -> None:
+    """
+    Ingest and score query_logs inserts delivered by the change feed.
+
+    Only the users in this batch are expired and re-scored; the periodic
+    /run_analysis sweep still expires everyone else and catches up on
+    anything the stream missed. Runs on the change feed's thread.
+    """
+    with cycle_lock, metrics.timer(STAGE_STREAM):
+        sync_shard_ownership()
+        if scoring_engine.high_water_mark is None:
+            # Nothing loaded yet. These logs are already in query_logs, so a
+            # full bootstrap cycle covers them along with the rest of the window.
+            _run_analysis_cycle()
+            return
+
+        added = scoring_engine.ingest(logs)
+        metrics.inc("logs_ingested_total", added)
+        if not added:
+            return
+        scoring_engine.expire(datetime.now(timezone.utc), {log["userId"] for log in logs})
+        export_window_gauges()
+
+        scores = scoring_engine.rescore(budget_seconds=ANALYSIS_BUDGET_SECONDS)
+        metrics.set_gauge("scoring_backlog", scoring_engine.backlog)
+        with metrics.timer(STAGE_WRITE_BACK):
+            users_updated, flagged_count = apply_scores(scores)
+        logger.debug("Streamed %d logs: %d users updated, %d flagged", added, users_updated, flagged_count)
+
+
+# Scores users as their query logs are inserted, when DETECTOR_CHANGE_STREAM is on
+change_feed = QueryLogChangeFeed(query_logs_collection, db["detector_state"], process_streamed_logs)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+# The cycle currently running, which overlapping /run_analysis calls join
+analysis_task = None
 
 
-        print("="*60)
-        print(f"ANALYSIS CYCLE COMPLETE. Users updated: {users_updated}. New threats flagged: {flagged_count}")
-        print("="*60 + "\n")
+@app.post("/run_analysis", response_model=AnalysisResponse)
+async def run_analysis():
+    # pymongo calls and scoring block, so the cycle runs in a worker thread
+    # (scoring itself fans out to the process pool) and the event loop stays
+    # free to answer /health while it runs.
+    global analysis_task
+    joined = analysis_task is not None and not analysis_task.done()
+    if joined:
+        metrics.inc("cycles_joined_total")
+    else:
+        analysis_task = asyncio.create_task(asyncio.to_thread(run_analysis_cycle))
+    # A caller that disconnects must not cancel the cycle the others wait for
+    response = await asyncio.shield(analysis_task)
+    return response.model_copy(update={"joined": True}) if joined else response
+
+
+def run_analysis_cycle() -> AnalysisResponse:
+    with cycle_lock, metrics.timer(STAGE_CYCLE):
+        response = _run_analysis_cycle()
+    save_checkpoint()
+    return response
+
+
+def checkpoint_shards() -> dict:
+    return {"num_shards": shard_coordinator.num_shards, "shards": sorted(shard_coordinator.owned)}
+
+
+def save_checkpoint(force: bool = False) -> None:
+    """
+    Save the engine when a checkpoint is due. The state is copied under
+    cycle_lock; writing the file happens after the lock is released.
+    """
+    if not checkpointer.enabled or not (force or checkpointer.due()):
+        return
+    with cycle_lock:
+        # While restored windows are still loading, the file being restored is the latest state
+        if scoring_engine.high_water_mark is None or scoring_engine.window_store.pending is not None:
+            return
+        captured = checkpointer.capture(scoring_engine, checkpoint_shards())
+    try:
+        checkpointer.save(captured)
+        metrics.inc("checkpoints_saved_total")
+    except OSError:
+        logger.exception("Could not write checkpoint %s", checkpointer.path)
+
+
+def restore_checkpoint() -> dict:
+    """
+    Load the last checkpoint and ingest the logs written after it, so the
+    first cycle only scores users with new logs. A checkpoint taken while
+    this instance owned other shards is not used.
+
+    Returns:
+        dict: Restore stats, or None if nothing was restored
+    """
+    shards = checkpoint_shards()
+
+    def same_shards(header: dict) -> bool:
+        return header.get("num_shards", 1) == shards["num_shards"] and \
+            set(shards["shards"]) <= set(header.get("shards", []))
+
+    global scoring_engine
+    with cycle_lock:
+        sync_shard_ownership()
+        now = datetime.now(timezone.utc)
+        accept = same_shards if shard_coordinator.enabled else None
+        if checkpointer.restore(scoring_engine, now, accept=accept) is None:
+            return None
+        try:
+            tail_logs = scoring_engine.ingest(
+                store.iter_new_logs(query_logs_collection, scoring_engine.cursor_filter(now))
+            )
+        except Exception:
+            # Start cold rather than from windows with a gap in them
+            logger.exception("Could not read the logs after the checkpoint")
+            scoring_engine = new_scoring_engine()
+            return None
+        scoring_engine.expire(now)
+        export_window_gauges()
+        if scoring_engine.window_store.pending is not None:
+            threading.Thread(target=load_restored_windows, args=(scoring_engine,),
+                             name="checkpoint-load", daemon=True).start()
+    return dict(checkpointer.last_restored, tail_logs=tail_logs)
+
+
+def load_restored_windows(engine) -> None:
+    """
+    Load the restored checkpoint's windows a chunk at a time, letting cycles
+    run in between. Stops if the engine was replaced (shard ownership changed).
+    """
+    while True:
+        with cycle_lock:
+            if scoring_engine is not engine or not checkpointer.load_pending(engine):
+                break
+        # Let a waiting cycle take the lock
+        time.sleep(0)
+    with cycle_lock:
+        if scoring_engine is engine:
+            export_window_gauges()
+    loaded = checkpointer.last_restored
+    logger.info("Loaded %d restored user windows (%d entries) in %.3fs",
+                loaded["loaded_users"], loaded["entries"], loaded["load_seconds"])
+
+
+def _run_analysis_cycle() -> AnalysisResponse:
+    try:
+        now = datetime.now(timezone.utc)
+        logger.info("STARTING DETECTION ANALYSIS CYCLE: %s", now)
+        metrics.inc("cycles_total")
+        sync_shard_ownership()
+
+        # Only pull logs inserted since the previous cycle; the engine keeps
+        # the rest of each user's window in memory.
+        with metrics.timer(STAGE_FETCH):
+            if scoring_engine.high_water_mark is None:
+                since = now - timedelta(minutes=ANALYSIS_WINDOW_MINUTES)
+                new_count = scoring_engine.bootstrap(store.fetch_window_logs(query_logs_collection, since))
+            else:
+                new_count = scoring_engine.ingest(
+                    store.iter_new_logs(query_logs_collection, scoring_engine.cursor_filter(now))
+                )
+            scoring_engine.expire(now)
+        metrics.inc("logs_ingested_total", new_count)
+        export_window_gauges()
+        logger.info("Ingested %d new logs. Tracking %d active users.", new_count, len(scoring_engine.windows))
+
+        # Re-score only users whose window changed since the last cycle,
+        # most urgent first, carrying over what the budget does not cover
+        scores = scoring_engine.rescore(now, ANALYSIS_BUDGET_SECONDS)
+        rescore_stats = scoring_engine.last_rescore
+        metrics.set_gauge("scoring_backlog", scoring_engine.backlog)
+        if not scores:
+            logger.info("No user windows changed since the last cycle.")
+        elif scoring_engine.backlog:
+            logger.warning("Scoring budget of %.1fs spent after %d users; %d carried over to the next cycle",
+                           ANALYSIS_BUDGET_SECONDS, len(scores), scoring_engine.backlog)
+
+        with metrics.timer(STAGE_WRITE_BACK):
+            users_updated, flagged_count = apply_scores(scores)
+
+        logger.info("ANALYSIS CYCLE COMPLETE. Users updated: %d. New threats flagged: %d",
+                    users_updated, flagged_count)
+
+        if shard_coordinator.enabled:
+            shard_coordinator.record_progress({
+                "instance_id": shard_coordinator.instance_id,
+                "cycle_at": now,
+                "logs_ingested": new_count,
+                "active_users": len(scoring_engine.windows),
+                "users_updated": users_updated,
+                "flagged_count": flagged_count,
+            })
 
         return AnalysisResponse(
             status="complete",
             users_updated=users_updated,
             flagged_count=flagged_count,
-            message="Analysis finished"
+            message="Analysis finished",
+            shards=sorted(shard_coordinator.owned),
+            backlog=scoring_engine.backlog,
+            budget_seconds=ANALYSIS_BUDGET_SECONDS,
+            budget_used_seconds=round(rescore_stats["elapsed_seconds"], 3)
         )
 
     except Exception as e:
-        print(f"ERROR: {e}")
+        logger.exception("Analysis cycle failed")
+        metrics.inc("cycle_errors_total")
         return AnalysisResponse(
             status="error",
             users_updated=0,
@@ -0,0 +1,131 @@
+"""
+In-process instrumentation for the detector.
+
+Counters, gauges and per-stage timing histograms, rendered in the Prometheus
+text exposition format by the /metrics endpoint. Recording is a dict update
+under a lock, so it is cheap enough to leave on in the hot path.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+METRIC_PREFIX = "sentinel_detector"
+
+# Histogram buckets (seconds) for stage timings
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stages of an analysis cycle
+STAGE_FETCH = "fetch"
+STAGE_VELOCITY = "velocity"
+STAGE_SIMILARITY = "similarity"
+# Cross-user cluster lookups (see cluster_index.py)
+STAGE_CLUSTER = "cluster"
+STAGE_WRITE_BACK = "write_back"
+STAGE_BLOCKCHAIN = "blockchain"
+STAGE_CYCLE = "cycle"
+# Scoring one batch of change-stream inserts (see change_feed.py)
+STAGE_STREAM = "stream_batch"
+
+
+class Metrics:
+    """Thread-safe registry of counters, gauges and stage histograms."""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._help = {}
+        self._stages = {}
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = [[0] * len(self.buckets), 0.0, 0]
+            bucket_counts = stats[0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    bucket_counts[i] += 1
+            stats[1] += seconds
+            stats[2] += 1
+
+    @contextmanager
+    def timer(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        """Plain-dict copy of every value, for JSON responses and benchmarks."""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "stages": {
+                    stage: {"count": count, "sum_seconds": total}
+                    for stage, (_, total, count) in self._stages.items()
+                },
+            }
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                full_name = f"{METRIC_PREFIX}_{name}"
+                if name in self._help:
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} counter")
+                lines.append(f"{full_name} {value}")
+
+            for name, value in sorted(self._gauges.items()):
+                full_name = f"{METRIC_PREFIX}_{name}"
+                if name in self._help:
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} gauge")
+                lines.append(f"{full_name} {value}")
+
+            if self._stages:
+                full_name = f"{METRIC_PREFIX}_stage_seconds"
+                lines.append(f"# HELP {full_name} Time spent per analysis stage")
+                lines.append(f"# TYPE {full_name} histogram")
+                for stage, (bucket_counts, total, count) in sorted(self._stages.items()):
+                    for bound, bucket_count in zip(self.buckets, bucket_counts):
+                        lines.append(f'{full_name}_bucket{{stage="{stage}",le="{bound}"}} {bucket_count}')
+                    lines.append(f'{full_name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+                    lines.append(f'{full_name}_sum{{stage="{stage}"}} {total}')
+                    lines.append(f'{full_name}_count{{stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("cycles_total", "Analysis cycles run")
+metrics.describe("cycle_errors_total", "Analysis cycles that failed")
+metrics.describe("logs_ingested_total", "Query logs added to the in-memory windows")
+metrics.describe("users_scored_total", "User windows re-scored")
+metrics.describe("users_updated_total", "User score documents written")
+metrics.describe("users_flagged_total", "Users queued for blockchain logging")
+metrics.describe("threats_logged_total", "Threats confirmed on the blockchain")
+metrics.describe("threats_failed_total", "Failed blockchain logging attempts")
+metrics.describe("score_events_published_total", "Score changes published on /scores/stream")
+metrics.describe("stream_events_total", "Query log inserts received from the change stream")
+metrics.describe("active_users", "Users with at least one query in the analysis window")
+metrics.describe("window_entries", "Query entries held in the in-memory windows")
+metrics.describe("interned_prompts", "Distinct prompts held in the in-memory windows")
+metrics.describe("window_store_bytes", "Estimated memory held by the in-memory windows")
+metrics.describe("similarity_cache_bytes", "Estimated memory held by the prompt similarity cache")
+metrics.describe("similarity_cache_hit_rate", "Share of prompt similarity lookups served from the cache")
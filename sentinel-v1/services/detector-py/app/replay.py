@@ -0,0 +1,601 @@
+"""
+Offline replay of archived query_logs through the scoring engine.
+
+Tuning the thresholds and weights in scoring.py used to mean trying them on
+live traffic. The replay feeds exported logs to the same ScoringEngine the
+detector runs, cycle by simulated cycle, and writes what the detector would
+have decided to --out:
+
+    timeline-<partition>.jsonl  {userId, at, score, tier} for every user
+                                re-scored in a cycle, in time order
+    events.jsonl                {userId, at, from_tier, to_tier, score} for
+                                every tier change, in time order
+    summary.json                settings, record counts and timings
+
+Inputs are the compactor's daily archives (query_logs-<day>.jsonl.gz, see
+retention.py), mongoexport JSONL (plain or gzip) and mongodump BSON
+(query_logs.bson, plain or --gzip); directories are read in file name order.
+
+Two parallel passes stream the logs, so memory does not grow with their size:
+
+    1. split   Each input file (plain JSONL: each RANGE_BYTES slice of it) is
+               read by one worker, which only extracts the userId of every
+               record and appends the record, still encoded, to a spill file
+               of the user's partition (sharding.shard_of).
+    2. replay  Each partition is replayed by one worker: its spill files are
+               decoded in input order, put in timestamp order through a
+               reorder buffer of --max-lateness seconds and fed to a
+               ScoringEngine, which runs a cycle (ingest, expire, rescore)
+               every --cycle-seconds of log time, as the gateway's sweep does.
+
+A replay worker holds the engine's windows (the users active within the
+analysis window), the reorder buffer and the tiers of the users above Tier 1.
+The spill files take about the uncompressed size of the input on disk and
+are removed at the end.
+
+Inputs are expected in about timestamp order, as archives and dumps are
+(insertion order). A record more than --max-lateness seconds older than the
+newest one seen is skipped and counted as late, as the live detector skips
+logs arriving more than LATE_ARRIVAL_GRACE_SECONDS behind its high-water mark.
+
+Each partition is scored like one shard of a sharded detector: the
+cross-user cluster signal (cluster_index.py) only sees the partition's own
+users. --partitions 1 replays a single unsharded instance.
+
+Settings come from the environment as for the detector (SIMILARITY_BACKEND,
+VELOCITY_MODE, VELOCITY_WINDOWS, CLUSTER_*, ...). The scoring.py constants
+can be overridden with --set. The exact similarity backend compares prompts
+with difflib; replay production volumes with --similarity minhash.
+
+Usage (from services/detector-py):
+    python -m app.replay /var/archive/query_logs --out replay --set SIMILARITY_THRESHOLD_BOT=0.6
+    python -m app.replay dump/sentinel/query_logs.bson --out replay --similarity minhash --workers 8
+"""
+import argparse
+import contextlib
+import functools
+import gzip
+import heapq
+import json
+import math
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import bson
+from bson import json_util
+from bson.errors import BSONError
+
+from . import scheduler, scoring
+from .cluster_index import CLUSTER_DETECTION
+from .engine import ScoringEngine
+from .sharding import shard_of
+from .velocity import VELOCITY_MODE
+
+# scoring.py constants --set may override
+TUNABLE_SETTINGS = (
+    "VELOCITY_THRESHOLD_NORMAL",
+    "VELOCITY_THRESHOLD_BOT",
+    "SIMILARITY_THRESHOLD_NORMAL",
+    "SIMILARITY_THRESHOLD_BOT",
+    "VELOCITY_WEIGHT",
+    "SIMILARITY_WEIGHT",
+    "TIER_2_THRESHOLD",
+    "TIER_3_THRESHOLD",
+)
+# main.ANALYSIS_WINDOW_MINUTES and the gateway's sweep interval
+REPLAY_WINDOW_MINUTES = 5.0
+REPLAY_CYCLE_SECONDS = float(os.getenv("DETECTOR_SWEEP_INTERVAL_MS", "60000")) / 1000
+REPLAY_MAX_LATENESS_SECONDS = 60.0
+# Plain JSONL inputs are split in slices of this size
+RANGE_BYTES = 256 << 20
+SPILL_BUFFER_BYTES = 1 << 20
+# userId -> partition entries a split worker caches before starting over
+PARTITION_CACHE_USERS = 100_000
+
+INPUT_SUFFIXES = (".jsonl", ".json", ".jsonl.gz", ".json.gz", ".bson", ".bson.gz")
+# A string userId, read without decoding the record. An escaped quote in the
+# value (or a non-string userId) falls back to decoding.
+_JSON_USER_ID = re.compile(rb'"userId"\s*:\s*"([^"\\]*)"')
+# BSON string element named userId: type 0x02, name, int32 length, value
+_BSON_USER_ID = b"\x02userId\x00"
+
+
+def list_inputs(paths) -> list:
+    """Input files in replay order: as given, directories expanded in name order."""
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(p for p in path.iterdir() if p.is_file() and p.name.endswith(INPUT_SUFFIXES)))
+        else:
+            files.append(path)
+    return files
+
+
+def is_bson(path: Path) -> bool:
+    return path.name.endswith((".bson", ".bson.gz"))
+
+
+def _open(path: Path):
+    return gzip.open(path, "rb") if path.suffix == ".gz" else open(path, "rb")
+
+
+def split_tasks(files, range_bytes: int = RANGE_BYTES) -> list:
+    """(task index, path, start, end) per input slice, in replay order; end None = to the end."""
+    slices = []
+    for path in files:
+        size = path.stat().st_size
+        if path.suffix == ".gz" or is_bson(path) or size <= range_bytes:
+            slices.append((str(path), 0, None))
+        else:
+            slices.extend((str(path), start, min(size, start + range_bytes)) for start in range(0, size, range_bytes))
+    return [(index, *task) for index, task in enumerate(slices)]
+
+
+def iter_json_lines(path: Path, start: int = 0, end: int = None):
+    """Non-empty lines of a JSONL file that start in [start, end), newline-terminated."""
+    with _open(path) as f:
+        position = start
+        if start:
+            # The line running across start belongs to the previous slice
+            f.seek(start - 1)
+            position = start - 1 + len(f.readline())
+        for line in f:
+            if end is not None and position >= end:
+                break
+            position += len(line)
+            if not line.strip():
+                continue
+            yield line if line.endswith(b"\n") else line + b"\n"
+
+
+def iter_bson_documents(path: Path):
+    """Encoded documents of a mongodump BSON file."""
+    with _open(path) as f:
+        while True:
+            head = f.read(4)
+            if not head:
+                return
+            size = int.from_bytes(head, "little")
+            body = f.read(size - 4)
+            if len(head) < 4 or len(body) < size - 4:
+                raise ValueError(f"{path}: truncated BSON document")
+            yield head + body
+
+
+def _user_id_of(log) -> str:
+    user_id = log.get("userId") if isinstance(log, dict) else None
+    return None if user_id is None else str(user_id)
+
+
+def json_user_id(line: bytes) -> str:
+    match = _JSON_USER_ID.search(line)
+    if match is not None:
+        return match.group(1).decode("utf-8")
+    return _user_id_of(json_util.loads(line))
+
+
+def bson_user_id(document: bytes) -> str:
+    # Logs are written with userId near the front, ahead of the prompt and answers
+    at = document.find(_BSON_USER_ID)
+    if at == -1:
+        return _user_id_of(bson.decode(document))
+    start = at + len(_BSON_USER_ID) + 4
+    size = int.from_bytes(document[start - 4:start], "little")
+    return document[start:start + size - 1].decode("utf-8")
+
+
+def decode_json_log(line: bytes) -> dict:
+    """
+    A JSONL log as json_util.loads decodes it, except that only the Extended
+    JSON fields the replay reads (_id, userId, timestamp) are converted.
+    """
+    log = json.loads(line)
+    if not isinstance(log, dict):
+        raise ValueError("Not a document")
+    for field in ("_id", "userId", "timestamp"):
+        value = log.get(field)
+        if isinstance(value, dict):
+            log[field] = _extended_json_value(value)
+    return log
+
+
+def _extended_json_value(value: dict):
+    date = value.get("$date")
+    if isinstance(date, str) and len(value) == 1:
+        # Relaxed ISO dates (the archives' format) without json_util's strptime
+        with contextlib.suppress(ValueError):
+            return datetime.fromisoformat(date)
+    if any(isinstance(inner, dict) for inner in value.values()):
+        # e.g. canonical {"$date": {"$numberLong": ...}}, converted inside out
+        return json_util.loads(json.dumps(value))
+    return json_util.object_hook(value)
+
+
+def partition_dir(spill_dir, partition: int) -> Path:
+    return Path(spill_dir) / f"{partition:04d}"
+
+
+def split_input(task, spill_dir, partitions: int) -> dict:
+    """Split pass over one input slice: append each record to its user's partition."""
+    index, path, start, end = task
+    path = Path(path)
+    if is_bson(path):
+        records, user_id_of, suffix = iter_bson_documents(path), bson_user_id, "bson"
+    else:
+        records, user_id_of, suffix = iter_json_lines(path, start, end), json_user_id, "jsonl"
+
+    counts = {"records": 0, "unreadable": 0}
+    partition_of = {}
+    spills = {}
+    try:
+        for record in records:
+            try:
+                user_id = user_id_of(record)
+            except (ValueError, BSONError):
+                user_id = None
+            if user_id is None:
+                counts["unreadable"] += 1
+                continue
+            partition = partition_of.get(user_id)
+            if partition is None:
+                if len(partition_of) >= PARTITION_CACHE_USERS:
+                    partition_of.clear()
+                partition = partition_of[user_id] = shard_of(user_id, partitions)
+            spill = spills.get(partition)
+            if spill is None:
+                spill = spills[partition] = open(partition_dir(spill_dir, partition) / f"{index:06d}.{suffix}",
+                                                 "wb", buffering=SPILL_BUFFER_BYTES)
+            spill.write(record)
+            counts["records"] += 1
+    finally:
+        for spill in spills.values():
+            spill.close()
+    return counts
+
+
+def _iso_millis(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class PartitionReplay:
+    """Replay pass over one partition: its own ScoringEngine, timeline and event files."""
+
+    def __init__(self, partition: int, settings: dict):
+        self.partition = partition
+        self.spill_dir = settings["spill_dir"]
+        self.cycle_seconds = settings["cycle_seconds"]
+        self.max_lateness = settings["max_lateness"]
+        self.budget_seconds = settings["budget_seconds"] or None
+        self.engine = ScoringEngine(window_minutes=settings["window_minutes"],
+                                    similarity_backend=settings["similarity_backend"])
+        out = Path(settings["out"])
+        self.events_path = out / f"events-{partition:04d}.jsonl"
+        self.timeline_path = out / f"timeline-{partition:04d}.jsonl" if settings["timeline"] else None
+
+        self.base_tier = scoring.get_tier(0.0)
+        # userId -> tier, for users above the base tier only
+        self.tiers = {}
+        self.next_cycle = None
+        # Logs for the next cycle, in timestamp order
+        self.batch = []
+        self.events = None
+        self.timeline = None
+        self.counts = {
+            "records": 0, "unreadable": 0, "ignored": 0, "late": 0, "duplicates": 0, "ingested": 0,
+            "cycles": 0, "scored": 0, "events": 0, "peak_windows": 0,
+        }
+        self.first_log = None
+        self.last_log = None
+
+    def run(self) -> dict:
+        started = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            self.events = stack.enter_context(open(self.events_path, "w", encoding="utf-8"))
+            if self.timeline_path is not None:
+                self.timeline = stack.enter_context(open(self.timeline_path, "w", encoding="utf-8"))
+            for epoch, log in self._in_order(self._decoded()):
+                self._advance(epoch)
+                self.batch.append(log)
+            if self.batch:
+                self._cycle(self.next_cycle)
+
+        tiers = {}
+        for tier in self.tiers.values():
+            tiers[str(tier)] = tiers.get(str(tier), 0) + 1
+        return dict(self.counts, partition=self.partition, tiers_at_end=tiers, first_log=self.first_log,
+                    last_log=self.last_log, seconds=time.perf_counter() - started)
+
+    def _decoded(self):
+        """Decoded logs of the partition's spill files, in input order."""
+        for path in sorted(partition_dir(self.spill_dir, self.partition).iterdir()):
+            if path.suffix == ".bson":
+                records, decode = iter_bson_documents(path), bson.decode
+            else:
+                records, decode = iter_json_lines(path), decode_json_log
+            for record in records:
+                self.counts["records"] += 1
+                try:
+                    yield decode(record)
+                except (ValueError, BSONError):
+                    self.counts["unreadable"] += 1
+
+    def _in_order(self, logs):
+        """(epoch, log) in timestamp order, as far as the reorder buffer allows."""
+        heap = []
+        newest = None
+        emitted = None
+        for seq, log in enumerate(logs):
+            ts = log.get("timestamp")
+            if not isinstance(ts, datetime):
+                # e.g. the gateway's access logs (ISO strings), which the detector ignores too
+                self.counts["ignored"] += 1
+                continue
+            if ts.tzinfo is None:
+                ts = ts.replace(tzinfo=timezone.utc)
+            epoch = ts.timestamp()
+            if emitted is not None and epoch < emitted:
+                self.counts["late"] += 1
+                continue
+            user_id = log["userId"]
+            heapq.heappush(heap, (epoch, seq, {
+                "_id": log.get("_id", seq),
+                "userId": user_id if isinstance(user_id, str) else str(user_id),
+                "timestamp": ts,
+                "prompt": log.get("prompt", ""),
+            }))
+            if newest is None or epoch > newest:
+                newest = epoch
+            while heap[0][0] < newest - self.max_lateness:
+                emitted, _, oldest = heapq.heappop(heap)
+                yield emitted, oldest
+        while heap:
+            emitted, _, oldest = heapq.heappop(heap)
+            yield emitted, oldest
+
+    def _advance(self, epoch: float) -> None:
+        """Run the cycles due before a log at epoch arrives."""
+        if self.first_log is None:
+            self.first_log = _iso_millis(epoch)
+        self.last_log = _iso_millis(epoch)
+        # A cycle at t ingests the logs up to and including t
+        while self.next_cycle is None or epoch > self.next_cycle:
+            if not self.batch and not self.engine.windows:
+                # Nothing to score until this log: skip to its cycle
+                self.next_cycle = math.ceil(epoch / self.cycle_seconds) * self.cycle_seconds
+                break
+            self._cycle(self.next_cycle)
+            self.next_cycle += self.cycle_seconds
+
+    def _cycle(self, epoch: float) -> None:
+        now = datetime.fromtimestamp(epoch, timezone.utc)
+        added = self.engine.ingest(self.batch)
+        self.counts["ingested"] += added
+        self.counts["duplicates"] += len(self.batch) - added
+        self.batch = []
+        self.counts["peak_windows"] = max(self.counts["peak_windows"], len(self.engine.windows))
+        self.engine.expire(now)
+        scores = self.engine.rescore(now, self.budget_seconds)
+        self.counts["cycles"] += 1
+        self.counts["scored"] += len(scores)
+
+        at = _iso_millis(epoch)
+        for user_id, score in scores.items():
+            score = round(float(score), 4)
+            tier = scoring.get_tier(score)
+            if self.timeline is not None:
+                self.timeline.write(json.dumps({"userId": user_id, "at": at, "score": score, "tier": tier}) + "\n")
+            previous = self.tiers.get(user_id, self.base_tier)
+            if tier == previous:
+                continue
+            self.events.write(json.dumps({
+                "userId": user_id, "at": at, "from_tier": previous, "to_tier": tier, "score": score,
+            }) + "\n")
+            self.counts["events"] += 1
+            if tier == self.base_tier:
+                del self.tiers[user_id]
+            else:
+                self.tiers[user_id] = tier
+
+
+def replay_partition(partition: int, settings: dict) -> dict:
+    return PartitionReplay(partition, settings).run()
+
+
+def parse_overrides(items) -> dict:
+    """
+    --set NAME=VALUE pairs into {NAME: float}.
+
+    Raises:
+        ValueError: on an unknown name, a value that is not a number or a
+                    normal threshold not below its bot threshold
+    """
+    overrides = {}
+    for item in items or ():
+        name, _, value = item.partition("=")
+        name = name.strip().upper()
+        if name not in TUNABLE_SETTINGS:
+            raise ValueError(f"Unknown setting {name!r} (one of {', '.join(TUNABLE_SETTINGS)})")
+        overrides[name] = float(value)
+    for normal, bot in (("VELOCITY_THRESHOLD_NORMAL", "VELOCITY_THRESHOLD_BOT"),
+                        ("SIMILARITY_THRESHOLD_NORMAL", "SIMILARITY_THRESHOLD_BOT"),
+                        ("TIER_2_THRESHOLD", "TIER_3_THRESHOLD")):
+        if overrides.get(normal, getattr(scoring, normal)) >= overrides.get(bot, getattr(scoring, bot)):
+            raise ValueError(f"{normal} must be below {bot}")
+    return overrides
+
+
+def apply_overrides(overrides: dict) -> None:
+    """Set the overridden scoring.py constants in this process (scoring reads them per call)."""
+    for name, value in overrides.items():
+        setattr(scoring, name, value)
+    scheduler.TIER_BOUNDARIES = (scoring.TIER_2_THRESHOLD, scoring.TIER_3_THRESHOLD)
+
+
+def merge_events(paths, target: Path) -> int:
+    """Merge the partitions' event files (each in time order) into target, removing them."""
+    count = 0
+    with contextlib.ExitStack() as stack:
+        files = [stack.enter_context(open(path, encoding="utf-8")) for path in paths]
+        with open(target, "w", encoding="utf-8") as merged:
+            for line in heapq.merge(*files, key=lambda line: json.loads(line)["at"]):
+                merged.write(line)
+                count += 1
+    for path in paths:
+        Path(path).unlink()
+    return count
+
+
+def run(inputs, out, partitions: int, workers: int, overrides: dict = None, window_minutes: float = REPLAY_WINDOW_MINUTES,
+        cycle_seconds: float = REPLAY_CYCLE_SECONDS, max_lateness: float = REPLAY_MAX_LATENESS_SECONDS,
+        similarity_backend: str = None, budget_seconds: float = 0.0, timeline: bool = True,
+        spill_dir=None, keep_spill: bool = False) -> dict:
+    """
+    Replay inputs (files or directories) into the out directory.
+
+    Returns:
+        dict: The summary also written to out/summary.json
+    """
+    overrides = overrides or {}
+    files = list_inputs(inputs)
+    if not files:
+        raise ValueError("No input files")
+    out = Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    spill_dir = Path(tempfile.mkdtemp(prefix="replay-spill-", dir=spill_dir or out))
+    for partition in range(partitions):
+        partition_dir(spill_dir, partition).mkdir()
+
+    settings = {
+        "spill_dir": str(spill_dir), "out": str(out), "window_minutes": window_minutes,
+        "cycle_seconds": cycle_seconds, "max_lateness": max_lateness, "budget_seconds": budget_seconds,
+        "similarity_backend": similarity_backend or scoring.SIMILARITY_BACKEND, "timeline": timeline,
+    }
+    tasks = split_tasks(files)
+    split_counts = {"records": 0, "unreadable": 0}
+    results = []
+    started = time.perf_counter()
+    try:
+        with contextlib.ExitStack() as stack:
+            if workers > 1:
+                pool = stack.enter_context(multiprocessing.get_context("spawn").Pool(
+                    workers, initializer=apply_overrides, initargs=(overrides,)
+                ))
+                map_tasks = functools.partial(pool.imap_unordered, chunksize=1)
+            else:
+                apply_overrides(overrides)
+                map_tasks = map
+
+            for counts in map_tasks(functools.partial(split_input, spill_dir=spill_dir, partitions=partitions), tasks):
+                for key, value in counts.items():
+                    split_counts[key] += value
+            split_seconds = time.perf_counter() - started
+
+            results = list(map_tasks(functools.partial(replay_partition, settings=settings), range(partitions)))
+            replay_seconds = time.perf_counter() - started - split_seconds
+    finally:
+        if not keep_spill:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+    results.sort(key=lambda result: result["partition"])
+    merge_events([out / f"events-{result['partition']:04d}.jsonl" for result in results], out / "events.jsonl")
+
+    totals = {key: sum(result[key] for result in results)
+              for key in ("records", "ignored", "late", "duplicates", "ingested", "scored", "events")}
+    tiers_at_end = {}
+    for result in results:
+        for tier, count in result["tiers_at_end"].items():
+            tiers_at_end[tier] = tiers_at_end.get(tier, 0) + count
+    first_logs = [result["first_log"] for result in results if result["first_log"]]
+    last_logs = [result["last_log"] for result in results if result["last_log"]]
+    elapsed = time.perf_counter() - started
+    summary = {
+        "inputs": [str(path) for path in files],
+        "partitions": partitions,
+        "workers": workers,
+        "window_minutes": window_minutes,
+        "cycle_seconds": cycle_seconds,
+        "max_lateness_seconds": max_lateness,
+        "budget_seconds": budget_seconds,
+        "similarity_backend": settings["similarity_backend"],
+        "velocity_mode": VELOCITY_MODE,
+        "cluster_detection": CLUSTER_DETECTION,
+        "settings": {name: overrides.get(name, getattr(scoring, name)) for name in TUNABLE_SETTINGS},
+        "overridden": sorted(overrides),
+        "first_log": min(first_logs, default=None),
+        "last_log": max(last_logs, default=None),
+        "records": totals["records"],
+        "unreadable": split_counts["unreadable"] + sum(result["unreadable"] for result in results),
+        "ignored": totals["ignored"],
+        "late": totals["late"],
+        "duplicates": totals["duplicates"],
+        "ingested": totals["ingested"],
+        "cycles": max((result["cycles"] for result in results), default=0),
+        "scored": totals["scored"],
+        "tier_changes": totals["events"],
+        "tiers_at_end": tiers_at_end,
+        "peak_windows": sum(result["peak_windows"] for result in results),
+        "split_seconds": split_seconds,
+        "replay_seconds": replay_seconds,
+        "elapsed_seconds": elapsed,
+        "records_per_second": totals["records"] / elapsed if elapsed > 0 else None,
+    }
+    with open(out / "summary.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.replay", description=__doc__.split("\n\n")[0])
+    parser.add_argument("inputs", nargs="+", help="query_logs exports: .jsonl[.gz] or .bson[.gz] files, or directories")
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--partitions", type=int, default=None, help="User partitions (default: --workers)")
+    parser.add_argument("--set", action="append", metavar="NAME=VALUE",
+                        help=f"Override a scoring.py constant: {', '.join(TUNABLE_SETTINGS)}")
+    parser.add_argument("--similarity", choices=["exact", "minhash"], default=None,
+                        help="Similarity backend (default: SIMILARITY_BACKEND)")
+    parser.add_argument("--window-minutes", type=float, default=REPLAY_WINDOW_MINUTES)
+    parser.add_argument("--cycle-seconds", type=float, default=REPLAY_CYCLE_SECONDS,
+                        help="Log time between cycles (default: DETECTOR_SWEEP_INTERVAL_MS)")
+    parser.add_argument("--max-lateness", type=float, default=REPLAY_MAX_LATENESS_SECONDS,
+                        help="Seconds a record may arrive out of timestamp order")
+    parser.add_argument("--budget-seconds", type=float, default=0.0,
+                        help="Scoring budget per cycle in wall time, as ANALYSIS_BUDGET_SECONDS (default: none)")
+    parser.add_argument("--timeline", action=argparse.BooleanOptionalAction, default=True,
+                        help="Write the per-user score timelines")
+    parser.add_argument("--spill-dir", default=None, help="Directory for the split pass (default: --out)")
+    parser.add_argument("--keep-spill", action="store_true")
+    args = parser.parse_args(argv)
+
+    try:
+        overrides = parse_overrides(args.set)
+    except ValueError as e:
+        parser.error(str(e))
+    workers = max(1, args.workers)
+    partitions = max(1, args.partitions or workers)
+    summary = run(args.inputs, args.out, partitions, workers, overrides,
+                  window_minutes=args.window_minutes, cycle_seconds=args.cycle_seconds,
+                  max_lateness=args.max_lateness, similarity_backend=args.similarity,
+                  budget_seconds=args.budget_seconds, timeline=args.timeline,
+                  spill_dir=args.spill_dir, keep_spill=args.keep_spill)
+
+    print(f"{summary['records']} records ({summary['first_log']} to {summary['last_log']}) "
+          f"in {summary['elapsed_seconds']:.1f}s: split {summary['split_seconds']:.1f}s, "
+          f"replay {summary['replay_seconds']:.1f}s, {summary['records_per_second'] or 0:.0f} records/s")
+    print(f"ingested {summary['ingested']}, late {summary['late']}, duplicates {summary['duplicates']}, "
+          f"ignored {summary['ignored']}, unreadable {summary['unreadable']}")
+    print(f"{summary['scored']} scores, {summary['tier_changes']} tier changes, "
+          f"tiers at end: {summary['tiers_at_end'] or 'none above 1'}")
+    print(f"written to {Path(args.out).resolve()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""
+Retention for query_logs: a small hot tier of raw logs, rollups behind it.
+
+The detector only reads the last few minutes of query_logs, but every
+served prompt stays there with both answers. The compactor keeps the raw
+collection down to QUERY_LOG_HOT_SECONDS: logs older than that are
+
+    1. appended to gzip JSONL archives (one file per UTC day, Extended JSON,
+       readable with bson.json_util) when QUERY_LOG_ARCHIVE_DIR is set,
+    2. folded into one `query_log_rollups` document per user and minute:
+
+       {userId, minute, count, gateway_count, prompt_chars, first_at, last_at,
+        prompt_digests: [<8-byte hash of each distinct normalized prompt>],
+        batches: [<ids of the last compaction batches applied>]}
+
+    3. deleted from query_logs.
+
+A batch first claims its logs: it stamps a fresh batch id (`compactionBatch`,
+with `compactedAt`) on expired logs that carry none yet, and from then on
+works only on the logs carrying its id. A rollup document only takes a batch
+id it has not recorded yet. A batch interrupted before step 3 (a crash, a
+Mongo error) leaves its logs stamped; the next run finishes those batches
+first, with the same ids and the same logs, before claiming new ones, so
+their ids are still among the rollup's last markers and nothing is counted
+twice. An archive may then hold the batch twice; readers should deduplicate
+by _id.
+
+The TTL index on query_logs (QUERY_LOG_TTL_SECONDS) remains the safety net
+for a compactor that is not running. With the compactor on and no TTL
+configured, the TTL defaults to RETENTION_TTL_FACTOR times the hot horizon.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from bson import ObjectId, json_util
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from .metrics import metrics
+from .store import QUERY_LOG_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Raw logs older than this are rolled up and removed (0 = compactor off)
+QUERY_LOG_HOT_SECONDS = int(os.getenv("QUERY_LOG_HOT_SECONDS", "0"))
+# Directory for gzip JSONL archives of compacted raw logs (empty = no archive)
+QUERY_LOG_ARCHIVE_DIR = os.getenv("QUERY_LOG_ARCHIVE_DIR", "")
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "60"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))
+# Batches per run, so one run cannot hold the thread for an unbounded backlog
+RETENTION_MAX_BATCHES = 20
+RETENTION_TTL_FACTOR = 4
+# Compaction batch ids remembered per rollup document
+ROLLUP_BATCH_MARKERS = 16
+
+_DUPLICATE_KEY = 11000
+_ARCHIVE_JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+
+
+def safety_net_ttl(hot_seconds: int = QUERY_LOG_HOT_SECONDS, ttl_seconds: int = QUERY_LOG_TTL_SECONDS) -> int:
+    """TTL for the query_logs timestamp index given the hot horizon."""
+    if ttl_seconds > 0 or hot_seconds <= 0:
+        return ttl_seconds
+    return hot_seconds * RETENTION_TTL_FACTOR
+
+
+def prompt_digest(prompt) -> str:
+    """Hash of the normalized prompt (lower + strip, as scoring compares them)."""
+    text = prompt.lower().strip() if isinstance(prompt, str) else ""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _as_datetime(value):
+    """Log timestamp as an aware UTC datetime (the gateway writes ISO strings)."""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    return None
+
+
+def _iso_millis(when: datetime) -> str:
+    return when.astimezone(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class QueryLogCompactor:
+    """Background thread rolling expired query_logs into query_log_rollups."""
+
+    def __init__(self, query_logs_collection, rollups_collection, hot_seconds: int = QUERY_LOG_HOT_SECONDS,
+                 archive_dir: str = QUERY_LOG_ARCHIVE_DIR, batch_size: int = RETENTION_BATCH_SIZE,
+                 interval: float = RETENTION_INTERVAL_SECONDS, min_hot_seconds: int = 0, should_run=None):
+        self.query_logs = query_logs_collection
+        self.rollups = rollups_collection
+        if 0 < hot_seconds < min_hot_seconds:
+            logger.warning("QUERY_LOG_HOT_SECONDS=%d is shorter than the analysis window; using %d",
+                           hot_seconds, min_hot_seconds)
+            hot_seconds = min_hot_seconds
+        self.hot_seconds = hot_seconds
+        self.archive_dir = Path(archive_dir) if archive_dir else None
+        self.batch_size = batch_size
+        self.interval = interval
+        # With several detector instances only one should compact (e.g. the owner of shard 0)
+        self.should_run = should_run or (lambda: True)
+        self.compacted_total = 0
+        self.archived_total = 0
+        self.rollups_written = 0
+        self.last_run = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.hot_seconds > 0
+
+    def ensure_indexes(self) -> None:
+        self.rollups.create_index(
+            [("userId", ASCENDING), ("minute", ASCENDING)], name="userId_minute", unique=True
+        )
+        # Only logs of unfinished batches carry the field
+        self.query_logs.create_index([("compactionBatch", ASCENDING)], name="compactionBatch", sparse=True)
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "hot_seconds": self.hot_seconds,
+            "archive_dir": str(self.archive_dir) if self.archive_dir else None,
+            "compacted_total": self.compacted_total,
+            "archived_total": self.archived_total,
+            "rollups_written": self.rollups_written,
+            "last_run": self.last_run,
+        }
+
+    def run_once(self, now: datetime = None) -> int:
+        """
+        Compact logs older than the hot horizon, up to RETENTION_MAX_BATCHES batches.
+
+        Returns:
+            int: Number of raw logs removed from query_logs
+        """
+        now = now or datetime.now(timezone.utc)
+        cutoff = now - timedelta(seconds=self.hot_seconds)
+        # Strings only compare with strings, so the ISO cutoff matches the gateway's string timestamps
+        expired = {
+            "$or": [{"timestamp": {"$lt": cutoff}}, {"timestamp": {"$lt": _iso_millis(cutoff)}}],
+            "compactionBatch": {"$exists": False},
+        }
+        removed = 0
+        # Batches claimed by a run that did not finish come first
+        for batch_id in self.query_logs.distinct("compactionBatch", {"compactionBatch": {"$exists": True}}):
+            if self._stop.is_set():
+                break
+            removed += self._compact_batch(batch_id)
+        for _ in range(RETENTION_MAX_BATCHES):
+            if self._stop.is_set():
+                break
+            ids = [log["_id"] for log in
+                   self.query_logs.find(expired, {"_id": 1}).sort("_id", ASCENDING).limit(self.batch_size)]
+            if not ids:
+                break
+            batch_id = str(ObjectId())
+            self.query_logs.update_many(
+                {"_id": {"$in": ids}, "compactionBatch": {"$exists": False}},
+                {"$set": {"compactionBatch": batch_id, "compactedAt": now}}
+            )
+            removed += self._compact_batch(batch_id)
+            if len(ids) < self.batch_size:
+                break
+        self.last_run = {"at": now, "cutoff": cutoff, "removed": removed}
+        return removed
+
+    def _compact_batch(self, batch_id: str) -> int:
+        """Archive, roll up and delete the logs claimed by batch_id."""
+        batch = list(self.query_logs.find({"compactionBatch": batch_id}))
+        if not batch:
+            return 0
+
+        if self.archive_dir is not None:
+            self._archive(batch)
+
+        groups = {}
+        for log in batch:
+            when = _as_datetime(log.get("timestamp"))
+            if when is None or "userId" not in log:
+                continue
+            minute = when.replace(second=0, microsecond=0)
+            group = groups.setdefault((log["userId"], minute), {
+                "count": 0, "gateway_count": 0, "prompt_chars": 0,
+                "first_at": when, "last_at": when, "digests": set(),
+            })
+            prompt = log.get("prompt")
+            group["count"] += 1
+            group["gateway_count"] += 1 if log.get("gateway_log") else 0
+            group["prompt_chars"] += len(prompt) if isinstance(prompt, str) else 0
+            group["first_at"] = min(group["first_at"], when)
+            group["last_at"] = max(group["last_at"], when)
+            group["digests"].add(prompt_digest(prompt))
+
+        operations = [
+            UpdateOne(
+                {"userId": user_id, "minute": minute, "batches": {"$ne": batch_id}},
+                {
+                    "$inc": {"count": group["count"], "gateway_count": group["gateway_count"],
+                             "prompt_chars": group["prompt_chars"]},
+                    "$min": {"first_at": group["first_at"]},
+                    "$max": {"last_at": group["last_at"]},
+                    "$addToSet": {"prompt_digests": {"$each": sorted(group["digests"])}},
+                    "$push": {"batches": {"$each": [batch_id], "$slice": -ROLLUP_BATCH_MARKERS}},
+                },
+                upsert=True
+            )
+            for (user_id, minute), group in groups.items()
+        ]
+        if operations:
+            try:
+                result = self.rollups.bulk_write(operations, ordered=False)
+                self.rollups_written += result.upserted_count + result.modified_count
+            except BulkWriteError as e:
+                # A duplicate key means the rollup already holds this batch (a retried batch)
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != _DUPLICATE_KEY for error in errors):
+                    raise
+                self.rollups_written += e.details.get("nUpserted", 0) + e.details.get("nModified", 0)
+
+        removed = self.query_logs.delete_many({"compactionBatch": batch_id}).deleted_count
+        self.compacted_total += removed
+        metrics.inc("query_logs_compacted_total", removed)
+        return removed
+
+    def _archive(self, batch: list) -> None:
+        by_day = {}
+        for log in batch:
+            when = _as_datetime(log.get("timestamp"))
+            day = when.strftime("%Y-%m-%d") if when else "undated"
+            by_day.setdefault(day, []).append(log)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        for day, logs in by_day.items():
+            # Appending a gzip member per batch keeps each file a valid gzip stream
+            with gzip.open(self.archive_dir / f"query_logs-{day}.jsonl.gz", "at", encoding="utf-8") as archive:
+                for log in logs:
+                    archive.write(json_util.dumps(log, json_options=_ARCHIVE_JSON_OPTIONS) + "\n")
+        self.archived_total += len(batch)
+        metrics.inc("query_logs_archived_total", len(batch))
+
+    def start(self) -> None:
+        if self.enabled and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="query-log-compactor", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            if not self.should_run():
+                continue
+            try:
+                removed = self.run_once()
+                if removed:
+                    logger.info("Compacted %d query logs older than %ds", removed, self.hot_seconds)
+            except (PyMongoError, OSError):
+                logger.exception("Query log compaction failed")
@@ -0,0 +1,93 @@
+"""
+Priority and time budget for the engine's re-scoring work.
+
+A cycle scores every window that changed. When a few heavy bot windows make
+that take longer than the sweep interval, the most useful users should be
+scored first and the rest can wait a cycle. ScoringEngine.rescore pops the
+changed windows off a priority queue in chunks and stops once
+ANALYSIS_BUDGET_SECONDS are spent; the windows left over stay dirty and are
+carried over to the next cycle. Each chunk is filled up to the budget left,
+predicting a window's scoring time from its distinct prompt pairs (see
+scoring_cost) and the time per pair measured on the previous chunks.
+
+A window's priority is the sum of three terms, each between 0 and 1:
+
+    activity    exp(-(now - newest entry) / SCHEDULER_ACTIVITY_SECONDS)
+    boundary    1 at a tier boundary (0.8, 0.95), falling to 0 at
+                SCHEDULER_BOUNDARY_MARGIN from the nearest one; 0.5 before
+                the first score
+    staleness   time since the window was last scored over
+                SCHEDULER_STALE_SECONDS, capped at 1 (1 if never scored)
+
+so a user sending right now whose score sits at a tier boundary goes first,
+and users carried over gain priority every cycle they wait.
+"""
+import heapq
+import math
+import os
+
+# Seconds of scoring per cycle before the rest is carried over (0 = no budget)
+ANALYSIS_BUDGET_SECONDS = float(os.getenv("ANALYSIS_BUDGET_SECONDS", "30"))
+SCHEDULER_CHUNK_USERS = int(os.getenv("SCHEDULER_CHUNK_USERS", "256"))
+# Chunk size before the time per user has been measured
+SCHEDULER_FIRST_CHUNK_USERS = 16
+SCHEDULER_ACTIVITY_SECONDS = 60.0
+SCHEDULER_STALE_SECONDS = 300.0
+SCHEDULER_BOUNDARY_MARGIN = 0.15
+# Tier 2 and Tier 3 thresholds (see scoring.get_tier)
+TIER_BOUNDARIES = (0.8, 0.95)
+
+
+def scoring_cost(window) -> int:
+    """
+    Relative cost of scoring a window: similarity compares every pair of
+    distinct prompts (repeats of one prompt compare for free).
+    """
+    _, prompt_ids = window.columns()
+    distinct = len(set(prompt_ids))
+    return 1 + distinct * (distinct - 1) // 2
+
+
+def priority(window, now: float) -> float:
+    """Scheduling priority of a changed window at now (epoch seconds); higher goes first."""
+    activity = math.exp(-max(0.0, now - window.last_epoch) / SCHEDULER_ACTIVITY_SECONDS)
+    if window.score is None:
+        boundary = 0.5
+    else:
+        distance = min(abs(window.score - threshold) for threshold in TIER_BOUNDARIES)
+        boundary = max(0.0, 1.0 - distance / SCHEDULER_BOUNDARY_MARGIN)
+    if window.scored_at is None:
+        staleness = 1.0
+    else:
+        staleness = min(1.0, max(0.0, now - window.scored_at) / SCHEDULER_STALE_SECONDS)
+    return activity + boundary + staleness
+
+
+class ScoringQueue:
+    """Max-priority queue of changed windows, taken in chunks."""
+
+    def __init__(self, windows, now: float):
+        # The sequence number keeps equal priorities in window order
+        self._heap = [(-priority(window, now), seq, window) for seq, window in enumerate(windows)]
+        heapq.heapify(self._heap)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def take_within(self, max_cost, max_count: int) -> tuple:
+        """
+        Highest-priority windows while their scoring_cost adds up to at most
+        max_cost (None = no limit), up to max_count; always at least one.
+
+        Returns:
+            tuple: (windows, their total scoring_cost)
+        """
+        chunk = []
+        total = 0
+        while self._heap and len(chunk) < max_count:
+            cost = scoring_cost(self._heap[0][2])
+            if chunk and max_cost is not None and total + cost > max_cost:
+                break
+            chunk.append(heapq.heappop(self._heap)[2])
+            total += cost
+        return chunk, total
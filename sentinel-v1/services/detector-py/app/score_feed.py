@@ -0,0 +1,148 @@
+"""
+Push channel for score changes, consumed by the gateway's score cache.
+
+Every score write that changes a user's suspicion_score is published as an
+event with a sequence number:
+
+    {"seq": 42, "userId": "...", "score": 0.97, "tier": 3, "updated_at": <epoch ms>}
+
+GET /scores/stream serves them as Server-Sent Events. A client passes the
+last seq it applied (`?since=` or the Last-Event-ID header) and gets the
+events it missed replayed from a bounded in-memory buffer. If they are no
+longer buffered, or the client is too slow to keep up, it is sent a
+`resync` event and should reload GET /scores/snapshot, then stream again
+from the snapshot's seq. Sequence numbers restart with the process;
+`stream_id` changes with them so clients notice.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+SCORE_FEED_BUFFER = int(os.getenv("SCORE_FEED_BUFFER", "10000"))
+# Events queued per subscriber before it is cut off and told to resync
+SCORE_FEED_SUBSCRIBER_QUEUE = int(os.getenv("SCORE_FEED_SUBSCRIBER_QUEUE", "10000"))
+SCORE_FEED_KEEPALIVE_SECONDS = float(os.getenv("SCORE_FEED_KEEPALIVE_SECONDS", "15"))
+
+_RESYNC = object()
+
+
+class ScoreFeed:
+    """Sequenced score events, a replay buffer and the live subscribers."""
+
+    def __init__(self, buffer_size: int = SCORE_FEED_BUFFER, queue_size: int = SCORE_FEED_SUBSCRIBER_QUEUE):
+        self.stream_id = uuid.uuid4().hex
+        self.seq = 0
+        self.queue_size = queue_size
+        self._buffer = deque(maxlen=buffer_size)
+        self._subscribers = set()
+        # publish() runs on cycle / change-stream threads, subscribers on the event loop
+        self._lock = threading.Lock()
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, changes) -> int:
+        """
+        Publish score changes.
+
+        Args:
+            changes: Iterable of (userId, score, tier, updated_at_ms)
+
+        Returns:
+            int: seq of the last published event
+        """
+        with self._lock:
+            events = []
+            for user_id, score, tier, updated_at in changes:
+                self.seq += 1
+                event = {"seq": self.seq, "userId": user_id, "score": score, "tier": tier,
+                         "updated_at": updated_at}
+                self._buffer.append(event)
+                events.append(event)
+            subscribers = list(self._subscribers)
+            seq = self.seq
+        if events:
+            for subscriber in subscribers:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, events)
+        return seq
+
+    def subscribe(self, since: int = None) -> "Subscription":
+        """
+        Register a subscriber on the running event loop.
+
+        Events after `since` still in the buffer are queued first; if some
+        are gone (or `since` is from another stream) the subscription starts
+        with a resync.
+        """
+        subscription = Subscription(self, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            if since is not None:
+                oldest = self._buffer[0]["seq"] if self._buffer else self.seq + 1
+                if since > self.seq or since + 1 < oldest:
+                    subscription.queue.put_nowait(_RESYNC)
+                else:
+                    missed = [event for event in self._buffer if event["seq"] > since]
+                    subscription.deliver(missed)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: "Subscription") -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    async def stream(self, since: int = None, keepalive: float = SCORE_FEED_KEEPALIVE_SECONDS):
+        """SSE body: a `hello` event, then score events, comment keepalives while idle."""
+        subscription = self.subscribe(since)
+        try:
+            yield _sse("hello", {"stream_id": self.stream_id, "seq": self.seq})
+            while True:
+                try:
+                    item = await asyncio.wait_for(subscription.queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if item is _RESYNC:
+                    yield _sse("resync", {"stream_id": self.stream_id, "seq": self.seq})
+                    return
+                yield _sse("score", item, event_id=item["seq"])
+        finally:
+            self.unsubscribe(subscription)
+
+
+class Subscription:
+    __slots__ = ("feed", "loop", "queue", "overflowed")
+
+    def __init__(self, feed: ScoreFeed, loop, queue_size: int):
+        self.feed = feed
+        self.loop = loop
+        # One slot above the limit is kept free for the resync marker
+        self.queue = asyncio.Queue(maxsize=queue_size + 1)
+        self.overflowed = False
+
+    def deliver(self, events) -> None:
+        """Queue events (on the subscriber's loop); a lagging subscriber is told to resync."""
+        if self.overflowed:
+            return
+        for event in events:
+            if self.queue.qsize() >= self.queue.maxsize - 1:
+                logger.warning("Score stream subscriber fell %d events behind; asking it to resync",
+                               self.queue.qsize())
+                self.overflowed = True
+                self.queue.put_nowait(_RESYNC)
+                return
+            self.queue.put_nowait(event)
+
+
+def _sse(event: str, data: dict, event_id: int = None) -> str:
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
@@ -1,7 +1,14 @@
+import logging
 import math
+import os
+import zlib
 from difflib import SequenceMatcher # Import difflib for text similarity calculations
 from datetime import datetime
 
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
 # Why these values: Humans type slowly, bots send 100+ requests/second
 VELOCITY_THRESHOLD_NORMAL = 4.0  # Normal user: ~ 4 queries per minute max
 VELOCITY_THRESHOLD_BOT = 15.0    # Bot threshold: 10+ queries/min is clearly automated
@@ -14,6 +21,37 @@ SIMILARITY_THRESHOLD_BOT = 0.7
 VELOCITY_WEIGHT = 0.6  # 60% weight on velocity 
 SIMILARITY_WEIGHT = 0.4  # 40% weight on similarity 
 
+# Tier boundaries on the final suspicion score
+TIER_2_THRESHOLD = 0.8
+TIER_3_THRESHOLD = 0.95
+
+# Similarity backend: "exact" compares every prompt pair with difflib,
+# "minhash" estimates the same average from per-prompt sketches.
+SIMILARITY_BACKEND = os.getenv("SIMILARITY_BACKEND", "exact")
+
+# MinHash sketch parameters
+MINHASH_NUM_PERM = 64        # Sketch size (slots per prompt)
+MINHASH_SHINGLE_SIZE = 3     # Character shingles
+MINHASH_SAMPLE_PAIRS = 2000  # Pairs sampled when a window has more than this
+# difflib's ratio for two unrelated English prompts sits around 0.25, while
+# their shingle overlap is ~0. The estimate is rescaled onto difflib's range.
+MINHASH_RATIO_BASELINE = 0.25
+
+# Exact backend early exit: stop comparing pairs once the average is known
+# to be <= SIMILARITY_THRESHOLD_NORMAL or >= SIMILARITY_THRESHOLD_BOT, where
+# the D-Score is clamped anyway (see bounded_average_similarity).
+SIMILARITY_EARLY_EXIT = os.getenv("SIMILARITY_EARLY_EXIT", "1").lower() in ("1", "true", "yes")
+# Probability that a sampled early exit misjudges a window; 0 keeps only the
+# exits that are certain (duplicates and length bounds).
+SIMILARITY_EARLY_EXIT_DELTA = float(os.getenv("SIMILARITY_EARLY_EXIT_DELTA", "1e-6"))
+EARLY_EXIT_FIRST_CHECK = 32  # Pairs sampled before the first confidence check
+_AUTOJUNK_MIN_LENGTH = 200   # difflib only applies autojunk to sequences this long
+
+_MINHASH_PRIME = (1 << 31) - 1
+_minhash_rng = np.random.RandomState(1)
+_MINHASH_A = _minhash_rng.randint(1, _MINHASH_PRIME, size=MINHASH_NUM_PERM).astype(np.uint64)
+_MINHASH_B = _minhash_rng.randint(0, _MINHASH_PRIME, size=MINHASH_NUM_PERM).astype(np.uint64)
+
 
 def calculate_text_similarity(text1: str, text2: str) -> float:
     """
@@ -43,6 +81,78 @@ def calculate_text_similarity(text1: str, text2: str) -> float:
     return matcher.ratio()
 
 
+def build_prompt_sketch(prompt: str) -> np.ndarray:
+    """
+    Build a MinHash sketch of a prompt
+    
+    Args:
+        prompt: Prompt string
+    
+    Returns:
+        np.ndarray: MINHASH_NUM_PERM uint32 slot values
+    
+    Algorithm:
+        - Same normalization as calculate_text_similarity (lower + strip)
+        - Split into overlapping character shingles of MINHASH_SHINGLE_SIZE
+        - Each slot keeps the minimum of one universal hash over all shingles
+    
+    Two sketches agree on a slot with probability equal to the Jaccard
+    similarity of the prompts' shingle sets.
+    """
+    text = prompt.lower().strip()
+    size = MINHASH_SHINGLE_SIZE
+    shingles = {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles)
+    )
+    slots = ((_MINHASH_A[:, None] * hashes[None, :] + _MINHASH_B[:, None]) % _MINHASH_PRIME).min(axis=1)
+    return slots.astype(np.uint32)
+
+
+def sketch_pair_similarity(jaccard):
+    """
+    Map estimated shingle Jaccard similarity onto difflib's ratio scale
+    
+    Jaccard is first converted to the Dice coefficient (2J / (1 + J)), which
+    like SequenceMatcher.ratio() is 2 * matches / total length, then rescaled
+    so unrelated prompts land on MINHASH_RATIO_BASELINE instead of 0.
+    Works on floats and NumPy arrays.
+    """
+    dice = 2 * jaccard / (1 + jaccard)
+    return MINHASH_RATIO_BASELINE + (1 - MINHASH_RATIO_BASELINE) * dice
+
+
+def estimate_average_similarity(sketches, max_pairs: int = MINHASH_SAMPLE_PAIRS) -> float:
+    """
+    Estimate the average pairwise prompt similarity from MinHash sketches
+    
+    Args:
+        sketches: Sequence of sketches from build_prompt_sketch (at least 2)
+        max_pairs: Above this many pairs, a fixed-seed random sample is used
+    
+    Returns:
+        float: Estimated average similarity on the difflib ratio scale
+    
+    Cost is O(n * MINHASH_NUM_PERM) to stack the sketches plus
+    O(max_pairs * MINHASH_NUM_PERM) for the pair comparisons, so it stays
+    roughly linear in the number of prompts instead of quadratic.
+    """
+    matrix = np.asarray(sketches)
+    n = len(matrix)
+    total_pairs = n * (n - 1) // 2
+    if total_pairs <= max_pairs:
+        left, right = np.triu_indices(n, k=1)
+    else:
+        rng = np.random.RandomState(n)
+        left = rng.randint(0, n, size=max_pairs)
+        # Offset in [1, n) guarantees right != left
+        right = (left + rng.randint(1, n, size=max_pairs)) % n
+    jaccard = (matrix[left] == matrix[right]).mean(axis=1)
+    return float(sketch_pair_similarity(jaccard).mean())
+
+
 def calculate_velocity_score(num_queries: int, time_window_minutes: float) -> float:
     """
     Calculate velocity score based on queries per minute (QPM)
@@ -77,31 +187,33 @@ def calculate_velocity_score(num_queries: int, time_window_minutes: float) -> fl
 
     qpm = num_queries / time_window_minutes
     
-    print(f"QPM: {qpm:.2f} queries/minute")
+    logger.debug("QPM: %.2f queries/minute", qpm)
     
 
     if qpm <= VELOCITY_THRESHOLD_NORMAL:
-        print(f"      [V-SCORE] Below normal threshold ({VELOCITY_THRESHOLD_NORMAL}), returning 0.0")
+        logger.debug("[V-SCORE] Below normal threshold (%s), returning 0.0", VELOCITY_THRESHOLD_NORMAL)
         return 0.0
     
 
     if qpm >= VELOCITY_THRESHOLD_BOT:
-        print(f"[V-SCORE] Above bot threshold ({VELOCITY_THRESHOLD_BOT}), returning 1.0")
+        logger.debug("[V-SCORE] Above bot threshold (%s), returning 1.0", VELOCITY_THRESHOLD_BOT)
         return 1.0
     
  
     v_score = (qpm - VELOCITY_THRESHOLD_NORMAL) / (VELOCITY_THRESHOLD_BOT - VELOCITY_THRESHOLD_NORMAL)
     v_score = max(0.0, min(1.0, v_score))    
-    print(f"Interpolated score: {v_score:.3f}")    
+    logger.debug("[V-SCORE] Interpolated score: %.3f", v_score)
     return v_score
 
 
-def calculate_similarity_score(prompts: list) -> float:
+def calculate_similarity_score(prompts: list, backend: str = None) -> float:
     """
     Calculate similarity score based on how repetitive prompts are
     
     Args:
         prompts: List of prompt strings
+        backend: "exact" (difflib, every pair) or "minhash" (sketch estimate).
+                 Defaults to SIMILARITY_BACKEND.
     
     Returns:
         float: Similarity score between 0.0 (diverse) and 1.0 (repetitive)
@@ -125,30 +237,217 @@ def calculate_similarity_score(prompts: list) -> float:
     """
     # Need at least 2 prompts to calculate similarity
     if len(prompts) < 2:
-        print(f"Only {len(prompts)} prompt(s), returning 0.0 (insufficient data)")
+        logger.debug("Only %d prompt(s), returning 0.0 (insufficient data)", len(prompts))
         return 0.0  
 
-    similarities = []  # Store all pairwise similarity values
+    avg_similarity = average_prompt_similarity(prompts, backend=backend)
+    return similarity_score_from_average(avg_similarity)
+
+
+def average_prompt_similarity(prompts: list, backend: str = None) -> float:
+    """
+    Average pairwise similarity of a list of (at least 2) prompts
+    
+    Args:
+        prompts: List of prompt strings
+        backend: "exact" or "minhash", defaults to SIMILARITY_BACKEND
+    
+    Returns:
+        float: Average similarity between 0.0 and 1.0
+    """
+    backend = backend or SIMILARITY_BACKEND
+
+    if backend == "minhash":
+        sketches = [build_prompt_sketch(prompt) for prompt in prompts]
+        avg_similarity = estimate_average_similarity(sketches)
+        logger.debug("Estimated average prompt similarity (minhash): %.3f", avg_similarity)
+    elif backend == "exact" and SIMILARITY_EARLY_EXIT:
+        avg_similarity = bounded_average_similarity(prompts)
+        logger.debug("Bounded average prompt similarity: %.3f", avg_similarity)
+    elif backend == "exact":
+        similarities = []  # Store all pairwise similarity values
+        
+
+        for i in range(len(prompts)):
+            for j in range(i + 1, len(prompts)):  
+                similarity = calculate_text_similarity(prompts[i], prompts[j])
+                similarities.append(similarity)
+        
+        avg_similarity = sum(similarities) / len(similarities)
+        
+        logger.debug("Average prompt similarity: %.3f", avg_similarity)
+        logger.debug("(Compared %d prompt pairs)", len(similarities))
+    else:
+        raise ValueError(f"Unknown similarity backend: {backend}")
     
 
-    for i in range(len(prompts)):
-        for j in range(i + 1, len(prompts)):  
-            similarity = calculate_text_similarity(prompts[i], prompts[j])
-            similarities.append(similarity)
+    return avg_similarity
+
+
+def _length_bound(len1, len2):
+    """
+    Upper bound on SequenceMatcher.ratio() from the lengths alone
+    (what real_quick_ratio() returns). Works on ints and NumPy arrays.
+    """
+    total = len1 + len2
+    return np.where(total > 0, 2.0 * np.minimum(len1, len2) / np.maximum(total, 1), 1.0)
+
+
+def bounded_average_similarity(prompts: list, low: float = None, high: float = None,
+                               delta: float = SIMILARITY_EARLY_EXIT_DELTA, stats: dict = None,
+                               similarity=None) -> float:
+    """
+    Average pairwise similarity, computed only as far as the D-Score needs it
     
-    avg_similarity = sum(similarities) / len(similarities)
+    Args:
+        prompts: List of (at least 2) prompt strings
+        low, high: The D-Score interpolation band (default: the current
+                   SIMILARITY_THRESHOLD_NORMAL and SIMILARITY_THRESHOLD_BOT)
+        delta: Allowed probability of a sampled early exit being wrong
+               (0 = only exits that are certain)
+        stats: Optional dict, filled with pairs / evaluated / exit
+        similarity: Optional similarity(i, j) for prompts[i], prompts[j] (i < j),
+                    e.g. backed by a cache; defaults to calculate_text_similarity
     
-    print(f"Average prompt similarity: {avg_similarity:.3f}")
-    print(f"(Compared {len(similarities)} prompt pairs)")
+    Returns:
+        float: The exact average (bit for bit what the exact backend returns)
+        whenever it lies inside (low, high); otherwise a value on the same
+        side of the band, so similarity_score_from_average gives the same D-Score
     
+    Algorithm:
+        1. Identical prompts (after normalization) are hashed together; their
+           pairs are 1.0 without calling difflib. A copy-paste bot is settled
+           here: the duplicate pairs alone already push the average >= high.
+        2. Every other pair is bounded above by its length ratio, which can
+           settle windows of very uneven prompt lengths as <= low.
+        3. Pairs are then compared in a random order. After each doubling of
+           the sample (from EARLY_EXIT_FIRST_CHECK pairs) the running mean is
+           tested against the band with the Hoeffding–Serfling bound for
+           sampling without replacement,
+               eps = sqrt(ln(checks / delta) * (1 - (k - 1) / N) / (2k)),
+           alongside the certain bounds from the pairs compared so far.
+        4. A window whose average is inside the band is compared completely
+           (except with probability <= delta), and each distinct prompt pair
+           only once.
+    
+    SequenceMatcher.quick_ratio() is deliberately not used: on English text
+    it bounds unrelated prompts around 0.6-0.7, far above `low`, so it never
+    settles a window and only adds cost.
+    """
+    low = SIMILARITY_THRESHOLD_NORMAL if low is None else low
+    high = SIMILARITY_THRESHOLD_BOT if high is None else high
+    normalized = [prompt.lower().strip() for prompt in prompts]
+    text_ids = {}
+    ids = [text_ids.setdefault(text, len(text_ids)) for text in normalized]
+    n = len(normalized)
+    total_pairs = n * (n - 1) // 2
 
+    # Value of a pair of identical prompts: 1.0, except that difflib's
+    # autojunk heuristic (texts of 200+ characters) could in principle make
+    # it lower, so those are measured once per distinct text.
+    texts = list(text_ids)
+    self_values = [
+        1.0 if len(text) < _AUTOJUNK_MIN_LENGTH else SequenceMatcher(None, text, text).ratio()
+        for text in texts
+    ]
+    counts = np.bincount(ids)
+    duplicate_weights = counts * (counts - 1) / 2.0
+    duplicate_pairs = float(duplicate_weights.sum())
+    duplicate_sum = float(np.dot(duplicate_weights, self_values))
+
+    # Known exact sum so far, and the sum of upper bounds of the pairs not compared yet
+    lengths = np.array([len(text) for text in normalized], dtype=np.int64)
+    length_values, length_counts = np.unique(lengths, return_counts=True)
+    bound_matrix = _length_bound(length_values[:, None], length_values[None, :])
+    weights = np.outer(length_counts, length_counts).astype(np.float64)
+    np.fill_diagonal(weights, length_counts * (length_counts - 1) / 2.0)
+    bound_sum = float(np.triu(bound_matrix * weights).sum())
+    known_sum = duplicate_sum
+    unknown_bound_sum = bound_sum - duplicate_pairs
+
+    def finish(value, how, evaluated):
+        if stats is not None:
+            stats.update(pairs=total_pairs, evaluated=evaluated, exit=how)
+        return value
+
+    if known_sum / total_pairs >= high:
+        return finish(known_sum / total_pairs, "duplicates", 0)
+    # Tiny slack so float rounding in the bound sums can never flip the D-Score
+    if (known_sum + unknown_bound_sum) / total_pairs + 1e-9 <= low:
+        return finish((known_sum + unknown_bound_sum) / total_pairs, "length_bound", 0)
+
+    rng = np.random.RandomState(n)
+    order = rng.permutation(total_pairs)
+    checks = max(1, math.ceil(math.log2(max(total_pairs, 2) / EARLY_EXIT_FIRST_CHECK)) + 1)
+    log_term = math.log(checks / delta) if delta > 0 else None
+    next_check = EARLY_EXIT_FIRST_CHECK
+
+    cache = {}
+    sample_sum = 0.0
+    sampled = 0
+    for start in range(0, total_pairs, _BATCH_PAIR_CHUNK):
+        block = order[start:start + _BATCH_PAIR_CHUNK]
+        left, right = _triangular_pairs(block, n)
+        for i, j in zip(left.tolist(), right.tolist()):
+            a, b = ids[i], ids[j]
+            if a == b:
+                value = self_values[a]
+            else:
+                key = (a, b)
+                value = cache.get(key)
+                if value is None:
+                    if similarity is not None:
+                        value = similarity(i, j)
+                    else:
+                        value = SequenceMatcher(None, normalized[i], normalized[j]).ratio()
+                    cache[key] = value
+                known_sum += value
+                unknown_bound_sum -= float(_length_bound(lengths[i], lengths[j]))
+            sample_sum += value
+            sampled += 1
+
+            if sampled < next_check or sampled == total_pairs:
+                continue
+            next_check *= 2
+            if known_sum / total_pairs >= high:
+                return finish(known_sum / total_pairs, "bound", sampled)
+            if (known_sum + unknown_bound_sum) / total_pairs + 1e-9 <= low:
+                return finish((known_sum + unknown_bound_sum) / total_pairs, "bound", sampled)
+            if log_term is not None:
+                mean = sample_sum / sampled
+                eps = math.sqrt(log_term * (1 - (sampled - 1) / total_pairs) / (2 * sampled))
+                if mean + eps <= low:
+                    return finish(mean + eps, "sampled", sampled)
+                if mean - eps >= high:
+                    return finish(mean - eps, "sampled", sampled)
+
+    # Compared everything: sum in the exact backend's order so the result is identical
+    similarities = []
+    for i in range(n):
+        a = ids[i]
+        for j in range(i + 1, n):
+            b = ids[j]
+            similarities.append(self_values[a] if a == b else cache[(a, b)])
+    return finish(sum(similarities) / len(similarities), "complete", total_pairs)
+
+
+def similarity_score_from_average(avg_similarity: float) -> float:
+    """
+    Map an average pairwise prompt similarity onto the D-Score
+    
+    Args:
+        avg_similarity: Average similarity between 0.0 and 1.0
+    
+    Returns:
+        float: D-Score between 0.0 (diverse) and 1.0 (repetitive)
+    """
     if avg_similarity <= SIMILARITY_THRESHOLD_NORMAL:
-        print(f"      [D-SCORE] Below normal threshold ({SIMILARITY_THRESHOLD_NORMAL}), returning 0.0")
+        logger.debug("[D-SCORE] Below normal threshold (%s), returning 0.0", SIMILARITY_THRESHOLD_NORMAL)
         return 0.0
     
 
     if avg_similarity >= SIMILARITY_THRESHOLD_BOT:
-        print(f"      [D-SCORE] Above bot threshold ({SIMILARITY_THRESHOLD_BOT}), returning 1.0")
+        logger.debug("[D-SCORE] Above bot threshold (%s), returning 1.0", SIMILARITY_THRESHOLD_BOT)
         return 1.0
     
 
@@ -157,11 +456,18 @@ def calculate_similarity_score(prompts: list) -> float:
 
     d_score = max(0.0, min(1.0, d_score))
     
-    print(f"Interpolated score: {d_score:.3f}")
+    logger.debug("[D-SCORE] Interpolated score: %.3f", d_score)
     
     return d_score
 
-def calculate_suspicion_score(recent_queries: list, analysis_window_minutes: float) -> float:
+
+def combine_scores(v_score: float, d_score: float) -> float:
+    """Weighted combination of V-Score and D-Score, clamped to [0, 1]."""
+    suspicion_score = (v_score * VELOCITY_WEIGHT) + (d_score * SIMILARITY_WEIGHT)
+    return max(0.0, min(1.0, suspicion_score))
+
+def calculate_suspicion_score(recent_queries: list, analysis_window_minutes: float,
+                              similarity_backend: str = None) -> float:
     """
     Calculate final suspicion score by combining V-Score and D-Score
     
@@ -169,6 +475,7 @@ def calculate_suspicion_score(recent_queries: list, analysis_window_minutes: flo
         recent_queries: List of query log documents from MongoDB
                         Each document has: userId, timestamp, prompt, etc.
         analysis_window_minutes: Time window size in minutes (e.g., 5)
+        similarity_backend: Passed to calculate_similarity_score
     
     Returns:
         float: Final suspicion score between 0.0 (normal) and 1.0 (malicious)
@@ -189,40 +496,167 @@ def calculate_suspicion_score(recent_queries: list, analysis_window_minutes: flo
         - 0.8 ≤ score < 0.95 → Tier 2 (Suspicious/Temp Block)
         - score ≥ 0.95 → Tier 3 (Malicious/Perma Block)
     """
-    print(f"\n CALCULATING SUSPICION SCORE")
-    print(f"Input: {len(recent_queries)} recent queries")
-    print(f"Time window: {analysis_window_minutes} minutes")
+    logger.debug("CALCULATING SUSPICION SCORE: %d recent queries, %s minute window",
+                 len(recent_queries), analysis_window_minutes)
     
     prompts = [query["prompt"] for query in recent_queries]
-    
-    print(f"Extracted {len(prompts)} prompts for analysis")
 
     num_queries = len(recent_queries)
     v_score = calculate_velocity_score(num_queries, analysis_window_minutes)
     
-    print(f"V-Score (velocity): {v_score:.3f}")
+    logger.debug("V-Score (velocity): %.3f", v_score)
 
-    d_score = calculate_similarity_score(prompts)
+    d_score = calculate_similarity_score(prompts, backend=similarity_backend)
     
-    print(f"D-Score (similarity): {d_score:.3f}")
+    logger.debug("D-Score (similarity): %.3f", d_score)
 
-    suspicion_score = (v_score * VELOCITY_WEIGHT) + (d_score * SIMILARITY_WEIGHT)
+    suspicion_score = combine_scores(v_score, d_score)
     
+    logger.debug("FINAL SUSPICION SCORE: (%.3f * %s) + (%.3f * %s) = %.3f",
+                 v_score, VELOCITY_WEIGHT, d_score, SIMILARITY_WEIGHT, suspicion_score)
 
-    suspicion_score = max(0.0, min(1.0, suspicion_score))
+    if logger.isEnabledFor(logging.DEBUG):
+        if suspicion_score >= TIER_3_THRESHOLD:
+            tier = "TIER 3 (MALICIOUS - PERMA BLOCK)"
+        elif suspicion_score >= TIER_2_THRESHOLD:
+            tier = "TIER 2 (SUSPICIOUS - TEMP BLOCK)"
+        else:
+            tier = "TIER 1 (NORMAL - PROACTIVE DEFENSE)"
+        logger.debug("Classification: %s", tier)
     
-    print(f"FINAL SUSPICION SCORE: {suspicion_score:.3f}")
-    print(f"Formula: ({v_score:.3f} * {VELOCITY_WEIGHT}) + ({d_score:.3f} * {SIMILARITY_WEIGHT}) = {suspicion_score:.3f}")
+    return suspicion_score
 
-    if suspicion_score >= 0.95:
-        tier = "TIER 3 (MALICIOUS - PERMA BLOCK)"
-    elif suspicion_score >= 0.8:
-        tier = "TIER 2 (SUSPICIOUS - TEMP BLOCK)"
-    else:
-        tier = "TIER 1 (NORMAL - PROACTIVE DEFENSE)"
+
+def get_tier(score: float) -> int:
+    """Tier number (1, 2 or 3) for a final suspicion score."""
+    if score >= TIER_3_THRESHOLD:
+        return 3
+    if score >= TIER_2_THRESHOLD:
+        return 2
+    return 1
+
+
+# Pairs compared per NumPy block in score_users_batch (bounds temporary memory)
+_BATCH_PAIR_CHUNK = 1 << 16
+
+
+def _triangular_pairs(t, n):
+    """(i, j) with i < j for flat index t into the upper triangle of an n x n matrix."""
+    i = n - 2 - np.floor(np.sqrt(-8.0 * t + 4.0 * n * (n - 1) - 7) / 2.0 - 0.5).astype(np.int64)
+    j = t + i + 1 - n * (n - 1) // 2 + (n - i) * (n - i - 1) // 2
+    return i, j
+
+
+def batch_average_similarity(user_index, sketch_ids, sketches, num_users: int,
+                             max_pairs: int = MINHASH_SAMPLE_PAIRS) -> np.ndarray:
+    """
+    Estimate every user's average pairwise prompt similarity in one pass
     
-    print(f"Classification: {tier}")
+    Args:
+        user_index: int array, owning user (0..num_users-1) of each query
+        sketch_ids: int array, row of `sketches` holding each query's prompt sketch
+        sketches: (num_sketches, MINHASH_NUM_PERM) array from build_prompt_sketch
+        num_users: Number of users in the batch
+        max_pairs: Users with more pairs than this get a random sample of pairs
     
-    return suspicion_score
+    Returns:
+        np.ndarray: Average similarity per user (0.0 for users with < 2 queries)
+    
+    Same estimator as estimate_average_similarity, vectorized across users:
+    all pairs for small windows, a fixed-seed sample of max_pairs otherwise.
+    """
+    user_index = np.asarray(user_index, dtype=np.int64)
+    sketch_ids = np.asarray(sketch_ids, dtype=np.int64)
+    sketches = np.asarray(sketches)
+
+    order = np.argsort(user_index, kind="stable")
+    sorted_sketch_ids = sketch_ids[order]
+    counts = np.bincount(user_index, minlength=num_users)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    total_pairs = counts * (counts - 1) // 2
+    sampled = total_pairs > max_pairs
+    pair_counts = np.where(sampled, max_pairs, total_pairs)
+
+    owner = np.repeat(np.arange(num_users), pair_counts)
+    pair_starts = np.concatenate(([0], np.cumsum(pair_counts)[:-1]))
+    t = np.arange(len(owner)) - pair_starts[owner]
+    n = counts[owner]
+
+    i, j = _triangular_pairs(t, n)
+    is_sampled = sampled[owner]
+    if is_sampled.any():
+        rng = np.random.RandomState(num_users)
+        sampled_n = n[is_sampled]
+        left = (rng.random_sample(len(sampled_n)) * sampled_n).astype(np.int64)
+        offset = 1 + (rng.random_sample(len(sampled_n)) * (sampled_n - 1)).astype(np.int64)
+        i[is_sampled] = left
+        j[is_sampled] = (left + offset) % sampled_n
+
+    left_ids = sorted_sketch_ids[offsets[owner] + i]
+    right_ids = sorted_sketch_ids[offsets[owner] + j]
+
+    similarity = np.empty(len(owner), dtype=np.float64)
+    for start in range(0, len(owner), _BATCH_PAIR_CHUNK):
+        stop = start + _BATCH_PAIR_CHUNK
+        jaccard = (sketches[left_ids[start:stop]] == sketches[right_ids[start:stop]]).mean(axis=1)
+        similarity[start:stop] = sketch_pair_similarity(jaccard)
+
+    sums = np.bincount(owner, weights=similarity, minlength=num_users)
+    return np.divide(sums, pair_counts, out=np.zeros(num_users), where=pair_counts > 0)
+
+
+def score_users_batch(user_index, timestamps, sketch_ids, sketches, num_users: int,
+                      analysis_window_minutes: float, window_start: float = None,
+                      avg_similarity=None, min_v_scores=None):
+    """
+    Vectorized V-Score, D-Score and suspicion score for many users at once
+    
+    Args:
+        user_index: int array, owning user (0..num_users-1) of each query
+        timestamps: float array, epoch seconds of each query
+        sketch_ids: int array, row of `sketches` for each query's prompt
+        sketches: (num_sketches, MINHASH_NUM_PERM) MinHash matrix; may be None
+                  when avg_similarity is given
+        num_users: Number of users in the batch
+        analysis_window_minutes: Time window size in minutes (e.g., 5)
+        window_start: If given, queries older than this epoch time are ignored
+        avg_similarity: Optional per-user average similarity (e.g. from the
+                        exact difflib backend); estimated from sketches if None
+        min_v_scores: Optional per-user floor for the V-Score (e.g. the burst
+                      V-Score from velocity.VelocityTracker)
+    
+    Returns:
+        tuple: (v_scores, d_scores, suspicion_scores) NumPy arrays of length num_users
+    
+    Same formulas as calculate_velocity_score, similarity_score_from_average
+    and combine_scores, applied to whole columns instead of one user per call.
+    """
+    user_index = np.asarray(user_index, dtype=np.int64)
+    if window_start is not None:
+        in_window = np.asarray(timestamps, dtype=np.float64) >= window_start
+        user_index = user_index[in_window]
+        sketch_ids = np.asarray(sketch_ids)[in_window]
+
+    counts = np.bincount(user_index, minlength=num_users)
+
+    if analysis_window_minutes <= 0:
+        v_scores = np.zeros(num_users)
+    else:
+        qpm = counts / analysis_window_minutes
+        v_scores = np.clip(
+            (qpm - VELOCITY_THRESHOLD_NORMAL) / (VELOCITY_THRESHOLD_BOT - VELOCITY_THRESHOLD_NORMAL), 0.0, 1.0
+        )
+    if min_v_scores is not None:
+        v_scores = np.maximum(v_scores, np.asarray(min_v_scores, dtype=np.float64))
 
+    if avg_similarity is None:
+        avg_similarity = batch_average_similarity(user_index, sketch_ids, sketches, num_users)
+    d_scores = np.clip(
+        (np.asarray(avg_similarity, dtype=np.float64) - SIMILARITY_THRESHOLD_NORMAL)
+        / (SIMILARITY_THRESHOLD_BOT - SIMILARITY_THRESHOLD_NORMAL), 0.0, 1.0
+    )
+    d_scores[counts < 2] = 0.0
 
+    suspicion_scores = np.clip(v_scores * VELOCITY_WEIGHT + d_scores * SIMILARITY_WEIGHT, 0.0, 1.0)
+    return v_scores, d_scores, suspicion_scores
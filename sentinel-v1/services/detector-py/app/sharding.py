@@ -0,0 +1,212 @@
+"""
+Shard assignment for running several detector instances side by side.
+
+userIds are mapped onto DETECTOR_SHARDS fixed shards with a jump consistent
+hash, and shards are leased to instances through one document per shard in
+the `detector_shards` collection, next to one heartbeat document per
+running instance:
+
+    {_id: <shard>, kind: "shard", owner: <instance id>, lease_expires_at, progress: {...}}
+    {_id: "instance:<instance id>", kind: "instance", lease_expires_at}
+
+Every instance runs a ShardCoordinator heartbeat thread which renews its
+leases, claims unowned or expired shards up to its fair share
+(ceil(shards / live instances)) and hands back shards above it, so load
+spreads out as instances join and fails over when one stops renewing.
+Each instance only keeps windows for users of the shards it owns; its
+/run_analysis sweep and change feed cover that slice only.
+
+DETECTOR_SHARDS=1 (the default) disables sharding: one instance owns every
+user and nothing is written to `detector_shards`.
+"""
+import hashlib
+import logging
+import math
+import os
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+DETECTOR_SHARDS = int(os.getenv("DETECTOR_SHARDS", "1"))
+DETECTOR_INSTANCE_ID = os.getenv("DETECTOR_INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+SHARD_LEASE_SECONDS = float(os.getenv("SHARD_LEASE_SECONDS", "30"))
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_SHARD = "shard"
+_INSTANCE = "instance"
+
+
+def jump_hash(key: int, num_buckets: int) -> int:
+    """Jump consistent hash (Lamping & Veach): bucket in [0, num_buckets) for a 64-bit key."""
+    bucket, j = -1, 0
+    while j < num_buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_of(user_id: str, num_shards: int) -> int:
+    """
+    Shard owning a userId.
+
+    Growing num_shards from n to n+1 moves only ~1/(n+1) of the users.
+    """
+    if num_shards <= 1:
+        return 0
+    digest = hashlib.blake2b(str(user_id).encode("utf-8"), digest_size=8).digest()
+    return jump_hash(int.from_bytes(digest, "little"), num_shards)
+
+
+class ShardCoordinator:
+    """Leases shards for this instance and keeps them renewed in a background thread."""
+
+    def __init__(self, collection, num_shards: int = DETECTOR_SHARDS, instance_id: str = DETECTOR_INSTANCE_ID,
+                 lease_seconds: float = SHARD_LEASE_SECONDS):
+        self.collection = collection
+        self.num_shards = num_shards
+        self.instance_id = instance_id
+        self.lease_seconds = lease_seconds
+        # Shards this instance currently holds; replaced, never mutated
+        self.owned = frozenset()
+        # Bumped whenever `owned` changes, so the engine knows to rebuild
+        self.generation = 0
+        self._instance_doc_id = f"{_INSTANCE}:{instance_id}"
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.num_shards > 1
+
+    def owns(self, user_id: str) -> bool:
+        return shard_of(user_id, self.num_shards) in self.owned
+
+    def ensure_shards(self) -> None:
+        """Create the shard documents if they do not exist yet."""
+        self.collection.create_index([("kind", ASCENDING), ("owner", ASCENDING)], name="kind_owner")
+        for shard in range(self.num_shards):
+            self.collection.update_one(
+                {"_id": shard},
+                {"$setOnInsert": {"kind": _SHARD, "owner": None, "lease_expires_at": _EPOCH}},
+                upsert=True
+            )
+
+    def heartbeat(self) -> frozenset:
+        """
+        Renew, claim and release leases once.
+
+        Returns:
+            frozenset: Shards owned after this heartbeat
+        """
+        now = datetime.now(timezone.utc)
+        expires = now + timedelta(seconds=self.lease_seconds)
+
+        # Announce this instance, owning shards or not, so the others make room
+        self.collection.update_one(
+            {"_id": self._instance_doc_id},
+            {"$set": {"kind": _INSTANCE, "instance_id": self.instance_id, "lease_expires_at": expires}},
+            upsert=True
+        )
+
+        # Renew; a lease that someone else took over is simply not matched
+        renewed = set()
+        if self.owned:
+            self.collection.update_many(
+                {"_id": {"$in": list(self.owned)}, "owner": self.instance_id},
+                {"$set": {"lease_expires_at": expires}}
+            )
+            renewed = {
+                doc["_id"]
+                for doc in self.collection.find({"kind": _SHARD, "owner": self.instance_id}, {"_id": 1})
+            } & self.owned
+
+        live = {
+            doc["instance_id"]
+            for doc in self.collection.find({"kind": _INSTANCE, "lease_expires_at": {"$gt": now}},
+                                            {"instance_id": 1})
+        }
+        live.add(self.instance_id)
+        target = math.ceil(self.num_shards / len(live))
+
+        owned = set(renewed)
+        # Hand back the highest shards above the fair share; a newer instance picks them up
+        for shard in sorted(owned, reverse=True)[:max(0, len(owned) - target)]:
+            self.collection.update_one(
+                {"_id": shard, "owner": self.instance_id},
+                {"$set": {"owner": None, "lease_expires_at": _EPOCH}}
+            )
+            owned.discard(shard)
+
+        if len(owned) < target:
+            free = self.collection.find(
+                {"kind": _SHARD, "$or": [{"owner": None}, {"lease_expires_at": {"$lte": now}}]}, {"_id": 1}
+            ).sort("_id", ASCENDING)
+            for doc in list(free):
+                if len(owned) >= target:
+                    break
+                claimed = self.collection.find_one_and_update(
+                    {"_id": doc["_id"], "$or": [{"owner": None}, {"lease_expires_at": {"$lte": now}}]},
+                    {"$set": {"owner": self.instance_id, "lease_expires_at": expires, "claimed_at": now}}
+                )
+                if claimed is not None:
+                    owned.add(doc["_id"])
+
+        owned = frozenset(owned)
+        if owned != self.owned:
+            logger.info("Instance %s now owns shards %s of %d", self.instance_id, sorted(owned), self.num_shards)
+            self.owned = owned
+            self.generation += 1
+        return owned
+
+    def record_progress(self, progress: dict) -> None:
+        """Attach this instance's latest cycle stats to the shards it owns."""
+        if not self.owned:
+            return
+        self.collection.update_many(
+            {"_id": {"$in": list(self.owned)}, "owner": self.instance_id},
+            {"$set": {"progress": progress}}
+        )
+
+    def status(self) -> list:
+        """Shard documents, by shard number."""
+        return list(self.collection.find({"kind": _SHARD}).sort("_id", ASCENDING))
+
+    def start(self) -> None:
+        if self._thread is None:
+            self.ensure_shards()
+            self.heartbeat()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="shard-coordinator", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop renewing and release owned shards so others take over immediately."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(self.lease_seconds)
+        self._thread = None
+        try:
+            self.collection.update_many(
+                {"kind": _SHARD, "owner": self.instance_id},
+                {"$set": {"owner": None, "lease_expires_at": _EPOCH}}
+            )
+            self.collection.delete_one({"_id": self._instance_doc_id})
+        except PyMongoError:
+            logger.warning("Could not release shards of %s; their leases will expire", self.instance_id)
+        self.owned = frozenset()
+        self.generation += 1
+
+    def _run(self) -> None:
+        # Renew well before expiry so one slow round trip doesn't lose the lease
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.heartbeat()
+            except PyMongoError:
+                logger.exception("Shard heartbeat failed")
@@ -0,0 +1,295 @@
+"""
+Cross-cycle prompt similarity cache and incremental per-user pair sums.
+
+Consecutive analysis windows overlap almost completely, so most prompt
+pairs scored in one cycle are scored again in the next. SimilarityCache
+memoizes, keyed by a hash of the prompt content:
+    prompt key           -> normalized text (lower + strip)
+    (prompt key, key)    -> SequenceMatcher ratio of the two normalized texts
+in one LRU bounded by an estimate of the bytes it holds.
+
+PairSums keeps each user's running sum of pairwise similarities next to the
+window (UserWindow.pair_sum covers the `summed` oldest entries). A new entry
+adds its pairs with the entries before it when the user is next scored; an
+entry leaving the window subtracts its pairs as it goes. A steady-state
+cycle therefore compares O(new prompts x window) pairs instead of
+O(window^2), and the subtraction is served from the cache.
+
+When bringing a sum up to date would cost more than a share of a full
+evaluation (a fresh window, or a flood of new entries), the window is
+evaluated with scoring.bounded_average_similarity instead, through the same
+cache, which usually settles bot windows after a few hundred pairs.
+
+With a ScoringExecutor pool, the engine runs the comparisons that are not
+cached in worker processes first (pair_ratios and evaluate_windows below)
+and hands the results to PairSums, which then only does lookups.
+
+The average is the exact backend's average up to float rounding of the
+running sum.
+"""
+import hashlib
+import os
+import sys
+from collections import OrderedDict
+from difflib import SequenceMatcher
+
+from .scoring import bounded_average_similarity
+
+# Byte budget for cached normalized prompts and pair results (0 = no cache,
+# the exact backend then re-compares every window from scratch)
+SIMILARITY_CACHE_BYTES = int(os.getenv("SIMILARITY_CACHE_BYTES", str(64 * 1024 * 1024)))
+# Bring a running sum up to date only if that costs at most this share of
+# the window's pairs; otherwise evaluate the window as a whole
+INCREMENTAL_MAX_PAIR_SHARE = 0.25
+# Windows with at most this many pairs are always summed incrementally
+INCREMENTAL_MIN_PAIRS = 256
+
+_PAIR_ENTRY_BYTES = 150     # OrderedDict node, 32-byte key, float
+_PROMPT_ENTRY_BYTES = 120   # OrderedDict node, 16-byte key (plus the text itself)
+_AUTOJUNK_MIN_LENGTH = 200  # difflib only applies autojunk to sequences this long
+
+
+def prompt_key(prompt: str) -> bytes:
+    """Content hash identifying a prompt in the cache."""
+    return hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).digest()
+
+
+def pair_ratios(pairs: list) -> list:
+    """
+    SequenceMatcher ratios of (normalized text, normalized text) pairs.
+
+    Module-level so it can be shipped to worker processes.
+    """
+    return [SequenceMatcher(None, text_a, text_b).ratio() for text_a, text_b in pairs]
+
+
+def evaluate_windows(prompt_lists: list) -> list:
+    """
+    bounded_average_similarity over whole windows, for worker processes.
+
+    Returns:
+        list: (average, exit, compared) per window; compared holds the
+        (i, j, ratio) of every comparison when the exit was "complete", so
+        the caller can seed its cache, and is None otherwise
+    """
+    results = []
+    for prompts in prompt_lists:
+        normalized = [prompt.lower().strip() for prompt in prompts]
+        compared = []
+
+        def similarity(i, j):
+            value = SequenceMatcher(None, normalized[i], normalized[j]).ratio()
+            compared.append((i, j, value))
+            return value
+
+        stats = {}
+        average = bounded_average_similarity(prompts, stats=stats, similarity=similarity)
+        results.append((average, stats["exit"], compared if stats["exit"] == "complete" else None))
+    return results
+
+
+class SimilarityCache:
+    """LRU of normalized prompts and pair similarities, bounded in bytes."""
+
+    def __init__(self, max_bytes: int = SIMILARITY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def normalized(self, key: bytes, prompt: str) -> str:
+        text = self._get(key)
+        if text is None:
+            text = prompt.lower().strip()
+            self._put(key, text, _PROMPT_ENTRY_BYTES + sys.getsizeof(text))
+        return text
+
+    def pair(self, key_a: bytes, prompt_a: str, key_b: bytes, prompt_b: str) -> float:
+        """
+        SequenceMatcher ratio of two prompts, as calculate_text_similarity
+        computes it (order matters: difflib's ratio is not symmetric).
+        """
+        key = key_a + key_b
+        value = self._get(key)
+        if value is None:
+            text_a = self.normalized(key_a, prompt_a)
+            if key_a == key_b and len(text_a) < _AUTOJUNK_MIN_LENGTH:
+                value = 1.0
+            else:
+                value = SequenceMatcher(None, text_a, self.normalized(key_b, prompt_b)).ratio()
+            self._put(key, value, _PAIR_ENTRY_BYTES)
+        return value
+
+    def has_pair(self, key_a: bytes, key_b: bytes) -> bool:
+        """Whether pair() is cached, without touching the LRU order or the hit counts."""
+        return key_a + key_b in self._entries
+
+    def add_pair(self, key_a: bytes, key_b: bytes, value: float) -> None:
+        """Cache a pair ratio computed elsewhere (e.g. in a worker process)."""
+        self._put(key_a + key_b, value, _PAIR_ENTRY_BYTES)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def _put(self, key, value, size: int) -> None:
+        if self.max_bytes <= 0:
+            return
+        self._entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+
+class PairSums:
+    """
+    Maintains UserWindow.pair_sum / summed for a WindowStore.
+
+    The store calls evict_oldest() before it drops a window's oldest entry;
+    the engine calls average() when it scores the window.
+    """
+
+    def __init__(self, cache: SimilarityCache = None):
+        self.cache = cache if cache is not None else SimilarityCache()
+        self.incremental_updates = 0
+        self.full_evaluations = 0
+
+    def _similarity(self, prompts, id_a: int, id_b: int) -> float:
+        return self.cache.pair(prompts.key(id_a), prompts.get(id_a), prompts.key(id_b), prompts.get(id_b))
+
+    def evict_oldest(self, store, window) -> None:
+        """Remove the oldest entry's pairs from the running sum."""
+        if window.summed <= 1:
+            window.summed = 0
+            window.pair_sum = 0.0
+            return
+        prompt_ids = window.prompt_ids
+        capacity = window.capacity
+        start = window.start
+        oldest = prompt_ids[start]
+        removed = 0.0
+        for k in range(1, window.summed):
+            removed += self._similarity(store.prompts, oldest, prompt_ids[(start + k) % capacity])
+        window.summed -= 1
+        # Reset rather than carry float residue once no pairs are left
+        window.pair_sum = window.pair_sum - removed if window.summed > 1 else 0.0
+
+    def needs_full_evaluation(self, window) -> bool:
+        """Whether average() would evaluate the window as a whole rather than update its sum."""
+        count = window.count
+        if count < 2:
+            return False
+        total_pairs = count * (count - 1) // 2
+        summed = window.summed
+        pending_pairs = total_pairs - summed * (summed - 1) // 2
+        return pending_pairs > max(total_pairs * INCREMENTAL_MAX_PAIR_SHARE, INCREMENTAL_MIN_PAIRS)
+
+    def missing_pairs(self, store, window, missing: dict) -> None:
+        """
+        Collect the comparisons an incremental update of the window still needs.
+
+        Adds {(key_a, key_b): (normalized text a, normalized text b)} to
+        missing for the pairs the cache does not hold; see pair_ratios.
+        """
+        prompts = store.prompts
+        prompt_ids = window.prompt_ids
+        capacity = window.capacity
+        start = window.start
+        for k in range(window.summed, window.count):
+            newest = prompt_ids[(start + k) % capacity]
+            key_b = prompts.key(newest)
+            for i in range(k):
+                older = prompt_ids[(start + i) % capacity]
+                key_a = prompts.key(older)
+                if (key_a, key_b) in missing or self.cache.has_pair(key_a, key_b):
+                    continue
+                text_a = self.cache.normalized(key_a, prompts.get(older))
+                if key_a == key_b and len(text_a) < _AUTOJUNK_MIN_LENGTH:
+                    continue
+                missing[key_a, key_b] = (text_a, self.cache.normalized(key_b, prompts.get(newest)))
+
+    def add_pairs(self, missing: dict, ratios: list) -> None:
+        """Cache the ratios pair_ratios computed for missing_pairs' output."""
+        for (key_a, key_b), value in zip(missing, ratios):
+            self.cache.add_pair(key_a, key_b, value)
+
+    def average(self, store, window, evaluated: tuple = None) -> float:
+        """
+        Average pairwise similarity of the window (0.0 below 2 entries).
+
+        Brings the running sum up to date when that is cheap, otherwise
+        evaluates the whole window with bounded_average_similarity.
+
+        Args:
+            evaluated: The window's evaluate_windows result, when its full
+                       evaluation already ran in a worker process
+        """
+        count = window.count
+        if count < 2:
+            return 0.0
+        total_pairs = count * (count - 1) // 2
+        summed = window.summed
+        prompts = store.prompts
+        prompt_ids = window.prompt_ids
+        capacity = window.capacity
+        start = window.start
+
+        if not self.needs_full_evaluation(window):
+            self.incremental_updates += 1
+            added = 0.0
+            for k in range(summed, count):
+                newest = prompt_ids[(start + k) % capacity]
+                for i in range(k):
+                    added += self._similarity(prompts, prompt_ids[(start + i) % capacity], newest)
+            window.pair_sum += added
+            window.summed = count
+            return window.pair_sum / total_pairs
+
+        self.full_evaluations += 1
+        _, ids = window.columns()
+        if evaluated is not None:
+            avg_similarity, exit_kind, compared = evaluated
+            if compared is not None:
+                # Seed the cache so later updates and evictions of this window hit it
+                for i, j, value in compared:
+                    self.cache.add_pair(prompts.key(ids[i]), prompts.key(ids[j]), value)
+        else:
+            stats = {}
+            avg_similarity = bounded_average_similarity(
+                [prompts.get(prompt_id) for prompt_id in ids],
+                stats=stats,
+                similarity=lambda i, j: self._similarity(prompts, ids[i], ids[j])
+            )
+            exit_kind = stats["exit"]
+        if exit_kind == "complete":
+            # Every pair was compared: the running sum starts from here
+            window.pair_sum = avg_similarity * total_pairs
+            window.summed = count
+        else:
+            window.pair_sum = 0.0
+            window.summed = 0
+        return avg_similarity
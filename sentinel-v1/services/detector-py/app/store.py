@@ -0,0 +1,130 @@
+"""
+MongoDB data access for the detector.
+
+All reads and writes of one analysis cycle go through here so that a cycle
+costs a constant number of round trips instead of 2N+1:
+    - one projected cursor for the window's query logs, sorted by user
+      (bootstrap) or by timestamp (incremental)
+    - one $in query for the previous scores of the changed users
+    - one unordered bulk_write for the new scores
+"""
+import itertools
+import logging
+import os
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+
+# Only these fields of a query log are used by scoring.py and the engine's
+# cursor. original_answer and noisy_answer_served can be kilobytes each and
+# are never fetched.
+LOG_PROJECTION = {"userId": 1, "timestamp": 1, "prompt": 1, "insertedAt": 1}
+
+# Raw query_logs are expired by MongoDB after this many seconds (0 = keep forever)
+QUERY_LOG_TTL_SECONDS = int(os.getenv("QUERY_LOG_TTL_SECONDS", "0"))
+
+CURSOR_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_indexes(users_collection, query_logs_collection, ttl_seconds: int = QUERY_LOG_TTL_SECONDS) -> None:
+    """
+    Declare the indexes the detector's access pattern relies on.
+
+    - query_logs (userId, timestamp): per-user window lookups and the
+      bootstrap read of the window
+    - query_logs (timestamp): the high-water-mark cursor and the window
+      read; created as a TTL index when ttl_seconds > 0
+    - query_logs (insertedAt): the cursor's branch for logs written late
+    - users (userId): score reads and bulk updates
+    """
+    query_logs_collection.create_index(
+        [("userId", ASCENDING), ("timestamp", ASCENDING)], name="userId_timestamp"
+    )
+    try:
+        if ttl_seconds > 0:
+            query_logs_collection.create_index(
+                [("timestamp", ASCENDING)], name="timestamp_ttl", expireAfterSeconds=ttl_seconds
+            )
+        else:
+            query_logs_collection.create_index([("timestamp", ASCENDING)], name="timestamp")
+    except OperationFailure as e:
+        # An index on `timestamp` already exists with other options (e.g. the
+        # TTL was switched on or off). It still serves the range queries.
+        logger.warning("Keeping existing timestamp index on query_logs: %s", e)
+    query_logs_collection.create_index([("insertedAt", ASCENDING)], name="insertedAt")
+    users_collection.create_index([("userId", ASCENDING)], name="userId")
+
+
+def fetch_window_logs(query_logs_collection, since):
+    """
+    Stream every log of the analysis window grouped by user.
+
+    The logs are read with one cursor sorted on (userId, timestamp) and
+    grouped client-side. A server-side $group/$push would build one document
+    per user, which fails once a heavy user's window passes the 16MB BSON
+    document limit.
+
+    Returns:
+        Iterator of (userId, entries) where entries iterates over
+        {"_id", "userId", "timestamp", "prompt", "insertedAt"} dicts sorted by timestamp;
+        consume each user's entries before moving on to the next user
+    """
+    cursor = query_logs_collection.find(
+        {"timestamp": {"$gte": since}}, LOG_PROJECTION, batch_size=CURSOR_BATCH_SIZE, allow_disk_use=True
+    ).sort([("userId", ASCENDING), ("timestamp", ASCENDING)])
+    return itertools.groupby(cursor, key=_user_of)
+
+
+def _user_of(log):
+    return log.get("userId")
+
+
+def iter_new_logs(query_logs_collection, log_filter: dict):
+    """Stream logs matching log_filter in timestamp order, projected to the scoring fields."""
+    return query_logs_collection.find(
+        log_filter, LOG_PROJECTION, batch_size=CURSOR_BATCH_SIZE
+    ).sort("timestamp", ASCENDING)
+
+
+def fetch_scores(users_collection, user_ids) -> dict:
+    """
+    Current suspicion_score of the given users, in one query.
+
+    Users without a document in `users` are left out of the result.
+    """
+    return {
+        user["userId"]: user.get("suspicion_score", 0.0)
+        for user in users_collection.find(
+            {"userId": {"$in": list(user_ids)}},
+            {"userId": 1, "suspicion_score": 1}
+        )
+    }
+
+
+def iter_scores(users_collection):
+    """(userId, suspicion_score, last_seen) for every user, for score snapshots."""
+    for user in users_collection.find({}, {"_id": 0, "userId": 1, "suspicion_score": 1, "last_seen": 1}):
+        if "userId" in user:
+            yield user["userId"], user.get("suspicion_score", 0.0), user.get("last_seen")
+
+
+def write_scores(users_collection, scores: dict, now) -> int:
+    """
+    Write new suspicion scores with a single unordered bulk_write.
+
+    Returns:
+        int: Number of user documents matched
+    """
+    if not scores:
+        return 0
+    operations = [
+        UpdateOne(
+            {"userId": user_id},
+            {"$set": {"suspicion_score": score, "last_seen": now}}
+        )
+        for user_id, score in scores.items()
+    ]
+    result = users_collection.bulk_write(operations, ordered=False)
+    return result.matched_count
@@ -0,0 +1,358 @@
+"""
+Durable outbox for blockchain threat logging.
+
+run_analysis only enqueues flagged users; a background worker started in
+the service lifespan drains the outbox in batches, handing each batch to a
+sink without blocking the event loop, and retries failures with exponential
+backoff. The sink runs logThreat.js once per batch, or sends the batch to a
+long-lived threatSidecar.js when THREAT_SIDECAR_ADDR is set. Entries live in
+the `threat_outbox` collection so pending threats survive a detector restart.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import shlex
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from pymongo import ASCENDING, ReturnDocument
+
+from .metrics import STAGE_BLOCKCHAIN, metrics
+
+logger = logging.getLogger(__name__)
+
+THREAT_BATCH_SIZE = int(os.getenv("THREAT_BATCH_SIZE", "10"))
+THREAT_MAX_ATTEMPTS = int(os.getenv("THREAT_MAX_ATTEMPTS", "8"))
+THREAT_RETRY_BASE_SECONDS = float(os.getenv("THREAT_RETRY_BASE_SECONDS", "5"))
+THREAT_RETRY_MAX_SECONDS = float(os.getenv("THREAT_RETRY_MAX_SECONDS", "300"))
+THREAT_POLL_SECONDS = float(os.getenv("THREAT_POLL_SECONDS", "2"))
+# An in_flight entry whose worker died is picked up again this long after the
+# sink's own timeout for a full batch would have expired
+THREAT_LEASE_MARGIN_SECONDS = float(os.getenv("THREAT_LEASE_MARGIN_SECONDS", "60"))
+# threatSidecar.js address (host:port or a Unix socket path); empty = spawn logThreat.js per batch
+THREAT_SIDECAR_ADDR = os.getenv("THREAT_SIDECAR_ADDR", "")
+
+STATUS_PENDING = "pending"
+STATUS_IN_FLIGHT = "in_flight"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class SubprocessThreatSink:
+    """
+    Logs a batch of users with one `node logThreat.js <userId> ...` run.
+
+    The command can be overridden with THREAT_LOGGER_CMD (e.g. a stub script
+    for tests); user ids are appended as arguments. Per-user results are read
+    from the THREAT_LOGGED / THREAT_FAILED lines the script prints.
+    """
+
+    def __init__(self, scripts_path, command: str = None, timeout: float = 30.0, per_user_timeout: float = 10.0):
+        script_path = Path(scripts_path) / "logThreat.js"
+        command = command or os.getenv("THREAT_LOGGER_CMD")
+        self.command = shlex.split(command) if command else ["node", str(script_path)]
+        # Ensure node can find the root .env file by setting CWD
+        self.cwd = script_path.parent.parent.parent
+        self.timeout = timeout
+        self.per_user_timeout = per_user_timeout
+
+    def max_seconds(self, count: int) -> float:
+        """Longest a log_threats call for `count` users can take before it times out."""
+        return self.timeout + self.per_user_timeout * count
+
+    async def log_threats(self, user_ids: list) -> dict:
+        """
+        Returns:
+            dict: {userId: None on success, or an error string}
+        """
+        results = {user_id: "no result reported" for user_id in user_ids}
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self.command, *user_ids,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=self.cwd
+            )
+        except OSError as e:
+            return {user_id: f"could not start logger: {e}" for user_id in user_ids}
+
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(),
+                timeout=self.max_seconds(len(user_ids))
+            )
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return {user_id: "timeout while logging threat" for user_id in user_ids}
+
+        for line in stdout.decode(errors="replace").splitlines():
+            parts = line.strip().split(" ", 2)
+            if len(parts) < 2 or parts[1] not in results:
+                continue
+            if parts[0] == "THREAT_LOGGED":
+                results[parts[1]] = None
+            elif parts[0] == "THREAT_FAILED":
+                results[parts[1]] = parts[2] if len(parts) > 2 else "failed"
+
+        if process.returncode != 0:
+            error = stderr.decode(errors="replace").strip()[-500:] or f"exit code {process.returncode}"
+            for user_id, result in results.items():
+                if result == "no result reported":
+                    results[user_id] = error
+        return results
+
+
+class SidecarThreatSink:
+    """
+    Logs a batch of users through a running threatSidecar.js.
+
+    The sidecar keeps the RPC connection, contract and nonce state warm, so
+    a batch costs a request on a persistent local socket instead of a Node
+    start-up. Requests and responses are JSON lines matched by id. When the
+    sidecar cannot be reached the batch goes to `fallback` (normally a
+    SubprocessThreatSink) if one is given.
+    """
+
+    def __init__(self, address: str, fallback=None, timeout: float = 30.0, per_user_timeout: float = 10.0):
+        self.address = address
+        self.fallback = fallback
+        self.timeout = timeout
+        self.per_user_timeout = per_user_timeout
+        self._ids = itertools.count(1)
+        self._reader = None
+        self._writer = None
+        # One request in flight per connection
+        self._lock = asyncio.Lock()
+
+    async def _connect(self) -> None:
+        host, sep, port = self.address.rpartition(":")
+        if sep and port.isdigit() and "/" not in host and "\\" not in host:
+            self._reader, self._writer = await asyncio.open_connection(host or "127.0.0.1", int(port))
+        else:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.address)
+
+    async def _request(self, payload: dict, timeout: float) -> dict:
+        if self._writer is None:
+            try:
+                await asyncio.wait_for(self._connect(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                raise ConnectionError(f"could not connect within {self.timeout:g}s") from None
+        request_id = next(self._ids)
+        self._writer.write(json.dumps({"id": request_id, **payload}).encode() + b"\n")
+        await self._writer.drain()
+
+        async def read_response():
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    raise ConnectionError("sidecar closed the connection")
+                response = json.loads(line)
+                # Skip answers to requests that timed out earlier
+                if response.get("id") == request_id:
+                    return response
+
+        return await asyncio.wait_for(read_response(), timeout=timeout)
+
+    def max_seconds(self, count: int) -> float:
+        """Longest a log_threats call for `count` users can take, including the connect and any fallback."""
+        seconds = self.timeout + self.timeout + self.per_user_timeout * count
+        if self.fallback is not None:
+            seconds += self.fallback.max_seconds(count)
+        return seconds
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            writer, self._reader, self._writer = self._writer, None, None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def log_threats(self, user_ids: list) -> dict:
+        """
+        Returns:
+            dict: {userId: None on success, or an error string}
+        """
+        async with self._lock:
+            try:
+                response = await self._request(
+                    {"userIds": user_ids}, timeout=self.timeout + self.per_user_timeout * len(user_ids)
+                )
+            except asyncio.TimeoutError:
+                # Transactions may still confirm; the retry finds them already logged
+                await self.close()
+                return {user_id: "timeout while logging threat" for user_id in user_ids}
+            except (OSError, ConnectionError, ValueError) as e:
+                await self.close()
+                if self.fallback is None:
+                    return {user_id: f"threat sidecar unavailable: {e}" for user_id in user_ids}
+                logger.warning("Threat sidecar at %s unavailable (%s); spawning the logger instead", self.address, e)
+                return await self.fallback.log_threats(user_ids)
+
+        if "results" not in response:
+            error = response.get("error", "no result reported")
+            return {user_id: error for user_id in user_ids}
+        results = {}
+        for user_id in user_ids:
+            result = response["results"].get(user_id)
+            if result is None:
+                results[user_id] = "no result reported"
+            else:
+                results[user_id] = result.get("error")
+        return results
+
+
+class ThreatOutbox:
+    """Mongo-backed outbox of users to log on the blockchain, plus its worker."""
+
+    def __init__(self, collection, sink, batch_size: int = THREAT_BATCH_SIZE,
+                 max_attempts: int = THREAT_MAX_ATTEMPTS):
+        self.collection = collection
+        self.sink = sink
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._loop = None
+        self._task = None
+        self._stopping = False
+
+    def ensure_indexes(self) -> None:
+        self.collection.create_index(
+            [("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt"
+        )
+
+    def enqueue(self, user_id: str, score: float = None) -> None:
+        """
+        Record a flagged user. Called from the analysis cycle; returns immediately.
+
+        Safe to call from any thread.
+        """
+        now = datetime.now(timezone.utc)
+        self.collection.insert_one({
+            "userId": user_id,
+            "score": score,
+            "status": STATUS_PENDING,
+            "attempts": 0,
+            "created_at": now,
+            "next_attempt_at": now,
+            "last_error": None,
+        })
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def lease_seconds(self) -> float:
+        """
+        How long a claimed batch stays in_flight before another worker may take it.
+
+        Outlasts the sink's timeout for a full batch, so a batch that is still
+        being logged is never handed to a second worker.
+        """
+        max_seconds = getattr(self.sink, "max_seconds", None)
+        sink_seconds = max_seconds(self.batch_size) if max_seconds is not None else 0.0
+        return sink_seconds + THREAT_LEASE_MARGIN_SECONDS
+
+    def counts(self) -> dict:
+        """Number of outbox entries per status."""
+        return {
+            row["_id"]: row["count"]
+            for row in self.collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])
+        }
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    async def drain_once(self) -> int:
+        """
+        Claim one batch of due entries and hand it to the sink.
+
+        Returns:
+            int: Number of entries processed
+        """
+        batch = await asyncio.to_thread(self._claim_batch)
+        if not batch:
+            return 0
+
+        user_ids = list(dict.fromkeys(entry["userId"] for entry in batch))
+        logger.info("Threat outbox: logging %d user(s) to blockchain: %s", len(user_ids), ", ".join(user_ids))
+        with metrics.timer(STAGE_BLOCKCHAIN):
+            results = await self.sink.log_threats(user_ids)
+        await asyncio.to_thread(self._record_results, batch, results)
+        return len(batch)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                processed = await self.drain_once()
+            except Exception:
+                logger.exception("Threat outbox worker error")
+                processed = 0
+            if processed:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=THREAT_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _claim_batch(self, now: datetime = None) -> list:
+        now = now or datetime.now(timezone.utc)
+        due = {"$or": [
+            {"status": STATUS_PENDING, "next_attempt_at": {"$lte": now}},
+            {"status": STATUS_IN_FLIGHT, "claimed_at": {"$lt": now - timedelta(seconds=self.lease_seconds())}},
+        ]}
+        batch = []
+        # One atomic claim per entry so several detector instances can share the outbox
+        for _ in range(self.batch_size):
+            entry = self.collection.find_one_and_update(
+                due,
+                {"$set": {"status": STATUS_IN_FLIGHT, "claimed_at": now}},
+                sort=[("next_attempt_at", ASCENDING)],
+                return_document=ReturnDocument.AFTER
+            )
+            if entry is None:
+                break
+            batch.append(entry)
+        return batch
+
+    def _record_results(self, batch: list, results: dict) -> None:
+        now = datetime.now(timezone.utc)
+        for entry in batch:
+            error = results.get(entry["userId"], "no result reported")
+            if error is None:
+                logger.info("Threat logged successfully for %s", entry["userId"])
+                metrics.inc("threats_logged_total")
+                self.collection.update_one(
+                    {"_id": entry["_id"]},
+                    {"$set": {"status": STATUS_DONE, "logged_at": now, "last_error": None}}
+                )
+                continue
+
+            attempts = entry.get("attempts", 0) + 1
+            delay = min(THREAT_RETRY_BASE_SECONDS * (2 ** (attempts - 1)), THREAT_RETRY_MAX_SECONDS)
+            status = STATUS_FAILED if attempts >= self.max_attempts else STATUS_PENDING
+            logger.warning("Blockchain logging failed for %s (attempt %d): %s", entry["userId"], attempts, error)
+            metrics.inc("threats_failed_total")
+            self.collection.update_one(
+                {"_id": entry["_id"]},
+                {"$set": {
+                    "status": status,
+                    "attempts": attempts,
+                    "last_error": error,
+                    "next_attempt_at": now + timedelta(seconds=delay),
+                }}
+            )
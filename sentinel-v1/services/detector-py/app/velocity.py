@@ -0,0 +1,95 @@
+"""
+Burst-aware velocity: exponentially decayed query counters per user.
+
+The V-Score in scoring.py is the number of queries in the analysis window
+divided by its length, so 60 queries fired in 10 seconds weigh no more than
+60 queries spread over 5 minutes. VelocityTracker keeps one decayed counter
+per time constant (10s and 1m by default) next to each user's window:
+
+    on a query at t:    c = c * exp(-(t - t_last) / tau) + 1
+    rate at time now:   qpm = 60 * c * exp(-(now - t_last) / tau) / tau
+
+Updates are O(1) per query and need no history. Each counter is scored
+against its own QPM thresholds, and the burst V-Score is the highest of
+them. The engine combines it with the window V-Score by taking the maximum,
+so the short windows only ever add sensitivity.
+
+VELOCITY_MODE=window turns burst scoring off (window V-Score only).
+"""
+import math
+import os
+from array import array
+
+VELOCITY_MODE = os.getenv("VELOCITY_MODE", "multi")
+
+# seconds:normal_qpm:bot_qpm per window. A human rarely sends more than 3
+# prompts in 10 seconds (18 QPM); 10 in 10 seconds (60 QPM) is a script.
+DEFAULT_VELOCITY_WINDOWS = "10:18:60,60:8:25"
+
+
+def parse_velocity_windows(spec: str) -> list:
+    """
+    Parse "seconds:normal_qpm:bot_qpm,..." into [(seconds, normal_qpm, bot_qpm), ...].
+
+    Raises:
+        ValueError: on a malformed entry or bot_qpm <= normal_qpm
+    """
+    windows = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        seconds, normal_qpm, bot_qpm = (float(part) for part in item.split(":"))
+        if seconds <= 0 or bot_qpm <= normal_qpm:
+            raise ValueError(f"Invalid velocity window: {item!r}")
+        windows.append((seconds, normal_qpm, bot_qpm))
+    return windows
+
+
+VELOCITY_WINDOWS = parse_velocity_windows(os.getenv("VELOCITY_WINDOWS", DEFAULT_VELOCITY_WINDOWS))
+
+
+class VelocityTracker:
+    """
+    Decayed query counters for a fixed set of windows.
+
+    Counters for one user live in a small array created by new_counters():
+    one slot per window plus the time of the last update in the final slot.
+    """
+
+    def __init__(self, windows=VELOCITY_WINDOWS):
+        self.windows = list(windows)
+        self._taus = [seconds for seconds, _, _ in self.windows]
+
+    def new_counters(self) -> array:
+        return array("d", bytes(8 * (len(self.windows) + 1)))
+
+    def record(self, counters: array, epoch: float) -> None:
+        """Count one query at epoch seconds."""
+        last = len(self._taus)
+        elapsed = epoch - counters[last]
+        if elapsed >= 0:
+            for k, tau in enumerate(self._taus):
+                counters[k] = counters[k] * math.exp(-elapsed / tau) + 1.0
+            counters[last] = epoch
+        else:
+            # Older than the latest query seen: add its decayed contribution
+            for k, tau in enumerate(self._taus):
+                counters[k] += math.exp(elapsed / tau)
+
+    def rates_qpm(self, counters: array, now: float) -> list:
+        """Estimated queries per minute in each window, as of now."""
+        last = len(self._taus)
+        elapsed = max(0.0, now - counters[last])
+        return [
+            60.0 * counters[k] * math.exp(-elapsed / tau) / tau
+            for k, tau in enumerate(self._taus)
+        ]
+
+    def score(self, counters: array, now: float) -> float:
+        """Burst V-Score: the highest per-window score, each interpolated like the window V-Score."""
+        v_score = 0.0
+        for qpm, (_, normal_qpm, bot_qpm) in zip(self.rates_qpm(counters, now), self.windows):
+            if qpm > normal_qpm:
+                v_score = max(v_score, min(1.0, (qpm - normal_qpm) / (bot_qpm - normal_qpm)))
+        return v_score
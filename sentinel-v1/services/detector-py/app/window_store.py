@@ -0,0 +1,335 @@
+"""
+Compact in-memory store of per-user query windows for the scoring engine.
+
+Only a query's timestamp and prompt are needed for scoring, so a window keeps
+two parallel ring buffers:
+    timestamps   array('d') of epoch seconds
+    prompt_ids   array('i') of ids into a shared PromptTable
+Prompts are interned and reference counted: a bot repeating the same prompt
+a thousand times costs one string plus 12 bytes per query, and a prompt is
+freed once no window references it any more.
+
+Each window starts small, doubles as needed and is capped at
+WINDOW_MAX_ENTRIES_PER_USER; past the cap the oldest entry is overwritten.
+With a similarity_cache.PairSums, the table also keeps each prompt's content
+hash and every window a running sum of its pairwise prompt similarities.
+With a cluster_index.PromptClusterIndex, every entry added or dropped is
+mirrored into the cross-user index. While a restored checkpoint is still
+being loaded (checkpoint.PendingWindows), a user's restored window is loaded
+before anything is appended to it.
+Memory is accounted incrementally, so memory_report() is O(1) and can be
+exported every cycle.
+"""
+import os
+import sys
+from array import array
+
+from .similarity_cache import prompt_key
+
+# Hard cap on entries kept per user. At the default 1024 per 5 minutes a user
+# is far past the bot velocity threshold (15/min), so the cap only trims the
+# similarity sample of users who are already flagged on velocity.
+WINDOW_MAX_ENTRIES_PER_USER = int(os.getenv("WINDOW_MAX_ENTRIES_PER_USER", "1024"))
+WINDOW_INITIAL_CAPACITY = 8
+
+# Approximate fixed costs (CPython 64-bit) used by the memory accounting
+_WINDOW_OVERHEAD_BYTES = (
+    sys.getsizeof(object()) + 8 * 11          # slotted object with 11 slots
+    + 2 * sys.getsizeof(array("d"))            # two empty arrays
+    + 100                                      # windows dict entry + user id string
+)
+_ENTRY_BYTES = array("d").itemsize + array("i").itemsize
+_PROMPT_OVERHEAD_BYTES = 100                   # interning dict entry, list slot, refcount
+
+
+class PromptTable:
+    """
+    Interned prompt strings with reference counts; ids are reused once freed.
+
+    With a key_fn, each prompt's key_fn(prompt) (e.g. a content hash) is
+    kept alongside it.
+    """
+
+    __slots__ = ("_prompts", "_ids", "_refs", "_free", "_keys", "_key_fn", "bytes")
+
+    def __init__(self, key_fn=None):
+        self._prompts = []
+        self._ids = {}
+        self._refs = array("i")
+        self._free = []
+        self._keys = [] if key_fn is not None else None
+        self._key_fn = key_fn
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def intern(self, prompt: str) -> int:
+        prompt_id = self._ids.get(prompt)
+        if prompt_id is not None:
+            self._refs[prompt_id] += 1
+            return prompt_id
+
+        key = self._key_fn(prompt) if self._key_fn is not None else None
+        if self._free:
+            prompt_id = self._free.pop()
+            self._prompts[prompt_id] = prompt
+            self._refs[prompt_id] = 1
+            if key is not None:
+                self._keys[prompt_id] = key
+        else:
+            prompt_id = len(self._prompts)
+            self._prompts.append(prompt)
+            self._refs.append(1)
+            if key is not None:
+                self._keys.append(key)
+        self._ids[prompt] = prompt_id
+        self.bytes += self._size(prompt, key)
+        return prompt_id
+
+    def release(self, prompt_id: int) -> None:
+        self._refs[prompt_id] -= 1
+        if self._refs[prompt_id] == 0:
+            prompt = self._prompts[prompt_id]
+            del self._ids[prompt]
+            self._prompts[prompt_id] = None
+            self._free.append(prompt_id)
+            key = None
+            if self._keys is not None:
+                key = self._keys[prompt_id]
+                self._keys[prompt_id] = None
+            self.bytes -= self._size(prompt, key)
+
+    def get(self, prompt_id: int) -> str:
+        return self._prompts[prompt_id]
+
+    def key(self, prompt_id: int):
+        return self._keys[prompt_id]
+
+    @staticmethod
+    def _size(prompt: str, key) -> int:
+        size = sys.getsizeof(prompt) + _PROMPT_OVERHEAD_BYTES
+        if key is not None:
+            size += sys.getsizeof(key)
+        return size
+
+
+class UserWindow:
+    """Ring buffer of one user's (epoch_seconds, prompt_id) entries, oldest first."""
+
+    __slots__ = ("user_id", "timestamps", "prompt_ids", "start", "count", "dirty", "velocity",
+                 "pair_sum", "summed", "score", "scored_at")
+
+    def __init__(self, user_id: str, capacity: int = WINDOW_INITIAL_CAPACITY):
+        self.user_id = user_id
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.prompt_ids = array("i", bytes(4 * capacity))
+        self.start = 0
+        self.count = 0
+        self.dirty = False
+        # Decayed rate counters (see velocity.VelocityTracker), if tracked
+        self.velocity = None
+        # Sum of pairwise similarities over the `summed` oldest entries
+        # (see similarity_cache.PairSums), if tracked
+        self.pair_sum = 0.0
+        self.summed = 0
+        # Last score the engine computed and when (epoch seconds), for scheduling
+        self.score = None
+        self.scored_at = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def capacity(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def last_epoch(self) -> float:
+        """Timestamp of the newest entry (the window is not empty)."""
+        return self.timestamps[(self.start + self.count - 1) % len(self.timestamps)]
+
+    def columns(self) -> tuple:
+        """(timestamps, prompt_ids) as contiguous arrays, oldest first."""
+        end = self.start + self.count
+        capacity = len(self.timestamps)
+        if end <= capacity:
+            return self.timestamps[self.start:end], self.prompt_ids[self.start:end]
+        end -= capacity
+        return (
+            self.timestamps[self.start:] + self.timestamps[:end],
+            self.prompt_ids[self.start:] + self.prompt_ids[:end],
+        )
+
+    def _grow(self, capacity: int) -> None:
+        timestamps, prompt_ids = self.columns()
+        padding = capacity - self.count
+        self.timestamps = timestamps + array("d", bytes(8 * padding))
+        self.prompt_ids = prompt_ids + array("i", bytes(4 * padding))
+        self.start = 0
+
+
+class WindowStore:
+    """
+    All tracked users' windows plus the shared prompt table.
+
+    `windows` maps userId -> UserWindow; a user is dropped as soon as their
+    window is empty. With a velocity_tracker, every appended entry also
+    updates the window's decayed rate counters. With pair_sums, every
+    dropped entry is first taken out of the window's pair sum. With
+    cluster_index, entries are added to and removed from it as well.
+    """
+
+    def __init__(self, max_entries_per_user: int = WINDOW_MAX_ENTRIES_PER_USER, velocity_tracker=None,
+                 pair_sums=None, cluster_index=None):
+        self.max_entries_per_user = max_entries_per_user
+        self.velocity_tracker = velocity_tracker
+        self.pair_sums = pair_sums
+        self.cluster_index = cluster_index
+        self._window_bytes = _WINDOW_OVERHEAD_BYTES
+        if velocity_tracker is not None:
+            self._window_bytes += sys.getsizeof(velocity_tracker.new_counters())
+        self.windows = {}
+        self.prompts = PromptTable(prompt_key if pair_sums is not None else None)
+        self.entry_count = 0
+        self._slot_count = 0
+        # Restored windows not loaded yet (checkpoint.PendingWindows), if any
+        self.pending = None
+
+    def __len__(self) -> int:
+        return len(self.windows)
+
+    def append(self, user_id: str, epoch: float, prompt: str) -> UserWindow:
+        """Add one entry (callers append in timestamp order) and mark the window dirty."""
+        window = self.windows.get(user_id)
+        if window is None and self.pending is not None and self.pending.load(user_id):
+            window = self.windows.get(user_id)
+        if window is None:
+            window = self.windows[user_id] = UserWindow(
+                user_id, min(WINDOW_INITIAL_CAPACITY, self.max_entries_per_user)
+            )
+            self._slot_count += window.capacity
+            if self.velocity_tracker is not None:
+                window.velocity = self.velocity_tracker.new_counters()
+
+        capacity = window.capacity
+        if window.count == capacity:
+            if capacity < self.max_entries_per_user:
+                new_capacity = min(capacity * 2, self.max_entries_per_user)
+                window._grow(new_capacity)
+                self._slot_count += new_capacity - capacity
+                capacity = new_capacity
+            else:
+                # At the cap: drop the oldest entry to make room
+                self._drop_oldest(window)
+                window.start = (window.start + 1) % capacity
+                window.count -= 1
+                self.entry_count -= 1
+
+        slot = (window.start + window.count) % capacity
+        prompt_id = self.prompts.intern(prompt)
+        window.timestamps[slot] = epoch
+        window.prompt_ids[slot] = prompt_id
+        if self.cluster_index is not None:
+            self.cluster_index.add(user_id, prompt_id, prompt)
+        window.count += 1
+        window.dirty = True
+        self.entry_count += 1
+        if window.velocity is not None:
+            self.velocity_tracker.record(window.velocity, epoch)
+        return window
+
+    def load_window(self, user_id: str, timestamps, prompts, velocity=None, pair_sum: float = 0.0,
+                    summed: int = 0, dirty: bool = False, sketches=None) -> UserWindow:
+        """
+        Add a whole window restored from a checkpoint (see checkpoint.py).
+
+        Args:
+            timestamps: Epoch seconds, oldest first (at most max_entries_per_user)
+            prompts: The entries' prompts
+            velocity: Saved rate counters, or None to recount them from timestamps
+            sketches: The prompts' MinHash sketches for the cluster index, if saved
+        """
+        count = len(timestamps)
+        capacity = min(WINDOW_INITIAL_CAPACITY, self.max_entries_per_user)
+        while capacity < count:
+            capacity = min(capacity * 2, self.max_entries_per_user)
+        window = self.windows[user_id] = UserWindow(user_id, capacity)
+        self._slot_count += capacity
+        window.timestamps[:count] = array("d", timestamps)
+        for slot, prompt in enumerate(prompts):
+            prompt_id = window.prompt_ids[slot] = self.prompts.intern(prompt)
+            if self.cluster_index is not None:
+                self.cluster_index.add(user_id, prompt_id, prompt, None if sketches is None else sketches[slot])
+        window.count = count
+        window.dirty = dirty
+        self.entry_count += count
+        if self.velocity_tracker is not None:
+            window.velocity = self.velocity_tracker.new_counters()
+            if velocity is not None:
+                window.velocity[:] = array("d", velocity)
+            else:
+                for epoch in window.timestamps[:count]:
+                    self.velocity_tracker.record(window.velocity, epoch)
+        if self.pair_sums is not None:
+            window.pair_sum = pair_sum
+            window.summed = summed
+        return window
+
+    def expire(self, cutoff: float, user_ids=None) -> int:
+        """
+        Drop entries older than cutoff (epoch seconds); forget emptied users.
+
+        Returns:
+            int: Number of entries dropped
+        """
+        dropped = 0
+        for user_id in list(self.windows if user_ids is None else user_ids):
+            window = self.windows.get(user_id)
+            if window is None:
+                continue
+            capacity = window.capacity
+            while window.count and window.timestamps[window.start] < cutoff:
+                self._drop_oldest(window)
+                window.start = (window.start + 1) % capacity
+                window.count -= 1
+                window.dirty = True
+                dropped += 1
+            if not window.count:
+                self._slot_count -= capacity
+                del self.windows[user_id]
+                if self.cluster_index is not None:
+                    self.cluster_index.forget_user(user_id)
+        self.entry_count -= dropped
+        return dropped
+
+    def _drop_oldest(self, window: UserWindow) -> None:
+        """Release the oldest entry's prompt; the caller advances the ring."""
+        if self.pair_sums is not None:
+            self.pair_sums.evict_oldest(self, window)
+        prompt_id = window.prompt_ids[window.start]
+        if self.cluster_index is not None:
+            self.cluster_index.remove(window.user_id, prompt_id)
+        self.prompts.release(prompt_id)
+
+    def entries(self, window: UserWindow) -> list:
+        """The window as [(epoch_seconds, prompt), ...], the form score_windows takes."""
+        get_prompt = self.prompts.get
+        timestamps, prompt_ids = window.columns()
+        return [(epoch, get_prompt(prompt_id)) for epoch, prompt_id in zip(timestamps, prompt_ids)]
+
+    def memory_report(self) -> dict:
+        """Estimated bytes held by the store, for sizing detector pods."""
+        users = len(self.windows)
+        window_bytes = users * self._window_bytes + self._slot_count * _ENTRY_BYTES
+        total = window_bytes + self.prompts.bytes
+        return {
+            "users": users,
+            "entries": self.entry_count,
+            "interned_prompts": len(self.prompts),
+            "window_bytes": window_bytes,
+            "prompt_bytes": self.prompts.bytes,
+            "total_bytes": total,
+            "bytes_per_user": total / users if users else 0.0,
+            "max_entries_per_user": self.max_entries_per_user,
+        }
@@ -0,0 +1,97 @@
+"""
+Benchmark for detector warm-restart checkpoints.
+
+Builds an engine over one analysis window of synthetic traffic, saves it with
+checkpoint.capture/write and measures:
+    file size      bytes per window entry
+    ready          Checkpointer.restore (what runs before the detector is ready)
+    load           loading every pending window, chunk by chunk, afterwards
+    touch          loading one user's window ahead of the rest (new logs for them)
+
+Exits non-zero when ready time or file size exceed --max-ready-seconds or
+--max-bytes-per-entry, so CI can catch a restore that grows back into the
+startup path.
+
+Usage (from services/detector-py):
+    python benchmarks/bench_checkpoint.py --users 2000 20000 --queries 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from traffic import generate_logs  # noqa: E402
+
+WINDOW_MINUTES = 5
+
+
+def bench(users: int, queries: int, backend: str, seed: int) -> dict:
+    from app import checkpoint
+    from app.engine import ScoringEngine
+
+    logs = generate_logs(users, queries, 0, WINDOW_MINUTES, seed=seed)
+    grouped = {}
+    for log in logs:
+        grouped.setdefault(log["userId"], []).append(log)
+    engine = ScoringEngine(window_minutes=WINDOW_MINUTES, similarity_backend=backend)
+    # Not scored: restore cost does not depend on the scores
+    engine.bootstrap(grouped.items())
+
+    with tempfile.TemporaryDirectory() as directory:
+        checkpointer = checkpoint.Checkpointer(os.path.join(directory, "detector.ckpt"))
+        checkpointer.save(checkpointer.capture(engine))
+        size = checkpointer.last_saved["bytes"]
+
+        restored = ScoringEngine(window_minutes=WINDOW_MINUTES, similarity_backend=backend)
+        started = time.perf_counter()
+        checkpointer.restore(restored)
+        ready = time.perf_counter() - started
+
+        started = time.perf_counter()
+        restored.window_store.pending.load(next(iter(grouped)))
+        touch = time.perf_counter() - started
+
+        started = time.perf_counter()
+        while checkpointer.load_pending(restored):
+            pass
+        load = time.perf_counter() - started
+
+    entries = engine.window_store.entry_count
+    return {"users": users, "queries": queries, "entries": entries, "bytes": size,
+            "bytes_per_entry": size / entries, "ready_seconds": ready, "touch_seconds": touch,
+            "load_seconds": load}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[2000, 20000])
+    parser.add_argument("--queries", type=int, default=20, help="Queries per user per analysis window")
+    parser.add_argument("--backend", choices=["exact", "minhash"], default="exact")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-ready-seconds", type=float, default=0.25)
+    parser.add_argument("--max-bytes-per-entry", type=float, default=64)
+    args = parser.parse_args()
+
+    print(f"{'users':>7}{'entries':>9}{'MB':>8}{'B/entry':>9}{'ready ms':>10}{'touch ms':>10}{'load ms':>10}")
+    failures = []
+    for users in args.users:
+        row = bench(users, args.queries, args.backend, args.seed)
+        print(f"{row['users']:>7}{row['entries']:>9}{row['bytes'] / 1e6:>8.2f}{row['bytes_per_entry']:>9.1f}"
+              f"{row['ready_seconds'] * 1000:>10.1f}{row['touch_seconds'] * 1000:>10.2f}"
+              f"{row['load_seconds'] * 1000:>10.1f}")
+        if row["ready_seconds"] > args.max_ready_seconds:
+            failures.append(f"{users} users: ready in {row['ready_seconds']:.3f}s > {args.max_ready_seconds}s")
+        if row["bytes_per_entry"] > args.max_bytes_per_entry:
+            failures.append(f"{users} users: {row['bytes_per_entry']:.1f} bytes/entry > {args.max_bytes_per_entry}")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
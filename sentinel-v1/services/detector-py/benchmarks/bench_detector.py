@@ -0,0 +1,253 @@
+"""
+Benchmark harness for detector scoring and full analysis cycles.
+
+Runs a grid of users x queries-per-window x prompt-length and measures:
+    scoring      engine.score_windows on in-memory windows (no Mongo)
+    cycle_cold   first /run_analysis cycle: bootstrap aggregation + scoring + write-back
+    cycle_warm   next cycle after 10% new logs arrive (the incremental path)
+
+Cycles run against mongomock by default, or a real mongod with --mongo-uri.
+Each point reports throughput (users/s), p50/p99 latency over --repeat runs
+and peak traced memory. Results are saved as JSON; --compare diffs two runs.
+
+Usage (from services/detector-py):
+    python benchmarks/bench_detector.py --users 100 1000 --queries 5 60 --out before.json
+    python benchmarks/bench_detector.py --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from traffic import generate_logs, users_for_logs  # noqa: E402
+
+WINDOW_MINUTES = 5
+WARM_FRACTION = 0.1
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def traced_peak(fn) -> int:
+    """Peak bytes allocated by fn(). Run separately: tracing slows Python code several-fold."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def summarize(kind, point, users, latencies, peak):
+    p50 = percentile(latencies, 50)
+    return {
+        "kind": kind,
+        **point,
+        "runs": len(latencies),
+        "p50_seconds": p50,
+        "p99_seconds": percentile(latencies, 99),
+        "users_per_second": users / p50 if p50 > 0 else None,
+        "peak_memory_bytes": peak,
+    }
+
+
+def windows_from_logs(logs):
+    from app.engine import to_epoch_seconds
+
+    windows = {}
+    for log in logs:
+        windows.setdefault(log["userId"], []).append((to_epoch_seconds(log["timestamp"]), log["prompt"]))
+    return list(windows.items())
+
+
+def bench_scoring(point, logs, backend, repeat):
+    from app.engine import score_windows
+
+    windows = windows_from_logs(logs)
+    run_once = lambda: score_windows(windows, WINDOW_MINUTES, backend)  # noqa: E731
+    latencies = [timed(run_once) for _ in range(repeat)]
+    return summarize("scoring", point, len(windows), latencies, traced_peak(run_once))
+
+
+def load_detector(mongo_uri):
+    """Import app.main and point it at mongomock or a benchmark database."""
+    os.environ.setdefault("MONGODB_URI", mongo_uri or "mongodb://localhost:27017")
+    # Per-cycle INFO lines would interleave with the results table
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import app.main as detector
+
+    if mongo_uri:
+        from pymongo import MongoClient
+        database = MongoClient(mongo_uri)["sentinel_benchmark"]
+    else:
+        import mongomock
+        database = mongomock.MongoClient()["sentinel_benchmark"]
+
+    detector.users_collection = database["users"]
+    detector.query_logs_collection = database["query_logs"]
+    detector.threat_outbox.collection = database["threat_outbox"]
+    return detector, database
+
+
+def bench_cycles(detector, database, point, seed, backend, repeat):
+    """
+    Time a cold (bootstrap) and a warm (incremental) cycle per repeat.
+
+    Logs are regenerated relative to the current time before every repeat so
+    that none have aged out of the analysis window by the time the cycle runs.
+    One extra repeat at the end is traced for peak memory and not timed.
+    """
+    from app import store
+    from app.engine import ScoringEngine
+
+    cold, warm = [], []
+    cold_peak = warm_peak = 0
+    user_count = point["users"]
+
+    for attempt in range(repeat + 1):
+        traced = attempt == repeat
+        logs = generate_logs(point["users"], point["queries_per_window"], point["prompt_length"],
+                             WINDOW_MINUTES, seed=seed, now=datetime.now(timezone.utc) - timedelta(seconds=1))
+        split = int(len(logs) * (1 - WARM_FRACTION))
+
+        for name in ("users", "query_logs", "threat_outbox"):
+            database[name].delete_many({})
+        database["users"].insert_many(users_for_logs(logs))
+        database["query_logs"].insert_many([dict(log) for log in logs[:split]])
+        store.ensure_indexes(database["users"], database["query_logs"])
+        detector.scoring_engine = ScoringEngine(
+            window_minutes=WINDOW_MINUTES, similarity_backend=backend, executor=detector.scoring_executor
+        )
+
+        if traced:
+            cold_peak = traced_peak(detector.run_analysis_cycle)
+        else:
+            cold.append(timed(detector.run_analysis_cycle))
+
+        database["query_logs"].insert_many([dict(log) for log in logs[split:]])
+        if traced:
+            warm_peak = traced_peak(detector.run_analysis_cycle)
+        else:
+            warm.append(timed(detector.run_analysis_cycle))
+
+    window_store = detector.scoring_engine.memory_report()
+    rows = [
+        summarize("cycle_cold", point, user_count, cold, cold_peak),
+        summarize("cycle_warm", point, user_count, warm, warm_peak),
+    ]
+    for row in rows:
+        row["window_store_bytes_per_user"] = window_store["bytes_per_user"]
+    return rows
+
+
+def run(args):
+    results = []
+    detector = database = None
+    if args.mode in ("cycle", "both"):
+        detector, database = load_detector(args.mongo_uri)
+
+    for users in args.users:
+        for queries in args.queries:
+            for prompt_length in args.prompt_length:
+                point = {"users": users, "queries_per_window": queries,
+                         "prompt_length": prompt_length, "backend": args.backend}
+                rows = []
+                if args.mode in ("scoring", "both"):
+                    logs = generate_logs(users, queries, prompt_length, WINDOW_MINUTES, seed=args.seed)
+                    rows.append(bench_scoring(point, logs, args.backend, args.repeat))
+                if args.mode in ("cycle", "both"):
+                    rows.extend(bench_cycles(detector, database, point, args.seed, args.backend, args.repeat))
+                for row in rows:
+                    print_row(row)
+                results.extend(rows)
+
+    if detector is not None:
+        detector.scoring_executor.shutdown()
+    return results
+
+
+def print_row(row):
+    rate = row["users_per_second"]
+    print(f"{row['kind']:<11}{row['users']:>7}{row['queries_per_window']:>6}{row['prompt_length']:>6}"
+          f"{row['p50_seconds'] * 1000:>11.1f}{row['p99_seconds'] * 1000:>11.1f}"
+          f"{(rate or 0):>12.0f}{row['peak_memory_bytes'] / 1e6:>10.1f}")
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    def key(row):
+        return (row["kind"], row["users"], row["queries_per_window"], row["prompt_length"], row["backend"])
+
+    baseline = {key(row): row for row in before["results"]}
+    print(f"{'kind':<11}{'users':>7}{'q/w':>6}{'len':>6}{'p50 before':>12}{'p50 after':>11}{'change':>9}"
+          f"{'mem before':>12}{'mem after':>11}")
+    for row in after["results"]:
+        old = baseline.get(key(row))
+        if old is None:
+            continue
+        change = (row["p50_seconds"] - old["p50_seconds"]) / old["p50_seconds"] * 100
+        print(f"{row['kind']:<11}{row['users']:>7}{row['queries_per_window']:>6}{row['prompt_length']:>6}"
+              f"{old['p50_seconds'] * 1000:>10.1f}ms{row['p50_seconds'] * 1000:>9.1f}ms{change:>+8.1f}%"
+              f"{old['peak_memory_bytes'] / 1e6:>10.1f}MB{row['peak_memory_bytes'] / 1e6:>9.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--queries", type=int, nargs="+", default=[5, 20, 60],
+                        help="Queries per user per analysis window")
+    parser.add_argument("--prompt-length", type=int, nargs="+", default=[0],
+                        help="Pad prompts to about this many characters (0 = natural length)")
+    parser.add_argument("--mode", choices=["scoring", "cycle", "both"], default="both")
+    parser.add_argument("--backend", choices=["exact", "minhash"], default="exact")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mongo-uri", help="Benchmark cycles against this mongod instead of mongomock")
+    parser.add_argument("--out", help="Write results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    print(f"{'kind':<11}{'users':>7}{'q/w':>6}{'len':>6}{'p50 ms':>11}{'p99 ms':>11}{'users/s':>12}{'peak MB':>10}")
+    results = run(args)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+                "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+                "results": results,
+            }, f, indent=2)
+        print(f"Results written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Scaling benchmark for sharded detector instances.
+
+Simulates N detector instances (one process each) sharing DETECTOR_SHARDS
+shards, as the ShardCoordinator would hand them out, and times one bootstrap
++ scoring pass per instance over the same window of logs. Every instance
+reads the whole window and keeps only its own users, like a real instance
+filtering the query_logs it fetches, so the filtering overhead is counted.
+
+Reports the slowest instance's time (the cycle's wall time), aggregate
+throughput and speedup over a single instance. Scaling is bounded by the
+CPU cores available; run on a machine with at least as many cores as the
+largest instance count.
+
+Usage (from services/detector-py):
+    python benchmarks/bench_shards.py --users 5000 --queries 20 --instances 1 2 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+WINDOW_MINUTES = 5
+
+
+def assign_shards(num_shards: int, instances: int) -> list:
+    """Contiguous blocks of ceil(num_shards / instances) shards, as the coordinator's fair share."""
+    per_instance = -(-num_shards // instances)
+    return [set(range(i * per_instance, min(num_shards, (i + 1) * per_instance))) for i in range(instances)]
+
+
+def run_instance(args, owned, barrier, results):
+    from traffic import generate_logs
+    from app.engine import ScoringEngine
+    from app.sharding import shard_of
+
+    logs = generate_logs(args.users, args.queries, 0, WINDOW_MINUTES, seed=args.seed)
+    grouped = {}
+    for log in logs:
+        grouped.setdefault(log["userId"], []).append(log)
+
+    barrier.wait()
+    started = time.perf_counter()
+    engine = ScoringEngine(window_minutes=WINDOW_MINUTES, similarity_backend=args.backend,
+                           user_filter=lambda user_id: shard_of(user_id, args.shards) in owned)
+    engine.bootstrap(grouped.items())
+    scores = engine.rescore()
+    results.put((time.perf_counter() - started, len(scores)))
+
+
+def bench(args, instances: int) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(instances)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=run_instance, args=(args, owned, barrier, results))
+        for owned in assign_shards(args.shards, instances)
+    ]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    wall = max(elapsed for elapsed, _ in outcomes)
+    users = sum(scored for _, scored in outcomes)
+    return {"instances": instances, "wall_seconds": wall, "users": users,
+            "users_per_second": users / wall if wall > 0 else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=20, help="Queries per user per analysis window")
+    parser.add_argument("--instances", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--shards", type=int, default=16, help="DETECTOR_SHARDS")
+    parser.add_argument("--backend", choices=["exact", "minhash"], default="exact")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.users} users x {args.queries} queries, {args.shards} shards")
+    print(f"{'instances':>9}{'wall ms':>10}{'users/s':>10}{'speedup':>9}")
+    baseline = None
+    for instances in args.instances:
+        row = bench(args, instances)
+        baseline = baseline or row["wall_seconds"]
+        print(f"{row['instances']:>9}{row['wall_seconds'] * 1000:>10.1f}{row['users_per_second']:>10.0f}"
+              f"{baseline / row['wall_seconds']:>8.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
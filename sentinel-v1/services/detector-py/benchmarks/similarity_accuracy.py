@@ -0,0 +1,133 @@
+"""
+Accuracy report: MinHash similarity backend vs the exact difflib path.
+
+Scores synthetic prompt windows with both backends and compares the average
+similarity, D-score, final suspicion score and resulting tier (0.8 / 0.95).
+Also checks that the exact backend's early-exit evaluator
+(bounded_average_similarity) returns the same D-score as comparing every pair.
+
+Usage (from services/detector-py):
+    python benchmarks/similarity_accuracy.py
+    python benchmarks/similarity_accuracy.py --sizes 5 20 60 200 600 --json report.json
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from app.scoring import (  # noqa: E402
+    bounded_average_similarity,
+    build_prompt_sketch,
+    calculate_text_similarity,
+    calculate_velocity_score,
+    combine_scores,
+    estimate_average_similarity,
+    get_tier,
+    similarity_score_from_average,
+)
+from traffic import PROFILES  # noqa: E402
+
+WINDOW_MINUTES = 5
+
+def exact_average(prompts):
+    total = 0.0
+    pairs = 0
+    for i in range(len(prompts)):
+        for j in range(i + 1, len(prompts)):
+            total += calculate_text_similarity(prompts[i], prompts[j])
+            pairs += 1
+    return total / pairs
+
+
+def minhash_average(prompts):
+    return estimate_average_similarity([build_prompt_sketch(prompt) for prompt in prompts])
+
+
+def timed(fn, prompts):
+    started = time.perf_counter()
+    value = fn(prompts)
+    return value, time.perf_counter() - started
+
+
+def run_report(sizes, seeds):
+    rows = []
+    for profile, generate in PROFILES.items():
+        for size in sizes:
+            for seed in range(seeds):
+                prompts = generate(size, random.Random(seed))
+                v_score = calculate_velocity_score(len(prompts), WINDOW_MINUTES)
+                row = {"profile": profile, "prompts": size, "seed": seed}
+                for backend, average in (("exact", exact_average), ("minhash", minhash_average),
+                                         ("bounded", bounded_average_similarity)):
+                    avg_similarity, elapsed = timed(average, prompts)
+                    d_score = similarity_score_from_average(avg_similarity)
+                    final = combine_scores(v_score, d_score)
+                    row.update({
+                        f"{backend}_avg_similarity": avg_similarity,
+                        f"{backend}_d_score": d_score,
+                        f"{backend}_score": final,
+                        f"{backend}_tier": get_tier(final),
+                        f"{backend}_seconds": elapsed,
+                    })
+                rows.append(row)
+    return rows
+
+
+def summarize(rows):
+    mismatches = [row for row in rows if row["exact_tier"] != row["minhash_tier"]]
+    return {
+        "windows": len(rows),
+        "tier_mismatches": len(mismatches),
+        "bounded_d_mismatches": sum(r["exact_d_score"] != r["bounded_d_score"] for r in rows),
+        "max_abs_similarity_error": max(abs(r["exact_avg_similarity"] - r["minhash_avg_similarity"]) for r in rows),
+        "max_abs_score_error": max(abs(r["exact_score"] - r["minhash_score"]) for r in rows),
+        "exact_seconds": sum(r["exact_seconds"] for r in rows),
+        "minhash_seconds": sum(r["minhash_seconds"] for r in rows),
+        "bounded_seconds": sum(r["bounded_seconds"] for r in rows),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 20, 60, 200])
+    parser.add_argument("--seeds", type=int, default=3)
+    parser.add_argument("--json", dest="json_path", help="Write rows and summary to this file")
+    args = parser.parse_args()
+
+    rows = run_report(args.sizes, args.seeds)
+    summary = summarize(rows)
+
+    print(f"{'profile':<15}{'n':>5}{'seed':>5}{'exact_avg':>11}{'mh_avg':>9}"
+          f"{'exact_D':>9}{'mh_D':>7}{'exact':>8}{'mh':>7}{'tiers':>8}")
+    for r in rows:
+        tiers = f"{r['exact_tier']}/{r['minhash_tier']}"
+        flag = "" if r["exact_tier"] == r["minhash_tier"] else "  <-- tier mismatch"
+        print(f"{r['profile']:<15}{r['prompts']:>5}{r['seed']:>5}"
+              f"{r['exact_avg_similarity']:>11.3f}{r['minhash_avg_similarity']:>9.3f}"
+              f"{r['exact_d_score']:>9.3f}{r['minhash_d_score']:>7.3f}"
+              f"{r['exact_score']:>8.3f}{r['minhash_score']:>7.3f}{tiers:>8}{flag}")
+
+    print()
+    print(f"Windows compared:        {summary['windows']}")
+    print(f"Tier mismatches:         {summary['tier_mismatches']}")
+    print(f"Max |similarity error|:  {summary['max_abs_similarity_error']:.3f}")
+    print(f"Max |score error|:       {summary['max_abs_score_error']:.3f}")
+    print(f"Exact similarity time:   {summary['exact_seconds']:.3f}s")
+    print(f"MinHash similarity time: {summary['minhash_seconds']:.3f}s")
+    print(f"Bounded similarity time: {summary['bounded_seconds']:.3f}s "
+          f"({summary['bounded_d_mismatches']} D-score mismatches vs exact)")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"summary": summary, "rows": rows}, f, indent=2)
+
+    return 1 if summary["tier_mismatches"] or summary["bounded_d_mismatches"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+import pytest
+from pymongo.errors import OperationFailure
+
+from app import change_feed
+from app.change_feed import STATE_DOCUMENT_ID, QueryLogChangeFeed
+
+NOW = datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def insert(token, user_id, seconds):
+    return {"_id": token, "operationType": "insert",
+            "fullDocument": {"_id": token, "userId": user_id, "prompt": "hi", "timestamp": NOW + timedelta(seconds=seconds)}}
+
+
+class ScriptedStream:
+    """A change stream replaying scripted changes; closes after them when `invalidated`."""
+
+    def __init__(self, changes, invalidate_token=None):
+        self.changes = list(changes)
+        self.invalidate_token = invalidate_token
+        self.resume_token = None
+        self.alive = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.alive = False
+
+    def try_next(self):
+        if self.changes:
+            change = self.changes.pop(0)
+            self.resume_token = change["_id"]
+            return change
+        if self.invalidate_token is not None and self.alive:
+            # The invalidate event closes the cursor; its token is the one to start after
+            self.resume_token = self.invalidate_token
+            self.alive = False
+            return None
+        time.sleep(0.001)
+        return None
+
+
+class ScriptedCollection:
+    """watch() hands out the scripted streams (or raises the scripted errors) in order."""
+
+    def __init__(self, *streams):
+        self.streams = list(streams)
+        self.watch_calls = []
+
+    def watch(self, pipeline, **kwargs):
+        self.watch_calls.append(kwargs)
+        stream = self.streams.pop(0) if self.streams else ScriptedStream([])
+        if isinstance(stream, Exception):
+            raise stream
+        return stream
+
+
+def run_feed(collection, state, expected_logs):
+    batches = []
+    done = threading.Event()
+
+    def handle_logs(logs):
+        batches.append([log["_id"] for log in logs])
+        if sum(map(len, batches)) >= expected_logs:
+            done.set()
+
+    feed = QueryLogChangeFeed(collection, state, handle_logs, batch_size=10, max_await_ms=1)
+    feed.start()
+    try:
+        assert done.wait(5)
+    finally:
+        feed.stop()
+    return feed, batches
+
+
+@pytest.fixture
+def state():
+    return mongomock.MongoClient().db.detector_state
+
+
+def test_batches_resume_after_the_stored_token(state):
+    state.insert_one({"_id": STATE_DOCUMENT_ID, "resume_token": "t0"})
+    collection = ScriptedCollection(ScriptedStream([insert("t2", "u1", 5), insert("t1", "u2", 1)]))
+    feed, batches = run_feed(collection, state, 2)
+
+    assert collection.watch_calls[0]["start_after"] == "t0"
+    # Sorted by timestamp before the engine sees them
+    assert batches == [["t1", "t2"]]
+    assert state.find_one({"_id": STATE_DOCUMENT_ID})["resume_token"] == "t1"
+
+
+def test_invalidated_stream_is_reopened_after_the_invalidate(state):
+    collection = ScriptedCollection(
+        ScriptedStream([insert("t1", "u1", 1)], invalidate_token="invalidate"),
+        ScriptedStream([insert("t2", "u1", 2)]),
+    )
+    feed, batches = run_feed(collection, state, 2)
+
+    assert batches == [["t1"], ["t2"]]
+    assert [call["start_after"] for call in collection.watch_calls[:2]] == [None, "invalidate"]
+    assert state.find_one({"_id": STATE_DOCUMENT_ID})["resume_token"] == "t2"
+
+
+def test_lost_resume_token_starts_fresh(state, monkeypatch):
+    monkeypatch.setattr(change_feed, "CHANGE_STREAM_RETRY_SECONDS", 0.01)
+    state.insert_one({"_id": STATE_DOCUMENT_ID, "resume_token": "gone"})
+    collection = ScriptedCollection(
+        OperationFailure("resume point may no longer be in the oplog", code=286),
+        ScriptedStream([insert("t1", "u1", 1)]),
+    )
+    feed, batches = run_feed(collection, state, 1)
+
+    assert [call["start_after"] for call in collection.watch_calls[:2]] == ["gone", None]
+    assert batches == [["t1"]]
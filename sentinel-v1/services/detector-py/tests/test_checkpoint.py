@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import checkpoint
+from app.engine import ScoringEngine
+
+
+def make_engine():
+    return ScoringEngine(similarity_backend="exact", cluster_detection=False)
+
+
+def logs_for(now, users, per_user, start=0):
+    return [
+        {"_id": f"{u}-{i}", "userId": f"user-{u}", "prompt": f"question {i} from user {u}",
+         "timestamp": now - timedelta(seconds=per_user - i)}
+        for u in range(users) for i in range(start, start + per_user)
+    ]
+
+
+@pytest.fixture
+def saved(tmp_path):
+    now = datetime.now(timezone.utc)
+    engine = make_engine()
+    engine.bootstrap([(log["userId"], [log]) for log in logs_for(now, users=50, per_user=10)])
+    engine.rescore(now)
+    path = tmp_path / "detector.ckpt"
+    checkpoint.write(path, *checkpoint.capture(engine))
+    return engine, path, now
+
+
+def window_of(engine, user_id):
+    return [(epoch, prompt) for epoch, prompt in engine.window_store.entries(engine.windows[user_id])]
+
+
+def test_restore_leaves_the_windows_pending(saved):
+    engine, path, now = saved
+    restored = make_engine()
+    assert checkpoint.restore(restored, path, now=now) is not None
+
+    pending = restored.window_store.pending
+    assert len(pending) == 50 and not restored.windows
+    assert restored.high_water_mark == engine.high_water_mark
+
+    assert pending.load_some(20) == 20 and len(restored.windows) == 20
+    assert pending.load_some(100) == 30
+    assert restored.window_store.pending is None
+    assert restored.window_store.entry_count == engine.window_store.entry_count
+    for user_id in engine.windows:
+        assert window_of(restored, user_id) == window_of(engine, user_id)
+        assert not restored.windows[user_id].dirty
+    assert not restored.rescore(now)
+
+
+def test_new_logs_load_the_users_restored_window_first(saved):
+    engine, path, now = saved
+    restored = make_engine()
+    checkpoint.restore(restored, path, now=now)
+
+    new_logs = [log for log in logs_for(now + timedelta(seconds=5), users=1, per_user=3, start=100)]
+    assert restored.ingest(new_logs) == 3
+    assert list(restored.windows) == ["user-0"]
+    assert len(restored.window_store.pending) == 49
+    assert [prompt for _, prompt in window_of(restored, "user-0")] == \
+        [prompt for _, prompt in window_of(engine, "user-0")] + [log["prompt"] for log in new_logs]
+
+
+def test_checkpointer_loads_pending_windows_in_chunks(saved):
+    engine, path, now = saved
+    checkpointer = checkpoint.Checkpointer(str(path))
+    restored = make_engine()
+    assert checkpointer.restore(restored, now=now)["users"] == 50
+
+    steps = 1
+    while checkpointer.load_pending(restored, count=15):
+        steps += 1
+    assert steps == 4
+    assert checkpointer.last_restored["loaded_users"] == 50
+    assert checkpointer.last_restored["entries"] == 500
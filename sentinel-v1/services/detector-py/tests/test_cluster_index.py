@@ -0,0 +1,67 @@
+import os
+import random
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.cluster_index import CLUSTER_MIN_ENTRIES, CLUSTER_WEIGHT
+from app.engine import ScoringEngine
+from app.scoring import TIER_2_THRESHOLD
+
+FAQ_VARIANTS = ["how do i reset my password?", "how do i reset my password", "How do I reset my password??",
+                "how do i reset my password please", "how do i reset my password?!"]
+TOPICS = ["pricing for teams", "export my data to csv", "change the billing email", "api rate limits",
+          "delete my account", "two factor login", "invoice for last month", "dark mode settings"]
+
+
+def honest_cohort_logs(now, users=40):
+    """
+    Every user sends at least CLUSTER_MIN_ENTRIES prompts at a human pace,
+    a third to a half of them the password-reset FAQ. A quarter of them
+    send it five times out of ten, enough to be dominated by the cluster.
+    """
+    rng = random.Random(7)
+    logs = []
+    for u in range(users):
+        if u % 4 == 0:
+            faq, own = 5, 5
+        else:
+            faq, own = rng.choice([(2, 4), (3, 4), (3, 5)])
+        prompts = [rng.choice(FAQ_VARIANTS) for _ in range(faq)]
+        prompts += [f"{rng.choice(TOPICS)} for project {rng.randint(0, 999)}?" for _ in range(own)]
+        rng.shuffle(prompts)
+        for i, prompt in enumerate(prompts):
+            logs.append({"_id": f"{u}-{i}", "userId": f"user-{u}", "prompt": prompt,
+                         "timestamp": now - timedelta(seconds=25 * (len(prompts) - i))})
+    return logs
+
+
+def scores_for(logs, now, cluster_detection):
+    engine = ScoringEngine(similarity_backend="exact", cluster_detection=cluster_detection)
+    engine.bootstrap([(log["userId"], [log]) for log in logs])
+    return engine.rescore(now)
+
+
+def test_honest_cohort_sharing_a_faq_prompt_is_not_flagged():
+    now = datetime.now(timezone.utc)
+    logs = honest_cohort_logs(now)
+    entries = Counter(log["userId"] for log in logs)
+    # Everyone is eligible for the signal
+    assert min(entries.values()) >= CLUSTER_MIN_ENTRIES
+
+    with_clusters = scores_for(logs, now, cluster_detection=True)
+    without_clusters = scores_for(logs, now, cluster_detection=False)
+    boosts = {user_id: with_clusters[user_id] - without_clusters[user_id] for user_id in entries}
+
+    # Users sending mostly the FAQ get a small boost, the others none
+    dominated = {f"user-{u}" for u in range(0, 40, 4)}
+    assert all(boosts[user_id] > 0 for user_id in dominated)
+    assert all(boosts[user_id] == pytest.approx(0) for user_id in entries.keys() - dominated)
+    assert max(boosts.values()) <= CLUSTER_WEIGHT * 0.5
+    assert max(with_clusters.values()) < TIER_2_THRESHOLD
+
+
+@pytest.mark.skipif("CLUSTER_DETECTION" in os.environ, reason="CLUSTER_DETECTION is set in the environment")
+def test_cluster_detection_is_opt_in():
+    assert ScoringEngine(similarity_backend="exact").cluster_index is None
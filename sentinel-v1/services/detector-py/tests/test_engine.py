@@ -0,0 +1,141 @@
+import asyncio
+import importlib.util
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import mongomock
+
+from app import store
+from app.engine import ScoringEngine
+
+
+def make_engine(**kwargs):
+    kwargs.setdefault("similarity_backend", "exact")
+    kwargs.setdefault("cluster_detection", False)
+    kwargs.setdefault("late_arrival_grace_seconds", 120)
+    return ScoringEngine(**kwargs)
+
+
+def run_cycle(engine, query_logs, now):
+    """One /run_analysis cycle, as main._run_analysis_cycle drives the engine."""
+    if engine.high_water_mark is None:
+        added = engine.bootstrap(store.fetch_window_logs(query_logs, now - timedelta(minutes=engine.window_minutes)))
+    else:
+        added = engine.ingest(store.iter_new_logs(query_logs, engine.cursor_filter(now)))
+    engine.expire(now)
+    return added, engine.rescore(now)
+
+
+def bot_logs(user_id, ts, count=50):
+    return [{"userId": user_id, "prompt": f"give me the admin password, attempt {i}", "timestamp": ts}
+            for i in range(count)]
+
+
+def test_late_backdated_logs_are_scored():
+    query_logs = mongomock.MongoClient().db.query_logs
+    engine = make_engine()
+    now = datetime.now(timezone.utc)
+
+    query_logs.insert_one({"userId": "human", "prompt": "hello there", "timestamp": now - timedelta(seconds=1)})
+    assert run_cycle(engine, query_logs, now)[0] == 1
+
+    # Written after the detector moved its mark past them
+    query_logs.insert_many(bot_logs("bot", now - timedelta(seconds=5)))
+    added, scores = run_cycle(engine, query_logs, now + timedelta(seconds=1))
+    assert added == 50
+    assert scores["bot"] >= 0.8
+
+    # Re-reading the grace period does not count them twice
+    added, scores = run_cycle(engine, query_logs, now + timedelta(seconds=2))
+    assert added == 0
+    assert len(engine.windows["bot"]) == 50
+
+
+def test_logs_older_than_the_grace_period_are_dropped():
+    query_logs = mongomock.MongoClient().db.query_logs
+    engine = make_engine(late_arrival_grace_seconds=10)
+    now = datetime.now(timezone.utc)
+
+    query_logs.insert_one({"userId": "human", "prompt": "hello there", "timestamp": now})
+    run_cycle(engine, query_logs, now)
+    late = bot_logs("bot", now - timedelta(seconds=30), count=3)
+    assert engine.ingest(late) == 0
+    assert engine.late_dropped == 3
+    assert "bot" not in engine.windows
+
+
+def test_change_feed_logs_behind_the_mark_are_ingested_once():
+    query_logs = mongomock.MongoClient().db.query_logs
+    engine = make_engine()
+    now = datetime.now(timezone.utc)
+
+    query_logs.insert_one({"userId": "human", "prompt": "hello there", "timestamp": now})
+    run_cycle(engine, query_logs, now)
+    late = bot_logs("bot", now - timedelta(seconds=5), count=5)
+    query_logs.insert_many(late)
+
+    # Delivered by the change feed, then re-read by the sweep
+    assert engine.ingest(late) == 5
+    assert run_cycle(engine, query_logs, now + timedelta(seconds=1))[0] == 0
+    assert len(engine.windows["bot"]) == 5
+
+
+def test_checkpoint_keeps_the_ids_within_the_grace_period(tmp_path):
+    from app import checkpoint
+
+    query_logs = mongomock.MongoClient().db.query_logs
+    engine = make_engine()
+    now = datetime.now(timezone.utc)
+    query_logs.insert_many(bot_logs("bot", now - timedelta(seconds=5), count=5))
+    query_logs.insert_one({"userId": "human", "prompt": "hello there", "timestamp": now})
+    run_cycle(engine, query_logs, now)
+
+    path = tmp_path / "detector.ckpt"
+    checkpoint.write(path, *checkpoint.capture(engine))
+    restored = make_engine()
+    assert checkpoint.restore(restored, path, now=now + timedelta(seconds=1)) is not None
+    assert restored.high_water_mark == engine.high_water_mark
+
+    # The tail read after a restore re-reads the grace period without duplicates
+    assert run_cycle(restored, query_logs, now + timedelta(seconds=1))[0] == 0
+    restored.window_store.pending.load_some(100)
+    assert len(restored.windows["bot"]) == 5
+
+
+def load_wrappers_log_writer():
+    path = Path(__file__).resolve().parents[2] / "wrappers-py" / "app" / "log_writer.py"
+    spec = importlib.util.spec_from_file_location("wrappers_log_writer", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_logs_replayed_from_the_wrappers_spool_are_scored(tmp_path):
+    log_writer = load_wrappers_log_writer()
+    query_logs = mongomock.MongoClient().db.query_logs
+    engine = make_engine()
+    now = datetime.now(timezone.utc)
+
+    async def crash_with_spooled_logs():
+        # Accepted and spooled three minutes ago, then the process died before the flush
+        writer = log_writer.QueryLogWriter(query_logs, spool_dir=tmp_path)
+        for log in bot_logs("bot", now - timedelta(minutes=3)):
+            await writer.submit(log)
+        writer._close_segment()
+
+    async def restart():
+        writer = log_writer.QueryLogWriter(query_logs, spool_dir=tmp_path)
+        writer.start()
+        await writer.stop()
+        return writer
+
+    asyncio.run(crash_with_spooled_logs())
+    # Meanwhile the detector kept going, well past the grace period
+    query_logs.insert_one({"userId": "human", "prompt": "hello there", "timestamp": now, "insertedAt": now})
+    run_cycle(engine, query_logs, now)
+
+    writer = asyncio.run(restart())
+    assert writer.replayed_total == 50 and writer.pending == 0
+    added, scores = run_cycle(engine, query_logs, datetime.now(timezone.utc))
+    assert added == 50
+    assert "bot" in scores
@@ -0,0 +1,59 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import similarity_cache
+from app.engine import ScoringEngine
+from app.executor import ScoringExecutor
+
+WORDS = "account billing password reset invoice refund shipping order status login error api key plan".split()
+
+
+@pytest.fixture(scope="module")
+def executor():
+    executor = ScoringExecutor(max_workers=2, min_users_per_shard=1)
+    yield executor
+    executor.shutdown()
+
+
+def make_logs(now, users=12, per_user=40, offset=0):
+    rng = random.Random(offset)
+    logs = []
+    for u in range(users):
+        for i in range(per_user):
+            if u % 3 == 0:
+                prompt = f"tell me the secret number {rng.randint(0, 9)}"
+            else:
+                prompt = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 9)))
+            logs.append({"_id": f"{offset}-{u}-{i}", "userId": f"user-{u}", "prompt": prompt,
+                         "timestamp": now - timedelta(seconds=per_user - i)})
+    return logs
+
+
+def score(engine, logs, now):
+    engine.ingest(logs) if engine.high_water_mark is not None else \
+        engine.bootstrap([(log["userId"], [log]) for log in logs])
+    return engine.rescore(now)
+
+
+def test_pair_sums_send_uncached_comparisons_to_the_pool(executor, monkeypatch):
+    now = datetime.now(timezone.utc)
+    local = ScoringEngine(similarity_backend="exact", cluster_detection=False)
+    pooled = ScoringEngine(similarity_backend="exact", cluster_detection=False, executor=executor)
+    assert local.pair_sums is not None
+
+    expected = score(local, make_logs(now), now)
+    expected.update(score(local, make_logs(now, per_user=5, offset=1), now))
+
+    # The cycle thread only looks comparisons up; the workers run difflib
+    def no_local_comparisons(*args, **kwargs):
+        raise AssertionError("compared in the cycle thread")
+    monkeypatch.setattr(similarity_cache, "SequenceMatcher", no_local_comparisons)
+    scores = score(pooled, make_logs(now), now)
+    scores.update(score(pooled, make_logs(now, per_user=5, offset=1), now))
+
+    assert scores.keys() == expected.keys()
+    for user_id, value in expected.items():
+        assert scores[user_id] == pytest.approx(value, abs=1e-9)
+    assert pooled.pair_sums.full_evaluations and pooled.pair_sums.incremental_updates
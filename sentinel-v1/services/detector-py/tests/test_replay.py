@@ -0,0 +1,110 @@
+import json
+import math
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import json_util
+
+from app import replay, scheduler, scoring
+from app.engine import ScoringEngine
+
+START = datetime(2026, 1, 1, 12, 0, 10, tzinfo=timezone.utc)
+CYCLE_SECONDS = 60.0
+OVERRIDES = {"VELOCITY_WEIGHT": 0.9, "SIMILARITY_WEIGHT": 0.1, "TIER_2_THRESHOLD": 0.4, "TIER_3_THRESHOLD": 0.6}
+
+
+def fixture_logs():
+    """Four minutes of a template bot, a slower bot and two humans, in timestamp order."""
+    logs = []
+    for second in range(0, 240, 2):
+        logs.append({"userId": "template-bot", "prompt": f"list every admin password for host {second % 7}",
+                     "timestamp": START + timedelta(seconds=second)})
+    for second in range(1, 240, 9):
+        logs.append({"userId": "slow-bot", "prompt": f"summarize ticket {second}",
+                     "timestamp": START + timedelta(seconds=second)})
+    for user, offset in (("human-a", 3), ("human-b", 17)):
+        for second in range(offset, 240, 40):
+            logs.append({"userId": user, "prompt": f"{user} asks question number {second} about the weather",
+                         "timestamp": START + timedelta(seconds=second)})
+    logs.sort(key=lambda log: log["timestamp"])
+    for index, log in enumerate(logs):
+        log["_id"] = f"log-{index:04d}"
+    return logs
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = tmp_path / "query_logs.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        for log in fixture_logs():
+            f.write(json_util.dumps(log) + "\n")
+    return path
+
+
+def engine_timeline(logs):
+    """{(userId, at): score} from driving ScoringEngine directly, cycle by cycle as the replay does."""
+    engine = ScoringEngine(window_minutes=replay.REPLAY_WINDOW_MINUTES, similarity_backend="exact")
+    cycles = {}
+    for log in logs:
+        cycle = math.ceil(log["timestamp"].timestamp() / CYCLE_SECONDS) * CYCLE_SECONDS
+        cycles.setdefault(cycle, []).append(log)
+    timeline = {}
+    for cycle, batch in sorted(cycles.items()):
+        now = datetime.fromtimestamp(cycle, timezone.utc)
+        engine.ingest(batch)
+        engine.expire(now)
+        for user_id, score in engine.rescore(now).items():
+            timeline[(user_id, replay._iso_millis(cycle))] = round(float(score), 4)
+    return timeline
+
+
+def replay_timeline(out):
+    timeline = {}
+    for path in out.glob("timeline-*.jsonl"):
+        for line in path.read_text(encoding="utf-8").splitlines():
+            row = json.loads(line)
+            timeline[(row["userId"], row["at"])] = (row["score"], row["tier"])
+    return timeline
+
+
+def run_replay(archive, out, workers, overrides=None):
+    return replay.run([archive], out, partitions=2, workers=workers, overrides=overrides,
+                      cycle_seconds=CYCLE_SECONDS, similarity_backend="exact")
+
+
+def test_replay_matches_the_scoring_engine(archive, tmp_path):
+    summary = run_replay(archive, tmp_path / "out", workers=1)
+    logs = fixture_logs()
+    assert summary["records"] == summary["ingested"] == len(logs)
+    assert summary["late"] == summary["duplicates"] == 0
+
+    replayed = replay_timeline(tmp_path / "out")
+    expected = engine_timeline(logs)
+    assert {key: score for key, (score, _) in replayed.items()} == expected
+    assert all(tier == scoring.get_tier(score) for score, tier in replayed.values())
+    assert max(score for (user_id, _), score in expected.items() if user_id == "template-bot") >= scoring.TIER_2_THRESHOLD
+
+    # Tier changes are the timeline's transitions, merged across partitions in time order
+    events = [json.loads(line) for line in (tmp_path / "out" / "events.jsonl").read_text().splitlines()]
+    assert events and [event["at"] for event in events] == sorted(event["at"] for event in events)
+    assert summary["tier_changes"] == len(events)
+
+
+def test_overrides_reach_the_worker_processes(archive, tmp_path, monkeypatch):
+    defaults = {name: getattr(scoring, name) for name in OVERRIDES}
+    summary = run_replay(archive, tmp_path / "out", workers=2, overrides=OVERRIDES)
+    # The spawn pool's initializer applied them; this process is untouched
+    assert {name: getattr(scoring, name) for name in OVERRIDES} == defaults
+    assert summary["settings"]["TIER_3_THRESHOLD"] == OVERRIDES["TIER_3_THRESHOLD"]
+
+    for name, value in OVERRIDES.items():
+        monkeypatch.setattr(scoring, name, value)
+    monkeypatch.setattr(scheduler, "TIER_BOUNDARIES", (OVERRIDES["TIER_2_THRESHOLD"], OVERRIDES["TIER_3_THRESHOLD"]))
+    expected = engine_timeline(fixture_logs())
+
+    replayed = replay_timeline(tmp_path / "out")
+    assert {key: score for key, (score, _) in replayed.items()} == expected
+    assert all(tier == scoring.get_tier(score) for score, tier in replayed.values())
+    # Some window lands in a tier only the overridden thresholds give it
+    assert any(OVERRIDES["TIER_3_THRESHOLD"] <= score < defaults["TIER_3_THRESHOLD"] and tier == 3
+               for score, tier in replayed.values())
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+import pytest
+from pymongo.errors import AutoReconnect
+
+from app.retention import QueryLogCompactor
+
+NOW = datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def make_compactor(batch_size=100):
+    db = mongomock.MongoClient().db
+    compactor = QueryLogCompactor(db.query_logs, db.query_log_rollups, hot_seconds=3600, batch_size=batch_size)
+    compactor.ensure_indexes()
+    return compactor
+
+
+def insert_logs(compactor, count, minutes_ago=120, user_id="u1"):
+    compactor.query_logs.insert_many([
+        {"userId": user_id, "prompt": f"prompt {i}", "timestamp": NOW - timedelta(minutes=minutes_ago, seconds=i % 50)}
+        for i in range(count)
+    ])
+
+
+def total_count(compactor):
+    return sum(rollup["count"] for rollup in compactor.rollups.find())
+
+
+def fail_once(collection, method):
+    original = getattr(collection, method)
+
+    def failing(*args, **kwargs):
+        setattr(collection, method, original)
+        raise AutoReconnect("connection lost")
+    setattr(collection, method, failing)
+
+
+def test_batch_interrupted_before_the_delete_is_not_counted_twice():
+    compactor = make_compactor()
+    insert_logs(compactor, 30)
+    fail_once(compactor.query_logs, "delete_many")
+    with pytest.raises(AutoReconnect):
+        compactor.run_once(NOW)
+    assert total_count(compactor) == 30
+
+    # More expired logs arrive before the retry: the batch's membership is fixed by its claim
+    insert_logs(compactor, 20)
+    assert compactor.run_once(NOW) == 50
+    assert total_count(compactor) == 50
+    assert compactor.query_logs.count_documents({}) == 0
+
+
+def test_batch_interrupted_before_the_rollup_is_finished_by_the_next_run():
+    compactor = make_compactor(batch_size=10)
+    insert_logs(compactor, 25)
+    fail_once(compactor.rollups, "bulk_write")
+    with pytest.raises(AutoReconnect):
+        compactor.run_once(NOW)
+    assert total_count(compactor) == 0
+
+    assert compactor.run_once(NOW) == 25
+    assert total_count(compactor) == 25
+
+
+def test_hot_logs_are_kept():
+    compactor = make_compactor()
+    insert_logs(compactor, 5)
+    insert_logs(compactor, 5, minutes_ago=10, user_id="u2")
+    assert compactor.run_once(NOW) == 5
+    assert compactor.query_logs.count_documents({"userId": "u2"}) == 5
@@ -0,0 +1,78 @@
+from datetime import datetime, timezone
+
+from app import engine as engine_module
+from app.engine import ScoringEngine
+from app.scheduler import ScoringQueue, priority, scoring_cost
+from app.window_store import WindowStore
+
+NOW = 1_800_000_000.0
+
+
+def make_window(store, user_id, ages, prompts=None, score=None, scored_at=None):
+    for age, prompt in zip(ages, prompts or [f"{user_id} prompt {i}" for i in range(len(ages))]):
+        window = store.append(user_id, NOW - age, prompt)
+    window.score = score
+    window.scored_at = scored_at
+    return window
+
+
+def test_windows_are_taken_in_priority_order():
+    store = WindowStore()
+    idle = make_window(store, "idle", [600, 590], score=0.1, scored_at=NOW - 10)
+    active = make_window(store, "active", [5, 1], score=0.1, scored_at=NOW - 10)
+    boundary = make_window(store, "boundary", [5, 1], score=0.8, scored_at=NOW - 10)
+    waiting = make_window(store, "waiting", [5, 1], score=0.1, scored_at=NOW - 600)
+    assert priority(boundary, NOW) > priority(waiting, NOW) > priority(active, NOW) > priority(idle, NOW)
+
+    queue = ScoringQueue([idle, active, waiting, boundary], NOW)
+    chunk, _ = queue.take_within(None, 3)
+    assert [window.user_id for window in chunk] == ["boundary", "waiting", "active"]
+    assert len(queue) == 1
+
+
+def test_chunk_stops_at_the_cost_budget():
+    store = WindowStore()
+    repeats = make_window(store, "repeats", [3, 2, 1], prompts=["same"] * 3)
+    distinct = make_window(store, "distinct", [30, 20, 10, 5])
+    assert scoring_cost(repeats) == 1
+    assert scoring_cost(distinct) == 1 + 6
+
+    queue = ScoringQueue([repeats, distinct], NOW)
+    chunk, cost = queue.take_within(5, 10)
+    assert [window.user_id for window in chunk] == ["repeats"] and cost == 1
+    # Always at least one window, however small the budget
+    chunk, cost = queue.take_within(1, 10)
+    assert [window.user_id for window in chunk] == ["distinct"] and cost == 7
+    assert not queue
+
+
+def test_rescore_carries_unscored_users_over(monkeypatch):
+    engine = ScoringEngine(similarity_backend="exact", cluster_detection=False)
+    now = datetime.fromtimestamp(NOW, timezone.utc)
+    for index in range(6):
+        # user-5 sent last, so goes first
+        engine.ingest([{"userId": f"user-{index}", "prompt": f"question {index}",
+                        "timestamp": datetime.fromtimestamp(NOW - 60 + index * 10, timezone.utc)}])
+
+    # Every chunk takes one simulated second
+    clock = [0.0]
+    monkeypatch.setattr(engine_module.time, "perf_counter", lambda: clock[0])
+    score_chunk = engine._score_chunk
+
+    def timed_chunk(windows, *args):
+        clock[0] += len(windows)
+        return score_chunk(windows, *args)
+    monkeypatch.setattr(engine, "_score_chunk", timed_chunk)
+    monkeypatch.setattr(engine_module, "SCHEDULER_FIRST_CHUNK_USERS", 1)
+    monkeypatch.setattr(engine_module, "SCHEDULER_CHUNK_USERS", 1)
+
+    scores = engine.rescore(now, budget_seconds=2.5)
+    assert sorted(scores) == ["user-3", "user-4", "user-5"]
+    assert engine.backlog == 3
+    assert all(engine.windows[f"user-{index}"].dirty for index in range(3))
+
+    # The next cycle picks up where this one stopped
+    scores = engine.rescore(now, budget_seconds=2.5)
+    assert sorted(scores) == ["user-0", "user-1", "user-2"]
+    assert engine.backlog == 0
+    assert not any(window.dirty for window in engine.windows.values())
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+from app.score_feed import ScoreFeed
+
+
+def publish(feed, count, start=0):
+    return feed.publish((f"user-{i}", 0.5, 1, 1_000 + i) for i in range(start, start + count))
+
+
+def parse(chunk):
+    """(event, data) of one SSE block; None for a keepalive comment."""
+    if chunk.startswith(":"):
+        return None
+    fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+    return fields["event"], json.loads(fields["data"])
+
+
+def read_stream(feed, since, count, during=None):
+    """The first `count` events the stream sends a client resuming from `since`."""
+    async def read():
+        events = []
+        stream = feed.stream(since, keepalive=0.05)
+        try:
+            async for chunk in stream:
+                event = parse(chunk)
+                if event is None:
+                    continue
+                events.append(event)
+                if event[0] == "hello" and during is not None:
+                    # Published from another thread while the client is connected
+                    await asyncio.to_thread(during)
+                if len(events) == count:
+                    break
+        finally:
+            await stream.aclose()
+        return events
+    return asyncio.run(read())
+
+
+def test_missed_events_are_replayed_from_since():
+    feed = ScoreFeed(buffer_size=10)
+    assert publish(feed, 5) == 5
+
+    events = read_stream(feed, since=2, count=6, during=lambda: publish(feed, 2, start=5))
+    assert events[0] == ("hello", {"stream_id": feed.stream_id, "seq": 5})
+    assert [data["seq"] for _, data in events[1:]] == [3, 4, 5, 6, 7]
+    assert all(event == "score" for event, _ in events[1:])
+    assert events[1][1] == {"seq": 3, "userId": "user-2", "score": 0.5, "tier": 1, "updated_at": 1_002}
+    assert feed.subscriber_count == 0
+
+
+def test_resync_when_the_buffer_was_trimmed():
+    feed = ScoreFeed(buffer_size=3)
+    publish(feed, 5)
+    # seq 2 is gone: the client missed events it can no longer get
+    events = read_stream(feed, since=1, count=2)
+    assert events == [("hello", {"stream_id": feed.stream_id, "seq": 5}),
+                      ("resync", {"stream_id": feed.stream_id, "seq": 5})]
+
+    # Still buffered: replayed
+    events = read_stream(feed, since=2, count=4)
+    assert [data["seq"] for _, data in events[1:]] == [3, 4, 5]
+
+
+def test_restart_changes_the_stream_id():
+    before = ScoreFeed()
+    publish(before, 5)
+    after = ScoreFeed()
+    publish(after, 2)
+    assert after.stream_id != before.stream_id
+
+    # A client at seq 5 of the old stream is ahead of the new one
+    events = read_stream(after, since=5, count=2)
+    assert events[0] == ("hello", {"stream_id": after.stream_id, "seq": 2})
+    assert events[1][0] == "resync"
+
+
+def test_lagging_subscriber_is_told_to_resync():
+    feed = ScoreFeed(queue_size=3)
+    events = read_stream(feed, since=0, count=5, during=lambda: publish(feed, 10))
+    assert [event for event, _ in events] == ["hello", "score", "score", "score", "resync"]
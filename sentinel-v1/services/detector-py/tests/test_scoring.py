@@ -0,0 +1,82 @@
+import random
+import string
+
+import pytest
+
+from app import scoring
+
+WORDS = ("password reset account login admin server weather python capital database "
+         "help please how what is the my for a of to").split()
+
+
+@pytest.fixture
+def full_average(monkeypatch):
+    """The exact backend's plain average over every pair."""
+    monkeypatch.setattr(scoring, "SIMILARITY_EARLY_EXIT", False)
+    return lambda prompts: scoring.average_prompt_similarity(prompts, backend="exact")
+
+
+def word_window(rng, size, template_share):
+    """Short word-salad prompts, template_share of them one template with a varying number."""
+    template = " ".join(rng.choice(WORDS) for _ in range(8))
+    return [
+        f"{template} {rng.randint(0, 99)}" if rng.random() < template_share
+        else " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 10)))
+        for _ in range(size)
+    ]
+
+
+def random_window(rng, size):
+    """Unrelated random strings of one length: far below the band, but not settled by length."""
+    return ["".join(rng.choice(string.ascii_letters + string.digits) for _ in range(40)) for _ in range(size)]
+
+
+def test_windows_inside_the_band_get_the_exact_average(full_average):
+    rng = random.Random(3)
+    compared = 0
+    for _ in range(40):
+        prompts = word_window(rng, rng.randint(2, 30), rng.choice([0.0, 0.2, 0.4]))
+        expected = full_average(prompts)
+        stats = {}
+        value = scoring.bounded_average_similarity(prompts, delta=0.0, stats=stats)
+        if scoring.SIMILARITY_THRESHOLD_NORMAL < expected < scoring.SIMILARITY_THRESHOLD_BOT:
+            assert stats["exit"] == "complete"
+        if stats["exit"] == "complete":
+            assert value == expected
+            compared += 1
+        else:
+            assert scoring.similarity_score_from_average(value) == scoring.similarity_score_from_average(expected)
+    assert compared >= 10
+
+
+def test_exits_with_delta_zero_are_certain(full_average):
+    prompts = ["reset my password now"] * 20 + ["what is the capital of india"] * 2
+    stats = {}
+    value = scoring.bounded_average_similarity(prompts, delta=0.0, stats=stats)
+    assert stats["exit"] == "duplicates" and stats["evaluated"] == 0
+    assert value <= full_average(prompts) and value >= scoring.SIMILARITY_THRESHOLD_BOT
+
+
+def test_sampled_exits_stay_on_the_right_side_of_the_band(full_average):
+    rng = random.Random(7)
+    low, high = scoring.SIMILARITY_THRESHOLD_NORMAL, scoring.SIMILARITY_THRESHOLD_BOT
+    sampled = {"low": 0, "high": 0}
+    for _ in range(30):
+        if rng.random() < 0.5:
+            prompts = random_window(rng, 48)
+        else:
+            prompts = word_window(rng, 48, rng.choice([0.8, 0.95]))
+        expected = full_average(prompts)
+        stats = {}
+        # A loose delta so the sampled exit fires early and often
+        value = scoring.bounded_average_similarity(prompts, delta=0.05, stats=stats)
+        assert scoring.similarity_score_from_average(value) == scoring.similarity_score_from_average(expected)
+        if stats["exit"] == "sampled":
+            assert stats["evaluated"] < stats["pairs"]
+            if value <= low:
+                assert expected <= low
+                sampled["low"] += 1
+            else:
+                assert value >= high and expected >= high
+                sampled["high"] += 1
+    assert sampled["low"] >= 5 and sampled["high"] >= 5
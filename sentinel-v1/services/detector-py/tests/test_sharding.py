@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+
+import mongomock
+
+from app.sharding import ShardCoordinator, jump_hash, shard_of
+
+USERS = [f"user-{i}" for i in range(5000)]
+
+
+def test_assignment_is_stable_and_moves_little_when_growing():
+    before = [shard_of(user, 8) for user in USERS]
+    assert before == [shard_of(user, 8) for user in USERS]
+    assert set(before) == set(range(8))
+    assert all(shard_of(user, 1) == 0 for user in USERS[:10])
+
+    after = [shard_of(user, 9) for user in USERS]
+    moved = [new for old, new in zip(before, after) if old != new]
+    # Only users of the new shard move, about 1/9 of them
+    assert set(moved) == {8}
+    assert 0.08 < len(moved) / len(USERS) < 0.15
+    assert jump_hash(12345, 1) == 0
+
+
+def coordinators(count, num_shards=4):
+    collection = mongomock.MongoClient().db.detector_shards
+    result = [ShardCoordinator(collection, num_shards=num_shards, instance_id=f"detector-{i}", lease_seconds=30)
+              for i in range(count)]
+    result[0].ensure_shards()
+    return collection, result
+
+
+def owners(collection):
+    return {doc["_id"]: doc["owner"] for doc in collection.find({"kind": "shard"})}
+
+
+def test_shards_are_handed_off_to_a_new_instance():
+    collection, (a, b) = coordinators(2)
+    assert a.heartbeat() == {0, 1, 2, 3}
+    generation = a.generation
+
+    # b joins: everything is leased, so it waits for a to make room
+    assert b.heartbeat() == frozenset()
+    assert a.heartbeat() == {0, 1}
+    assert a.generation == generation + 1
+    assert b.heartbeat() == {2, 3}
+    assert owners(collection) == {0: "detector-0", 1: "detector-0", 2: "detector-1", 3: "detector-1"}
+
+    # Steady state: renewing changes nothing
+    assert a.heartbeat() == {0, 1} and b.heartbeat() == {2, 3}
+    assert a.owns(next(user for user in USERS if shard_of(user, 4) == 0))
+    assert not a.owns(next(user for user in USERS if shard_of(user, 4) == 3))
+
+
+def test_expired_leases_fail_over():
+    collection, (a, b) = coordinators(2)
+    a.heartbeat(), b.heartbeat(), a.heartbeat(), b.heartbeat()
+
+    # a stops renewing: its shard and instance leases run out
+    past = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    collection.update_many({"owner": "detector-0"}, {"$set": {"lease_expires_at": past}})
+    collection.update_one({"_id": "instance:detector-0"}, {"$set": {"lease_expires_at": past}})
+    assert b.heartbeat() == {0, 1, 2, 3}
+    assert set(owners(collection).values()) == {"detector-1"}
+
+
+def test_stop_releases_the_shards():
+    collection, (a, b) = coordinators(2)
+    a.start()
+    assert a.owned == {0, 1, 2, 3}
+    a.stop()
+    assert a.owned == frozenset()
+    assert set(owners(collection).values()) == {None}
+    assert collection.count_documents({"kind": "instance"}) == 0
+    assert b.heartbeat() == {0, 1, 2, 3}
@@ -0,0 +1,23 @@
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+
+from app import store
+
+
+def test_fetch_window_logs_groups_by_user_in_timestamp_order():
+    query_logs = mongomock.MongoClient().db.query_logs
+    now = datetime.now(timezone.utc)
+    query_logs.insert_many([
+        {"userId": user_id, "prompt": f"{user_id} {i}", "timestamp": now - timedelta(seconds=seconds),
+         "original_answer": "x" * 1000}
+        for i, (user_id, seconds) in enumerate([("b", 5), ("a", 1), ("b", 3), ("a", 4), ("b", 600)])
+    ])
+
+    grouped = [(user_id, list(entries)) for user_id, entries in
+               store.fetch_window_logs(query_logs, now - timedelta(minutes=5))]
+
+    assert [user_id for user_id, _ in grouped] == ["a", "b"]
+    assert [entry["prompt"] for entry in grouped[0][1]] == ["a 3", "a 1"]
+    assert [entry["prompt"] for entry in grouped[1][1]] == ["b 0", "b 2"]
+    assert all("original_answer" not in entry and "_id" in entry for _, entries in grouped for entry in entries)
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+
+from app.threat_queue import SidecarThreatSink, SubprocessThreatSink, ThreatOutbox
+
+
+def make_outbox(sink):
+    outbox = ThreatOutbox(mongomock.MongoClient().db.threat_outbox, sink, batch_size=10)
+    for i in range(10):
+        outbox.enqueue(f"user-{i}", score=0.97)
+    return outbox
+
+
+def test_claimed_batch_is_not_reclaimed_before_the_sink_times_out():
+    sink = SubprocessThreatSink("/nonexistent", command="true")
+    outbox = make_outbox(sink)
+    now = datetime.now(timezone.utc)
+    assert len(outbox._claim_batch(now)) == 10
+
+    # A second instance polling at the sink's own deadline finds nothing to take
+    deadline = now + timedelta(seconds=sink.max_seconds(10))
+    assert sink.max_seconds(10) == 130
+    assert outbox._claim_batch(deadline) == []
+
+    # A batch whose worker died is picked up once the lease runs out
+    expired = now + timedelta(seconds=outbox.lease_seconds() + 1)
+    assert len(outbox._claim_batch(expired)) == 10
+
+
+def test_lease_covers_the_sidecar_fallback():
+    sink = SidecarThreatSink("127.0.0.1:1", fallback=SubprocessThreatSink("/nonexistent", command="true"))
+    outbox = make_outbox(sink)
+    now = datetime.now(timezone.utc)
+    assert len(outbox._claim_batch(now)) == 10
+
+    assert outbox.lease_seconds() > sink.max_seconds(10) > sink.fallback.max_seconds(10)
+    assert outbox._claim_batch(now + timedelta(seconds=sink.max_seconds(10))) == []
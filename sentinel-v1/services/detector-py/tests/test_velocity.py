@@ -0,0 +1,67 @@
+import math
+
+import pytest
+
+from app.velocity import VelocityTracker, parse_velocity_windows
+
+T0 = 1_800_000_000.0
+
+
+def test_single_query_decays_exponentially():
+    tracker = VelocityTracker([(10.0, 18.0, 60.0), (60.0, 8.0, 25.0)])
+    counters = tracker.new_counters()
+    tracker.record(counters, T0)
+    assert tracker.rates_qpm(counters, T0) == pytest.approx([6.0, 1.0])
+    # One time constant later each counter is down to 1/e
+    assert tracker.rates_qpm(counters, T0 + 10) == pytest.approx([6.0 / math.e, math.exp(-10 / 60)])
+    assert tracker.rates_qpm(counters, T0 + 60) == pytest.approx([6.0 * math.exp(-6), 1.0 / math.e])
+
+
+def test_steady_rate_converges_to_its_qpm():
+    tracker = VelocityTracker([(10.0, 18.0, 60.0), (60.0, 8.0, 25.0)])
+    counters = tracker.new_counters()
+    for second in range(0, 600, 2):
+        tracker.record(counters, T0 + second)
+    now = T0 + 598
+    # c converges to 1 / (1 - exp(-interval / tau)), slightly above the true 30 QPM
+    expected = [60.0 / tau / (1 - math.exp(-2.0 / tau)) for tau in (10.0, 60.0)]
+    assert tracker.rates_qpm(counters, now) == pytest.approx(expected, rel=1e-4)
+    assert all(30 < qpm < 36 for qpm in tracker.rates_qpm(counters, now))
+
+
+def test_out_of_order_queries_count_as_in_order():
+    tracker = VelocityTracker()
+    ordered, shuffled = tracker.new_counters(), tracker.new_counters()
+    times = [T0 + offset for offset in (0, 1.5, 3, 7, 8, 20)]
+    for epoch in times:
+        tracker.record(ordered, epoch)
+    for epoch in (times[1], times[0], times[3], times[2], times[5], times[4]):
+        tracker.record(shuffled, epoch)
+    assert list(shuffled) == pytest.approx(list(ordered))
+
+
+def test_burst_scores_while_it_lasts():
+    tracker = VelocityTracker([(10.0, 18.0, 60.0), (60.0, 8.0, 25.0)])
+    counters = tracker.new_counters()
+    for i in range(30):
+        tracker.record(counters, T0 + i * 0.3)
+    burst_end = T0 + 29 * 0.3
+    # ~30 queries in 9 seconds: far past the 10s window's bot rate
+    assert tracker.score(counters, burst_end) == 1.0
+    assert 0.0 < tracker.score(counters, burst_end + 60) < 1.0
+    assert tracker.score(counters, burst_end + 600) == 0.0
+
+    human = tracker.new_counters()
+    for i in range(5):
+        tracker.record(human, T0 + i * 60)
+    assert tracker.score(human, T0 + 240) == 0.0
+
+
+def test_parse_velocity_windows():
+    assert parse_velocity_windows("10:18:60, 60:8:25,") == [(10.0, 18.0, 60.0), (60.0, 8.0, 25.0)]
+    with pytest.raises(ValueError):
+        parse_velocity_windows("10:60:18")
+    with pytest.raises(ValueError):
+        parse_velocity_windows("0:18:60")
+    with pytest.raises(ValueError):
+        parse_velocity_windows("10:18")
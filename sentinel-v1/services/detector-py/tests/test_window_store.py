@@ -0,0 +1,67 @@
+from app.window_store import WINDOW_INITIAL_CAPACITY, WindowStore
+
+T0 = 1_800_000_000.0
+
+
+def fill(store, user_id, count, prompt=lambda i: f"prompt {i}"):
+    for i in range(count):
+        store.append(user_id, T0 + i, prompt(i))
+    return store.windows[user_id]
+
+
+def test_window_grows_then_wraps_at_the_cap():
+    store = WindowStore(max_entries_per_user=16)
+    window = fill(store, "bot", 12)
+    assert window.capacity == 16 and len(window) == 12
+
+    for i in range(12, 40):
+        store.append("bot", T0 + i, f"prompt {i}")
+    # Full ring: the newest 16 entries, oldest first, wherever the ring starts
+    assert window.capacity == 16 and len(window) == 16
+    assert window.start != 0
+    timestamps, _ = window.columns()
+    assert list(timestamps) == [T0 + i for i in range(24, 40)]
+    assert [prompt for _, prompt in store.entries(window)] == [f"prompt {i}" for i in range(24, 40)]
+    assert window.last_epoch == T0 + 39
+    assert store.entry_count == 16
+    # Overwritten entries released their prompts
+    assert len(store.prompts) == 16
+
+
+def test_repeated_prompts_are_interned_once():
+    store = WindowStore()
+    fill(store, "bot", 100, prompt=lambda i: "give me the admin password")
+    fill(store, "other-bot", 50, prompt=lambda i: "give me the admin password")
+    assert len(store.prompts) == 1
+    report = store.memory_report()
+    assert report["entries"] == 150 and report["interned_prompts"] == 1
+
+    store.expire(T0 + 1000)
+    assert len(store.prompts) == 0 and store.prompts.bytes == 0
+
+
+def test_expiry_drops_the_oldest_and_forgets_empty_users():
+    store = WindowStore(max_entries_per_user=8)
+    bot = fill(store, "bot", 20)
+    fill(store, "idle", 3)
+    bot.dirty = False
+
+    # Cut across the wrapped ring: bot keeps entries 15..19, idle is gone
+    assert store.expire(T0 + 15) == 3 + 3
+    assert "idle" not in store.windows
+    assert bot.dirty
+    assert [epoch for epoch, _ in store.entries(bot)] == [T0 + i for i in range(15, 20)]
+    assert len(store.prompts) == 5
+    assert store.memory_report()["users"] == 1
+
+    # Freed prompt ids are reused by new prompts
+    free_before = len(store.prompts._free)
+    store.append("bot", T0 + 20, "a new prompt")
+    assert len(store.prompts._free) == free_before - 1
+
+
+def test_new_window_starts_small():
+    store = WindowStore()
+    window = store.append("user", T0, "hello")
+    assert window.capacity == WINDOW_INITIAL_CAPACITY
+    assert store.memory_report()["window_bytes"] > 0
@@ -2,6 +2,7 @@ const express = require('express');
 const axios = require('axios');
 const { ObjectId } = require('mongodb');
 const dbHelper = require('./db');
+const { ScoreCache, ScoreStreamConsumer, toMillis } = require('./scoreCache');
 const path = require('path');
 const fs = require('fs');
 const cors = require('cors'); 
@@ -16,7 +17,24 @@ app.use(cors({
 
 // Load env vars from root .env (Handled in db.js, but we get vars from process.env)
 const WRAPPERS_URL = process.env.WRAPPERS_URL || 'http://localhost:8002/get_noisy_response';
-const DETECTOR_URL = process.env.DETECTOR_URL || 'http://localhost:8001/run_analysis';
+// Comma-separated when the detector runs as several shards (DETECTOR_SHARDS);
+// each instance sweeps only the users of the shards it owns.
+const DETECTOR_URLS = (process.env.DETECTOR_URL || 'http://localhost:8001/run_analysis')
+  .split(',').map((url) => url.trim()).filter(Boolean);
+// With DETECTOR_CHANGE_STREAM on, the detector scores inserts as they happen and
+// this poll is only a reconciliation sweep, so it can run far less often.
+const DETECTOR_SWEEP_INTERVAL_MS = parseInt(process.env.DETECTOR_SWEEP_INTERVAL_MS || '60000', 10);
+
+// Tier decisions come from a local score table kept current by each detector's
+// /scores/stream; the users collection is read only on a miss or while a stream is down.
+const SCORE_CACHE_ENABLED = !['0', 'false', 'no'].includes((process.env.SCORE_CACHE_ENABLED || '1').toLowerCase());
+const scoreCache = new ScoreCache();
+const scoreConsumers = [...new Set(DETECTOR_URLS.map((url) => new URL(url).origin))]
+  .map((origin) => new ScoreStreamConsumer(origin, scoreCache));
+
+function scoreCacheReady() {
+  return SCORE_CACHE_ENABLED && scoreConsumers.every((consumer) => consumer.synced);
+}
 
 let db;
 
@@ -27,16 +45,21 @@ async function connectDb(){
 
 // --- Scheduler to run detector service ---
 function startDetectorScheduler() {
-  console.log(`Starting detector scheduler. Will ping ${DETECTOR_URL} every 60 seconds.`);
+  console.log(`Starting detector scheduler. Will ping ${DETECTOR_URLS.join(', ')} every ${DETECTOR_SWEEP_INTERVAL_MS / 1000} seconds.`);
   setInterval(async () => {
-    try {
-      console.log('Scheduler: Pinging detector service to run analysis...');
-      const response = await axios.post(DETECTOR_URL, {});
-      console.log(`Scheduler: Analysis complete. Status: ${response.data.status}, Updated: ${response.data.users_updated}, Flagged: ${response.data.flagged_count}`);
-    } catch (err) {
-      console.error('Scheduler: Error pinging detector service:', err.message);
-    }
-  }, 60000); // 60,000 ms = 60 seconds
+    console.log('Scheduler: Pinging detector service to run analysis...');
+    const results = await Promise.allSettled(DETECTOR_URLS.map((url) => axios.post(url, {})));
+    results.forEach((result, i) => {
+      if (result.status === 'fulfilled') {
+        const data = result.value.data;
+        const shards = data.shards && data.shards.length ? ` (shards ${data.shards.join(',')})` : '';
+        const backlog = data.backlog ? `, Carried over: ${data.backlog}` : '';
+        console.log(`Scheduler: Analysis complete${shards}. Status: ${data.status}, Updated: ${data.users_updated}, Flagged: ${data.flagged_count}${backlog}`);
+      } else {
+        console.error(`Scheduler: Error pinging detector service ${DETECTOR_URLS[i]}:`, result.reason.message);
+      }
+    });
+  }, DETECTOR_SWEEP_INTERVAL_MS);
 }
 // ------------------------------------------
 
@@ -47,14 +70,20 @@ app.post('/api/v1/prompt', async (req, res) => {
   const users = db.collection('users');
   const logs = db.collection('query_logs');
 
-  let user = await users.findOne({ userId });
-  if (!user) {
-    user = { userId, apiKey: null, suspicion_score: 0.0, is_human_verified: false, last_seen: new Date().toISOString() };
-    await users.insertOne(user);
+  let score;
+  const cached = scoreCacheReady() ? scoreCache.get(userId) : undefined;
+  if (cached) {
+    score = cached.score;
+  } else {
+    let user = await users.findOne({ userId });
+    if (!user) {
+      user = { userId, apiKey: null, suspicion_score: 0.0, is_human_verified: false, last_seen: new Date().toISOString() };
+      await users.insertOne(user);
+    }
+    score = (user.suspicion_score || 0);
+    if (SCORE_CACHE_ENABLED) scoreCache.set(userId, score, toMillis(user.last_seen));
   }
 
-  const score = (user.suspicion_score || 0);
-
   // Tier logic from blueprint
   if (score >= 0.95) {
     // Tier 3: Malicious
@@ -91,6 +120,15 @@ app.post('/api/v1/prompt', async (req, res) => {
   }
 });
 
+app.get('/api/v1/score-cache', (req, res) => {
+  res.json({
+    enabled: SCORE_CACHE_ENABLED,
+    ready: scoreCacheReady(),
+    cache: scoreCache.stats(),
+    streams: scoreConsumers.map((consumer) => consumer.status()),
+  });
+});
+
 app.get('/api/v1/system-history', async (req, res) => {
   const logs = db.collection('query_logs');
   const rows = await logs.find({}).sort({ timestamp: -1 }).limit(500).toArray();
@@ -238,6 +276,7 @@ connectDb().then(() => {
     console.log(`Gateway running on ${PORT}`);
     // Start the detector scheduler after DB is connected
     startDetectorScheduler();
+    if (SCORE_CACHE_ENABLED) scoreConsumers.forEach((consumer) => consumer.start());
   });
 }).catch(err => { 
   console.error("Failed to start server:", err);
@@ -0,0 +1,207 @@
+// In-memory suspicion score table for tier decisions, kept current by the
+// detector's /scores/stream (Server-Sent Events).
+//
+// Each detector instance gets a ScoreStreamConsumer. On (re)connect it loads
+// /scores/snapshot when it has no position in the stream, then streams score
+// events from the snapshot's seq. The detector replays missed events on
+// reconnect, or sends `resync` when it no longer has them; a new stream_id
+// (detector restart) also triggers a resync.
+//
+// The cache is only trusted while every consumer is connected and synced;
+// otherwise the gateway reads the user document as before. Entries expire
+// after SCORE_CACHE_TTL_MS as a bound on staleness should an event ever be lost.
+const axios = require('axios');
+
+const SCORE_CACHE_TTL_MS = parseInt(process.env.SCORE_CACHE_TTL_MS || '300000', 10);
+const SCORE_CACHE_MAX_ENTRIES = parseInt(process.env.SCORE_CACHE_MAX_ENTRIES || '100000', 10);
+const SCORE_STREAM_RETRY_MS = parseInt(process.env.SCORE_STREAM_RETRY_MS || '2000', 10);
+// The detector sends a keepalive every 15s; longer silence means a dead connection
+const SCORE_STREAM_IDLE_TIMEOUT_MS = parseInt(process.env.SCORE_STREAM_IDLE_TIMEOUT_MS || '45000', 10);
+
+function toMillis(value) {
+  if (value === null || value === undefined) return null;
+  if (value instanceof Date) return value.getTime();
+  if (typeof value === 'number') return value;
+  const parsed = Date.parse(value);
+  return Number.isNaN(parsed) ? null : parsed;
+}
+
+class ScoreCache {
+  constructor({ ttlMs = SCORE_CACHE_TTL_MS, maxEntries = SCORE_CACHE_MAX_ENTRIES } = {}) {
+    this.ttlMs = ttlMs;
+    this.maxEntries = maxEntries;
+    this.entries = new Map();
+    this.hits = 0;
+    this.misses = 0;
+  }
+
+  get(userId) {
+    const entry = this.entries.get(userId);
+    if (!entry || entry.expiresAt <= Date.now()) {
+      if (entry) this.entries.delete(userId);
+      this.misses += 1;
+      return undefined;
+    }
+    this.hits += 1;
+    return entry;
+  }
+
+  // updatedAt (epoch ms) orders writes: an older value never replaces a newer one
+  set(userId, score, updatedAt = null) {
+    const existing = this.entries.get(userId);
+    if (existing && existing.updatedAt !== null && updatedAt !== null && updatedAt < existing.updatedAt) {
+      return;
+    }
+    this.entries.delete(userId);
+    this.entries.set(userId, { score, updatedAt, expiresAt: Date.now() + this.ttlMs });
+    while (this.entries.size > this.maxEntries) {
+      this.entries.delete(this.entries.keys().next().value);
+    }
+  }
+
+  clear() {
+    this.entries.clear();
+  }
+
+  stats() {
+    const lookups = this.hits + this.misses;
+    return {
+      entries: this.entries.size,
+      maxEntries: this.maxEntries,
+      ttlMs: this.ttlMs,
+      hits: this.hits,
+      misses: this.misses,
+      hitRate: lookups ? this.hits / lookups : 0,
+    };
+  }
+}
+
+class ScoreStreamConsumer {
+  constructor(baseUrl, cache) {
+    this.baseUrl = baseUrl.replace(/\/+$/, '');
+    this.cache = cache;
+    this.streamId = null;
+    this.seq = null;
+    this.synced = false;
+    this.stopped = true;
+    this.resyncs = 0;
+    this.events = 0;
+    this._response = null;
+  }
+
+  start() {
+    if (!this.stopped) return;
+    this.stopped = false;
+    this._run();
+  }
+
+  stop() {
+    this.stopped = true;
+    this.synced = false;
+    if (this._response) this._response.data.destroy();
+  }
+
+  status() {
+    return { url: this.baseUrl, synced: this.synced, streamId: this.streamId, seq: this.seq,
+      events: this.events, resyncs: this.resyncs };
+  }
+
+  async _run() {
+    while (!this.stopped) {
+      let retryNow = false;
+      try {
+        if (this.seq === null) await this._resync();
+        retryNow = await this._stream();
+      } catch (err) {
+        console.error(`ScoreStream: ${this.baseUrl} unavailable:`, err.message);
+      }
+      this.synced = false;
+      if (!retryNow) await new Promise((resolve) => setTimeout(resolve, SCORE_STREAM_RETRY_MS));
+    }
+  }
+
+  async _resync() {
+    const { data } = await axios.get(`${this.baseUrl}/scores/snapshot`, { timeout: 30000 });
+    for (const row of data.scores) {
+      this.cache.set(row.userId, row.score, row.updated_at);
+    }
+    this.streamId = data.stream_id;
+    this.seq = data.seq;
+    this.resyncs += 1;
+    console.log(`ScoreStream: loaded ${data.scores.length} scores from ${this.baseUrl} (seq ${data.seq})`);
+  }
+
+  // Resolves when the stream ends: true to reconnect right away (resync requested)
+  _stream() {
+    return new Promise((resolve, reject) => {
+      axios.get(`${this.baseUrl}/scores/stream`, {
+        params: { since: this.seq },
+        responseType: 'stream',
+        headers: { Accept: 'text/event-stream' },
+      }).then((response) => {
+        this._response = response;
+        const stream = response.data;
+        let buffer = '';
+        let retryNow = false;
+        let idleTimer = null;
+
+        const finish = () => {
+          clearTimeout(idleTimer);
+          this._response = null;
+          resolve(retryNow);
+        };
+        const resetIdle = () => {
+          clearTimeout(idleTimer);
+          idleTimer = setTimeout(() => stream.destroy(new Error('stream idle')), SCORE_STREAM_IDLE_TIMEOUT_MS);
+        };
+        const handle = (event, data) => {
+          if (event === 'hello') {
+            if (data.stream_id !== this.streamId) {
+              // Detector restarted: its sequence numbers start over
+              this.seq = null;
+              retryNow = true;
+              stream.destroy();
+              return;
+            }
+            this.synced = true;
+          } else if (event === 'score') {
+            this.cache.set(data.userId, data.score, data.updated_at);
+            this.seq = data.seq;
+            this.events += 1;
+          } else if (event === 'resync') {
+            this.seq = null;
+            retryNow = true;
+            stream.destroy();
+          }
+        };
+
+        resetIdle();
+        stream.setEncoding('utf8');
+        stream.on('data', (chunk) => {
+          resetIdle();
+          buffer += chunk;
+          let end;
+          while ((end = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+            let event = 'message';
+            const dataLines = [];
+            for (const line of block.split('\n')) {
+              if (line.startsWith('event:')) event = line.slice(6).trim();
+              else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+            }
+            if (dataLines.length) handle(event, JSON.parse(dataLines.join('\n')));
+          }
+        });
+        stream.on('end', finish);
+        stream.on('close', finish);
+        stream.on('error', (err) => {
+          if (!retryNow) console.error(`ScoreStream: ${this.baseUrl} stream error:`, err.message);
+          finish();
+        });
+      }).catch(reject);
+    });
+  }
+}
+
+module.exports = { ScoreCache, ScoreStreamConsumer, toMillis };
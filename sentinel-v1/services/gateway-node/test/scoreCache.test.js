@@ -0,0 +1,41 @@
+const assert = require('node:assert/strict');
+const test = require('node:test');
+
+const { ScoreCache, toMillis } = require('../src/scoreCache');
+
+test('set ignores a score older than the cached one', () => {
+  const cache = new ScoreCache({ ttlMs: 60000 });
+  cache.set('bot', 0.97, 2000);
+  cache.set('bot', 0.4, 1000);
+  assert.equal(cache.get('bot').score, 0.97);
+  assert.equal(cache.get('bot').updatedAt, 2000);
+
+  cache.set('bot', 0.85, 3000);
+  assert.equal(cache.get('bot').score, 0.85);
+});
+
+test('set without updated_at always replaces', () => {
+  const cache = new ScoreCache({ ttlMs: 60000 });
+  cache.set('user', 0.9, 2000);
+  cache.set('user', 0.1, null);
+  assert.equal(cache.get('user').score, 0.1);
+  cache.set('user', 0.5, 1000);
+  assert.equal(cache.get('user').score, 0.5);
+});
+
+test('oldest entries are evicted past maxEntries', () => {
+  const cache = new ScoreCache({ ttlMs: 60000, maxEntries: 2 });
+  cache.set('a', 0.1, 1);
+  cache.set('b', 0.2, 1);
+  cache.set('c', 0.3, 1);
+  assert.equal(cache.get('a'), undefined);
+  assert.deepEqual([...cache.entries.keys()], ['b', 'c']);
+});
+
+test('toMillis reads the snapshot and event formats', () => {
+  assert.equal(toMillis(1700000000000), 1700000000000);
+  assert.equal(toMillis('2023-11-14T22:13:20.000Z'), 1700000000000);
+  assert.equal(toMillis(new Date(1700000000000)), 1700000000000);
+  assert.equal(toMillis('not a date'), null);
+  assert.equal(toMillis(undefined), null);
+});
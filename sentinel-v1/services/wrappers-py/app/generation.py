@@ -0,0 +1,221 @@
+"""
+Micro-batching generation scheduler for the noise engine.
+
+generate_noisy_response hands each prompt to GenerationScheduler.submit()
+instead of calling the model itself. The scheduler
+
+    - coalesces identical prompts already queued or being generated
+      (single flight): every caller awaits the same result,
+    - collects queued prompts into micro-batches of up to
+      GENERATION_MAX_BATCH_SIZE, waiting at most GENERATION_MAX_WAIT_MS
+      after the first one for the batch to fill,
+    - runs at most GENERATION_MAX_CONCURRENCY batches at a time; prompts keep
+      queuing (and batches keep filling) while all slots are busy,
+    - rejects new prompts with GenerationQueueFull once
+      GENERATION_QUEUE_MAX prompts are waiting, which the endpoint turns
+      into a 503.
+
+Batches go to a GenerationBackend. Backends that block (a local model) set
+`blocking` and run in a worker thread; the canned response table does not.
+StubModelBackend stands in for a local CPU model: it answers from another
+backend after a batched forward-pass delay.
+"""
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+GENERATION_MAX_BATCH_SIZE = int(os.getenv("GENERATION_MAX_BATCH_SIZE", "16"))
+GENERATION_MAX_WAIT_MS = float(os.getenv("GENERATION_MAX_WAIT_MS", "2"))
+GENERATION_MAX_CONCURRENCY = int(os.getenv("GENERATION_MAX_CONCURRENCY", "2"))
+GENERATION_QUEUE_MAX = int(os.getenv("GENERATION_QUEUE_MAX", "1000"))
+# StubModelBackend cost: fixed per batch plus per prompt
+GENERATION_STUB_BATCH_MS = float(os.getenv("GENERATION_STUB_BATCH_MS", "20"))
+GENERATION_STUB_PROMPT_MS = float(os.getenv("GENERATION_STUB_PROMPT_MS", "2"))
+
+
+class GenerationQueueFull(Exception):
+    """GENERATION_QUEUE_MAX prompts are already waiting for a batch."""
+
+
+class GenerationBackend:
+    """Generates responses for a batch of prompts."""
+
+    name = "backend"
+    # Blocking backends are run in a worker thread
+    blocking = False
+
+    def generate_batch(self, prompts: list) -> list:
+        """
+        Returns:
+            list: One {"question", "clean_answer", "noisy_answer"} dict per
+            prompt, in order
+        """
+        raise NotImplementedError
+
+
+class StubModelBackend(GenerationBackend):
+    """
+    Local CPU model stand-in: answers like `inner` after sleeping for
+    batch_ms + prompt_ms per prompt, so batching pays off as with a model.
+    """
+
+    name = "stub"
+    blocking = True
+
+    def __init__(self, inner: GenerationBackend, batch_ms: float = GENERATION_STUB_BATCH_MS,
+                 prompt_ms: float = GENERATION_STUB_PROMPT_MS):
+        self.inner = inner
+        self.batch_ms = batch_ms
+        self.prompt_ms = prompt_ms
+
+    def generate_batch(self, prompts: list) -> list:
+        time.sleep((self.batch_ms + self.prompt_ms * len(prompts)) / 1000)
+        return self.inner.generate_batch(prompts)
+
+
+class GenerationScheduler:
+    """Single-flight micro-batcher in front of one backend, plus its batching task."""
+
+    def __init__(self, backend: GenerationBackend, max_batch_size: int = GENERATION_MAX_BATCH_SIZE,
+                 max_wait_ms: float = GENERATION_MAX_WAIT_MS, max_concurrency: int = GENERATION_MAX_CONCURRENCY,
+                 max_queue: int = GENERATION_QUEUE_MAX):
+        self.backend = backend
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+
+        # prompt -> future of its result, from submit() until its batch finishes
+        self._inflight = {}
+        # Prompts waiting for a batch, oldest first
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._slots = None
+        self._batches = set()
+        self._task = None
+        self._stopping = False
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.batch_count = 0
+        self.batched_prompts = 0
+        self.failed_batches = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Generate what is still queued, then stop the batching task."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+
+    async def submit(self, prompt: str) -> dict:
+        """
+        Response for prompt, generated in a batch.
+
+        Raises:
+            GenerationQueueFull: The queue is at GENERATION_QUEUE_MAX
+        """
+        self.submitted += 1
+        future = self._inflight.get(prompt)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            if len(self._pending) >= self.max_queue:
+                self.rejected += 1
+                raise GenerationQueueFull(f"{len(self._pending)} prompts waiting for generation")
+            if self._task is None:
+                self.start()
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[prompt] = future
+            self._pending.append(prompt)
+            self._wakeup.set()
+        # A caller going away must not cancel the result the others wait for
+        return dict(await asyncio.shield(future))
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend.name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queued": len(self._pending),
+            "running_batches": len(self._batches),
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "batches": self.batch_count,
+            "avg_batch_size": self.batched_prompts / self.batch_count if self.batch_count else 0.0,
+            "failed_batches": self.failed_batches,
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                if self._stopping:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Give the batch up to max_wait after its first prompt to fill
+            deadline = loop.time() + self.max_wait
+            while len(self._pending) < self.max_batch_size and not self._stopping:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            # Prompts queued while waiting for a slot join this batch
+            await self._slots.acquire()
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:len(batch)]
+            task = asyncio.create_task(self._generate(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _generate(self, batch: list) -> None:
+        try:
+            if self.backend.blocking:
+                results = await asyncio.to_thread(self.backend.generate_batch, batch)
+            else:
+                results = self.backend.generate_batch(batch)
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.backend.name} returned {len(results)} results for {len(batch)} prompts")
+        except Exception as e:
+            logger.exception("Generation batch of %d prompts failed", len(batch))
+            self.failed_batches += 1
+            results = None
+            error = e
+        finally:
+            self._slots.release()
+
+        self.batch_count += 1
+        self.batched_prompts += len(batch)
+        for position, prompt in enumerate(batch):
+            future = self._inflight.pop(prompt)
+            if future.done():
+                continue
+            if results is None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[position])
@@ -0,0 +1,269 @@
+"""
+Write-behind pipeline for query_logs inserts.
+
+get_noisy_response hands each log to QueryLogWriter.submit(), which appends
+it to an on-disk spool and an in-memory buffer and returns without a Mongo
+round trip. A background task flushes the buffer with insert_many (in a
+worker thread) whenever LOG_BATCH_SIZE logs are waiting or every
+LOG_FLUSH_INTERVAL_SECONDS.
+
+Durability: every log is written to the current spool segment before submit
+returns. A flush first rotates to a new segment; the old segments are deleted
+only after their logs are inserted. Segments left behind by a crash are
+replayed on the next start. Each log gets its `_id` before it is spooled, so
+a replayed log that had already been inserted is skipped as a duplicate key
+instead of being counted twice by the detector.
+
+`timestamp` records when the request arrived; a log can be inserted much
+later (batched, retried with backoff, replayed after a crash). Every insert
+attempt stamps `insertedAt`, which the detector's cursor follows so late
+logs are still scored.
+
+Backpressure: at most LOG_BUFFER_MAX logs are buffered or in flight. When
+Mongo is slow or down, submit() waits up to LOG_BUFFER_WAIT_SECONDS for room
+and then raises LogBufferFull, which the endpoint turns into a 503.
+
+One spool directory per wrappers process.
+"""
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from pathlib import Path
+
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv("LOG_FLUSH_INTERVAL_SECONDS", "0.2"))
+LOG_BUFFER_MAX = int(os.getenv("LOG_BUFFER_MAX", "10000"))
+LOG_BUFFER_WAIT_SECONDS = float(os.getenv("LOG_BUFFER_WAIT_SECONDS", "5"))
+LOG_RETRY_MAX_SECONDS = float(os.getenv("LOG_RETRY_MAX_SECONDS", "30"))
+# fsync every spooled log; survives power loss, not just a process crash
+LOG_SPOOL_FSYNC = os.getenv("LOG_SPOOL_FSYNC", "0").lower() in ("1", "true", "yes")
+DEFAULT_SPOOL_DIR = Path(__file__).resolve().parent.parent / "spool"
+LOG_SPOOL_DIR = Path(os.getenv("LOG_SPOOL_DIR", str(DEFAULT_SPOOL_DIR)))
+
+_SEGMENT_NAME = re.compile(r"^query_logs-(\d+)\.jsonl$")
+_DUPLICATE_KEY = 11000
+
+
+class LogBufferFull(Exception):
+    """The log buffer stayed full for LOG_BUFFER_WAIT_SECONDS."""
+
+
+class QueryLogWriter:
+    """Buffered, spooled writer for one collection, plus its flush task."""
+
+    def __init__(self, collection, spool_dir=LOG_SPOOL_DIR, batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL_SECONDS, max_buffer: int = LOG_BUFFER_MAX,
+                 max_wait: float = LOG_BUFFER_WAIT_SECONDS, fsync: bool = LOG_SPOOL_FSYNC):
+        self.collection = collection
+        self.spool_dir = Path(spool_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_wait = max_wait
+        self.fsync = fsync
+
+        # Logs accepted since the last rotation (all in the current segment)
+        self._buffer = []
+        # Logs of closed segments, being inserted (or retried)
+        self._unflushed = []
+        self._closed_segments = []
+        self._segment = None
+        self._segment_path = None
+        self._next_segment = 0
+
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._stopping = False
+        self._failures = 0
+
+        self.inserted_total = 0
+        self.duplicates_total = 0
+        self.replayed_total = 0
+        self.rejected_total = 0
+        self.failed_flushes_total = 0
+
+    @property
+    def pending(self) -> int:
+        """Logs accepted but not yet confirmed inserted."""
+        return len(self._buffer) + len(self._unflushed)
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "in_flight": len(self._unflushed),
+            "max_buffer": self.max_buffer,
+            "spool_segments": len(self._closed_segments) + (1 if self._segment is not None else 0),
+            "inserted_total": self.inserted_total,
+            "duplicates_total": self.duplicates_total,
+            "replayed_total": self.replayed_total,
+            "rejected_total": self.rejected_total,
+            "failed_flushes_total": self.failed_flushes_total,
+        }
+
+    def start(self) -> None:
+        """Replay spool segments left by a previous run and start the flush task."""
+        if self._task is not None:
+            return
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self._replay_spool()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush everything still buffered. Logs that cannot be inserted stay spooled."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        self._close_segment()
+        if self.pending:
+            logger.warning("%d query logs could not be written; kept in %s for the next start",
+                           self.pending, self.spool_dir)
+
+    async def submit(self, log: dict) -> None:
+        """
+        Accept one query_logs document for writing.
+
+        Raises:
+            LogBufferFull: no room freed up within max_wait
+        """
+        if self.pending >= self.max_buffer:
+            try:
+                await asyncio.wait_for(self._wait_for_space(), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                self.rejected_total += 1
+                raise LogBufferFull(f"{self.pending} query logs waiting to be written") from None
+
+        log.setdefault("_id", ObjectId())
+        self._spool(log)
+        self._buffer.append(log)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """
+        Insert everything accepted so far.
+
+        Returns:
+            int: Number of logs confirmed written (0 if the insert failed)
+        """
+        async with self._flush_lock:
+            if not self._unflushed and self._buffer:
+                self._close_segment()
+                self._unflushed, self._buffer = self._buffer, []
+            if not self._unflushed:
+                return 0
+
+            batch = self._unflushed
+            try:
+                inserted, duplicates = await asyncio.to_thread(self._insert, batch)
+            except PyMongoError as e:
+                self._failures += 1
+                self.failed_flushes_total += 1
+                logger.warning("Writing %d query logs failed (attempt %d): %s", len(batch), self._failures, e)
+                return 0
+
+            self._failures = 0
+            self.inserted_total += inserted
+            self.duplicates_total += duplicates
+            for path in self._closed_segments:
+                path.unlink(missing_ok=True)
+            self._closed_segments = []
+            self._unflushed = []
+            self._space.set()
+            return len(batch)
+
+    async def _wait_for_space(self) -> None:
+        while self.pending >= self.max_buffer:
+            self._space.clear()
+            await self._space.wait()
+
+    async def _run(self) -> None:
+        while True:
+            if self._failures:
+                delay = min(self.flush_interval * (2 ** self._failures), LOG_RETRY_MAX_SECONDS)
+            else:
+                delay = self.flush_interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+                if self._stopping:
+                    # One more pass for logs accepted while the last batch was inserted
+                    if self._failures == 0 and self.pending:
+                        await self.flush()
+                    return
+            except Exception:
+                logger.exception("Query log flush task error")
+                if self._stopping:
+                    return
+
+    def _insert(self, batch: list) -> tuple:
+        """insert_many in a worker thread. Returns (inserted, duplicates)."""
+        inserted_at = datetime.now(timezone.utc)
+        for log in batch:
+            log["insertedAt"] = inserted_at
+        try:
+            result = self.collection.insert_many(batch, ordered=False)
+            return len(result.inserted_ids), 0
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != _DUPLICATE_KEY for error in errors):
+                raise
+            # Replayed logs that had already been written before a crash
+            return e.details.get("nInserted", 0), len(errors)
+
+    def _spool(self, log: dict) -> None:
+        if self._segment is None:
+            self._segment_path = self.spool_dir / f"query_logs-{self._next_segment:08d}.jsonl"
+            self._next_segment += 1
+            self._segment = open(self._segment_path, "a", encoding="utf-8")
+        self._segment.write(json_util.dumps(log) + "\n")
+        self._segment.flush()
+        if self.fsync:
+            os.fsync(self._segment.fileno())
+
+    def _close_segment(self) -> None:
+        if self._segment is None:
+            return
+        self._segment.close()
+        self._closed_segments.append(self._segment_path)
+        self._segment = None
+        self._segment_path = None
+
+    def _replay_spool(self) -> None:
+        segments = sorted(
+            (int(match.group(1)), path)
+            for path in self.spool_dir.iterdir()
+            if (match := _SEGMENT_NAME.match(path.name))
+        )
+        for number, path in segments:
+            self._next_segment = max(self._next_segment, number + 1)
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._unflushed.append(json_util.loads(line))
+                    except ValueError:
+                        # A line cut short by the crash was never acknowledged
+                        logger.warning("Skipping truncated line in %s", path)
+            self._closed_segments.append(path)
+        if self._unflushed:
+            self.replayed_total += len(self._unflushed)
+            logger.warning("Replaying %d spooled query logs from %d segment(s)",
+                           len(self._unflushed), len(segments))
+            self._wakeup.set()
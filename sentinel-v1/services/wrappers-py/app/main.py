@@ -29,11 +29,31 @@ db = mongo_client[os.getenv("DB_NAME", "07")] # Use DB_NAME from .env
 query_logs_collection = db["query_logs"]
 print(f"Wrappers: Connected to MongoDB (DB: {os.getenv('DB_NAME', '07')})")
 
+try:
+    from .generation import GenerationQueueFull
+    from .log_writer import LogBufferFull, QueryLogWriter
+except ImportError:
+    from generation import GenerationQueueFull
+    from log_writer import LogBufferFull, QueryLogWriter
+
+# query_logs are written behind the request by a background flush task
+query_log_writer = QueryLogWriter(query_logs_collection)
+
 
 try:
     # This will now import the CodeLlama-based function
-    # Use simple relative import since we are running from this directory
-    from noise_engine import generate_noisy_response, load_paraphraser_model
+    try:
+        # uvicorn app.main:app (README, run-local.ps1)
+        from .noise_engine import (
+            generate_noisy_response, get_generation_stats, get_response_cache_stats, load_paraphraser_model,
+            stop_generation,
+        )
+    except ImportError:
+        # Running from this directory
+        from noise_engine import (
+            generate_noisy_response, get_generation_stats, get_response_cache_stats, load_paraphraser_model,
+            stop_generation,
+        )
 except ImportError as e:
     print(f"Import Error: {e}")
     # Fallback implementations
@@ -47,6 +67,15 @@ except ImportError as e:
         print("Using fallback model loader.")
         pass
 
+    def get_response_cache_stats():
+        return {}
+
+    def get_generation_stats():
+        return {}
+
+    async def stop_generation():
+        pass
+
 
 class PromptRequest(BaseModel):
     prompt: str
@@ -60,7 +89,7 @@ async def startup_event():
     print("\n" + "="*60)
     print("SENTINEL WRAPPERS SERVICE STARTED")
     print("="*60)
-    print(f"MongoDB connected: {MONGO_URI.split('@')[1].split('/')[0]}")
+    print(f"MongoDB connected: {MONGO_URI.split('://')[-1].split('@')[-1].split('/')[0]}")
     print(f"Database: {os.getenv('DB_NAME', '07')}")
     print("Loading noise engine (Local LLM)...")
     try:
@@ -68,11 +97,17 @@ async def startup_event():
         print("Noise engine ready (pointing to local LLM).")
     except Exception as e:
         print(f"Noise engine load failed: {e}")
+    query_log_writer.start()
+    print(f"Query log writer started (spool: {query_log_writer.spool_dir})")
     print("Service ready")
     print("="*60 + "\n")
 
 async def shutdown_event():
-    print("\n[SHUTDOWN] Closing MongoDB...")
+    print("\n[SHUTDOWN] Finishing queued generations...")
+    await stop_generation()
+    print("[SHUTDOWN] Flushing query logs...")
+    await query_log_writer.stop()
+    print("[SHUTDOWN] Closing MongoDB...")
     mongo_client.close()
     print("[SHUTDOWN] Done")
 
@@ -117,14 +152,23 @@ async def get_noisy_response(request: PromptRequest):
                 "noisy_answer_served": noisy,
                 "response_type_served": "NOISY"
             }
-            query_logs_collection.insert_one(log)
-            print("Logged to DB")
+            # Spooled and buffered; inserted in batches by query_log_writer
+            await query_log_writer.submit(log)
+            print("Queued for DB")
         
         print("="*60 + "\n")
 
         # Return the 'response' key as specified in blueprint and NoisyResponse model
         return NoisyResponse(response=noisy)
 
+    except GenerationQueueFull as e:
+        # The model is not keeping up; shed load before queuing unboundedly
+        print(f"ERROR: {e}")
+        raise HTTPException(status_code=503, detail="Generation queue full, retry later")
+    except LogBufferFull as e:
+        # Mongo is not keeping up; shed load rather than drop evidence
+        print(f"ERROR: {e}")
+        raise HTTPException(status_code=503, detail="Query log backlog full, retry later")
     except Exception as e:
         print(f"ERROR: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -134,5 +178,8 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "sentinel-wrappers",
-        "timestamp": datetime.now(dt.timezone.utc)
+        "timestamp": datetime.now(dt.timezone.utc),
+        "response_cache": get_response_cache_stats(),
+        "generation": get_generation_stats(),
+        "query_log_writer": query_log_writer.stats()
     }
\ No newline at end of file
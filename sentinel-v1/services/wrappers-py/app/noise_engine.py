@@ -1,13 +1,31 @@
+import importlib
+import logging
 import os
 import random
 from dotenv import load_dotenv
 from pathlib import Path
 
+try:
+    from .generation import GenerationBackend, GenerationScheduler, StubModelBackend
+    from .response_sources import KeywordResponseSource, ResponseCache, normalize_prompt
+except ImportError:
+    # main.py imports this module as top-level `noise_engine`
+    from generation import GenerationBackend, GenerationScheduler, StubModelBackend
+    from response_sources import KeywordResponseSource, ResponseCache, normalize_prompt
+
 # Define the path to the root .env file
 # This goes up 4 levels: app -> wrappers-py -> services -> sentinel-v1
 ENV_PATH = Path(__file__).resolve().parent.parent.parent.parent / '.env'
 load_dotenv(dotenv_path=ENV_PATH)
 
+logger = logging.getLogger(__name__)
+
+# Resolved responses are cached per normalized prompt (0 entries = no cache)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+# "canned" (the table below), "stub" (CPU model stand-in) or "package.module:factory"
+GENERATION_BACKEND = os.getenv("GENERATION_BACKEND", "canned")
+
 # HARDCODED DEMO RESPONSES - Add more as needed
 DEMO_RESPONSES = {
     "capital": {
@@ -57,41 +75,103 @@ DEMO_RESPONSES = {
     }
 }
 
+# Built by load_paraphraser_model(); consulted in order, first response wins
+response_sources = None
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_SECONDS)
+# Built by load_paraphraser_model(); batches prompts for the generation backend
+generation_scheduler = None
+
+# Cached marker for prompts that no source has a response for
+_NO_MATCH = object()
+
+
+def build_response_sources() -> list:
+    return [KeywordResponseSource(DEMO_RESPONSES)]
+
+
+def get_response_cache_stats() -> dict:
+    return response_cache.stats()
+
+
+def get_generation_stats() -> dict:
+    return generation_scheduler.stats() if generation_scheduler is not None else {}
+
+
 async def get_hardcoded_response(prompt: str) -> dict:
     """
     Returns hardcoded responses for demo purposes.
     Matches keywords in the prompt to return appropriate responses.
     """
-    print(f"... Using hardcoded demo responses (no LLM required)")
-    
-    prompt_lower = prompt.lower()
-    
-    # Check for keyword matches
-    for keyword, responses in DEMO_RESPONSES.items():
-        if keyword in prompt_lower:
-            print(f"... Matched keyword: '{keyword}'")
-            return {
-                "question": responses["question"],
-                "clean_answer": responses["clean"],
-                "noisy_answer": responses["noisy"]
-            }
-    
+    return resolve_hardcoded_response(prompt)
+
+
+def resolve_hardcoded_response(prompt: str) -> dict:
+    """get_hardcoded_response without the coroutine, for batch backends."""
+    global response_sources
+    if response_sources is None:
+        response_sources = build_response_sources()
+
+    key = normalize_prompt(prompt)
+    response = response_cache.get(key)
+    if response is None:
+        response = _NO_MATCH
+        for source in response_sources:
+            found = source.lookup(key)
+            if found is not None:
+                response = found
+                break
+        response_cache.put(key, response)
+
+    if response is not _NO_MATCH:
+        logger.debug("Matched canned response for prompt %r", prompt[:50])
+        return dict(response)
+
     # Default response if no keyword matches
-    print("... Using default response")
+    logger.debug("Using default response")
     return {
         "question": DEMO_RESPONSES["default"]["question"],
         "clean_answer": DEMO_RESPONSES["default"]["clean"] + f" (Query: {prompt[:50]}...)",
         "noisy_answer": DEMO_RESPONSES["default"]["noisy"] + f" You asked about: '{prompt[:80]}...'"
     }
 
+class CannedResponseBackend(GenerationBackend):
+    """The hardcoded demo table (and response cache) as a generation backend."""
+
+    name = "canned"
+
+    def generate_batch(self, prompts: list) -> list:
+        return [resolve_hardcoded_response(prompt) for prompt in prompts]
+
+
+def build_generation_backend(name: str = GENERATION_BACKEND) -> GenerationBackend:
+    """
+    Backend for GENERATION_BACKEND: "canned", "stub", or the import path of a
+    callable returning a GenerationBackend ("package.module:factory").
+    """
+    if name == "canned":
+        return CannedResponseBackend()
+    if name == "stub":
+        return StubModelBackend(CannedResponseBackend())
+    module_name, _, attribute = name.partition(":")
+    if not attribute:
+        raise ValueError(f"Unknown GENERATION_BACKEND {name!r}")
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
 async def generate_noisy_response(prompt: str, xai_api_key: str) -> dict:
     """
     Orchestrates the response generation.
     For demo purposes, this uses hardcoded responses.
     Returns only the noisy answer to the user.
-    """  
-    response_data = await get_hardcoded_response(prompt)
-    
+
+    Raises:
+        GenerationQueueFull: Too many prompts are waiting for the backend
+    """
+    global generation_scheduler
+    if generation_scheduler is None:
+        generation_scheduler = GenerationScheduler(build_generation_backend())
+    response_data = await generation_scheduler.submit(prompt)
+
     return {
         "question": response_data["question"],
         "clean_answer": response_data["clean_answer"],
@@ -100,7 +180,19 @@ async def generate_noisy_response(prompt: str, xai_api_key: str) -> dict:
 
 def load_paraphraser_model():
     """
-    Mock function for compatibility with main.py.
+    No model to load for the demo; builds the response sources' keyword
+    indexes and the generation backend once so requests never pay for it.
     """
-    print("Using hardcoded demo responses (no model loading required).")
-    pass
\ No newline at end of file
+    global response_sources, generation_scheduler
+    response_sources = build_response_sources()
+    response_cache.clear()
+    generation_scheduler = GenerationScheduler(build_generation_backend())
+    print(f"Using hardcoded demo responses (no model loading required). "
+          f"Sources: {', '.join(source.name for source in response_sources)}; "
+          f"generation backend: {generation_scheduler.backend.name}")
+
+
+async def stop_generation() -> None:
+    """Finish the prompts still queued for generation."""
+    if generation_scheduler is not None:
+        await generation_scheduler.stop()
\ No newline at end of file
@@ -0,0 +1,216 @@
+"""
+Response sources and response cache for the noise engine.
+
+A response source maps a prompt to a canned response. Sources are built once
+by load_paraphraser_model() and consulted in order; the first one that
+returns a response wins. KeywordResponseSource replaces the linear
+`keyword in prompt` scan over DEMO_RESPONSES with an Aho–Corasick automaton,
+so matching costs one pass over the prompt however many keywords the table
+grows to.
+
+ResponseCache keeps recently resolved prompts (bounded LRU with a TTL) so
+repeated prompts skip matching altogether.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Below this many keywords a plain `in` scan (done in C) beats the automaton
+# (done in Python), so the index falls back to it.
+MIN_KEYWORDS_FOR_AUTOMATON = 256
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Cache key and matching text for a prompt: lowercased, outer whitespace removed.
+
+    Keywords never start or end with whitespace, so stripping does not
+    change which keywords are contained in the prompt.
+    """
+    return prompt.lower().strip()
+
+
+class KeywordIndex:
+    """
+    Multi-pattern substring matcher over a fixed, ordered keyword list.
+
+    first_match() returns the earliest-listed keyword that occurs anywhere in
+    the text, i.e. exactly what
+        next((k for k in keywords if k in text), None)
+    returns, but in a single pass over the text.
+    """
+
+    __slots__ = ("keywords", "_goto", "_fail", "_best", "_linear")
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self._linear = len(self.keywords) < MIN_KEYWORDS_FOR_AUTOMATON
+        none = len(self.keywords)
+
+        # Trie of the keywords; _best[node] is the lowest keyword position
+        # ending at node or at any of its suffix (fail) links.
+        goto = [{}]
+        best = [none]
+        for position, keyword in enumerate(self.keywords):
+            node = 0
+            for char in keyword:
+                child = goto[node].get(char)
+                if child is None:
+                    child = len(goto)
+                    goto[node][char] = child
+                    goto.append({})
+                    best.append(none)
+                node = child
+            best[node] = min(best[node], position)
+
+        # Breadth-first, so a node's fail link is final before its children's
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for node in queue:
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                if node:
+                    fail[child] = goto[state].get(char, 0)
+                best[child] = min(best[child], best[fail[child]])
+
+        self._goto = goto
+        self._fail = fail
+        self._best = best
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def first_match(self, text: str):
+        """Earliest-listed keyword contained in text, or None."""
+        if self._linear:
+            for keyword in self.keywords:
+                if keyword in text:
+                    return keyword
+            return None
+
+        goto, fail, best = self._goto, self._fail, self._best
+        found = best[0]
+        node = 0
+        for char in text:
+            if found == 0:
+                break
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if best[node] < found:
+                found = best[node]
+        return self.keywords[found] if found < len(self.keywords) else None
+
+
+class ResponseSource:
+    """A source of canned responses, consulted by the noise engine."""
+
+    name = "source"
+
+    def lookup(self, normalized_prompt: str):
+        """
+        Returns:
+            dict: {"question", "clean_answer", "noisy_answer"}, or None if
+            this source has no response for the prompt
+        """
+        raise NotImplementedError
+
+
+class KeywordResponseSource(ResponseSource):
+    """
+    Responses selected by keyword, with the DEMO_RESPONSES table layout:
+        {keyword: {"question": ..., "clean": ..., "noisy": ...}}
+
+    When several keywords occur in a prompt, the one listed first in the
+    table wins, as with the original linear scan.
+    """
+
+    name = "keywords"
+
+    def __init__(self, responses: dict):
+        self.index = KeywordIndex(responses)
+        self.responses = {
+            keyword: {
+                "question": entry["question"],
+                "clean_answer": entry["clean"],
+                "noisy_answer": entry["noisy"],
+            }
+            for keyword, entry in responses.items()
+        }
+
+    def match(self, normalized_prompt: str):
+        """The matched keyword, or None."""
+        return self.index.first_match(normalized_prompt)
+
+    def lookup(self, normalized_prompt: str):
+        keyword = self.match(normalized_prompt)
+        return None if keyword is None else self.responses[keyword]
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache with a per-entry TTL, plus hit/miss statistics.
+
+    max_entries <= 0 disables caching (every get is a miss, put is a no-op).
+    Safe to share between threads: blocking generation backends resolve
+    prompts from several asyncio.to_thread workers at once.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, self.clock() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            entries = len(self._entries)
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,95 @@
+import asyncio
+from datetime import datetime, timezone
+
+import mongomock
+import pytest
+from pymongo.errors import AutoReconnect
+
+from app.log_writer import LogBufferFull, QueryLogWriter
+
+NOW = datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def make_log(i):
+    return {"userId": f"user-{i % 3}", "prompt": f"prompt {i}", "timestamp": NOW}
+
+
+@pytest.fixture
+def query_logs():
+    return mongomock.MongoClient().db.query_logs
+
+
+def test_spooled_logs_are_replayed_after_a_crash(query_logs, tmp_path):
+    async def crash():
+        writer = QueryLogWriter(query_logs, spool_dir=tmp_path, batch_size=100)
+        logs = [make_log(i) for i in range(5)]
+        for log in logs:
+            await writer.submit(log)
+        # The first two made it into Mongo before the process died
+        query_logs.insert_many([dict(log) for log in logs[:2]])
+        writer._segment.close()
+        return writer._segment_path
+
+    segment = asyncio.run(crash())
+    with open(segment, "a", encoding="utf-8") as f:
+        f.write('{"userId": "user-9", "prom')
+
+    async def restart():
+        writer = QueryLogWriter(query_logs, spool_dir=tmp_path, flush_interval=0.01)
+        writer.start()
+        await writer.stop()
+        return writer
+
+    writer = asyncio.run(restart())
+    assert writer.replayed_total == 5
+    assert writer.inserted_total == 3
+    assert writer.duplicates_total == 2
+    assert query_logs.count_documents({}) == 5
+    assert query_logs.count_documents({"insertedAt": {"$exists": True}}) == 3
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_full_buffer_pushes_back(query_logs, tmp_path):
+    async def run():
+        writer = QueryLogWriter(query_logs, spool_dir=tmp_path, batch_size=100, max_buffer=3, max_wait=0.05)
+        for i in range(3):
+            await writer.submit(make_log(i))
+        with pytest.raises(LogBufferFull):
+            await writer.submit(make_log(3))
+        assert writer.rejected_total == 1
+
+        # A submit waiting for room goes through once a flush frees it
+        writer.max_wait = 1.0
+        waiting = asyncio.create_task(writer.submit(make_log(4)))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        assert await writer.flush() == 3
+        await waiting
+        assert writer.pending == 1
+        return writer
+
+    asyncio.run(run())
+    assert query_logs.count_documents({}) == 3
+
+
+def test_failed_insert_keeps_the_logs_spooled(query_logs, tmp_path):
+    async def run():
+        writer = QueryLogWriter(query_logs, spool_dir=tmp_path, batch_size=100)
+        for i in range(4):
+            await writer.submit(make_log(i))
+        original = query_logs.insert_many
+
+        def unreachable(*args, **kwargs):
+            raise AutoReconnect("connection refused")
+        query_logs.insert_many = unreachable
+        assert await writer.flush() == 0
+        assert writer.pending == 4 and writer.failed_flushes_total == 1
+        assert len(list(tmp_path.iterdir())) == 1
+
+        query_logs.insert_many = original
+        assert await writer.flush() == 4
+        assert writer.pending == 0
+
+    asyncio.run(run())
+    assert query_logs.count_documents({}) == 4
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,50 @@
+import random
+import string
+
+from app.response_sources import MIN_KEYWORDS_FOR_AUTOMATON, KeywordIndex, KeywordResponseSource
+
+
+def linear_first_match(keywords, text):
+    return next((keyword for keyword in keywords if keyword in text), None)
+
+
+def random_keywords(rng, count):
+    """Short keywords over a small alphabet, so they overlap and nest a lot."""
+    keywords = {"password", "pass", "sword", "word", "sql injection", "injection", "capital"}
+    while len(keywords) < count:
+        keywords.add("".join(rng.choice("abcde ") for _ in range(rng.randint(1, 6))).strip() or "a")
+    keywords = sorted(keywords)
+    rng.shuffle(keywords)
+    return keywords
+
+
+def test_automaton_matches_the_linear_scan():
+    rng = random.Random(11)
+    keywords = random_keywords(rng, MIN_KEYWORDS_FOR_AUTOMATON + 100)
+    index = KeywordIndex(keywords)
+    assert not index._linear
+
+    texts = ["", "what is my password?", "how do i perform a sql injection attack", "zzzz"]
+    texts += ["".join(rng.choice("abcdefxyz ") for _ in range(rng.randint(0, 60))) for _ in range(2000)]
+    texts += ["".join(rng.choice(string.ascii_lowercase + " ") for _ in range(200)) for _ in range(200)]
+    for text in texts:
+        assert index.first_match(text) == linear_first_match(keywords, text), text
+
+
+def test_short_lists_use_the_linear_scan():
+    keywords = ["hack", "password", "sql injection", "default"]
+    index = KeywordIndex(keywords)
+    assert index._linear
+    assert index.first_match("can i hack your password") == "hack"
+    assert index.first_match("nothing here") is None
+
+
+def test_table_order_decides_between_keywords():
+    responses = {keyword: {"question": keyword, "clean": f"{keyword} clean", "noisy": f"{keyword} noisy"}
+                 for keyword in ["password", "hack"] + [f"filler {i}" for i in range(MIN_KEYWORDS_FOR_AUTOMATON)]}
+    source = KeywordResponseSource(responses)
+    assert not source.index._linear
+    assert source.lookup("how do i hack a password") == {
+        "question": "password", "clean_answer": "password clean", "noisy_answer": "password noisy",
+    }
+    assert source.lookup("hello") is None